@@ -0,0 +1,86 @@
+""" Benchmark of the per-query latency of the database, like the weather module looking up and storing coordinates.
+Compares the long-lived WAL connection on the database thread, with and without queueing writes, with opening a new
+connection for every query on the event loop, which modules did before.
+
+Run with: python -m benchmarks.bench_database
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from chaanbot.database import Database
+
+ROWS = 1000
+QUERIES = 1000
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS user_coordinates(ROOM_ID TEXT, USER_ID TEXT, LATITUDE TEXT, " \
+               "LONGITUDE TEXT, UNIQUE(ROOM_ID, USER_ID))"
+INSERT = "INSERT OR REPLACE INTO user_coordinates(ROOM_ID, USER_ID, LATITUDE, LONGITUDE) VALUES(?,?,?,?)"
+SELECT = "SELECT LATITUDE,LONGITUDE FROM user_coordinates WHERE ROOM_ID = ? AND USER_ID = ?"
+
+
+def new_connection_per_query(path, sql, parameters):
+    with closing(sqlite3.connect(path)) as conn:
+        result = conn.execute(sql, parameters).fetchone()
+        conn.commit()
+        return result
+
+
+def measure(function) -> float:
+    start = time.perf_counter()
+    for number in range(QUERIES):
+        function(number)
+    return (time.perf_counter() - start) / QUERIES
+
+
+async def measure_async(function) -> float:
+    start = time.perf_counter()
+    for number in range(QUERIES):
+        await function(number)
+    return (time.perf_counter() - start) / QUERIES
+
+
+async def measure_queued_writes(database) -> float:
+    """ Many rooms changing at once: all writes are queued and committed together """
+    start = time.perf_counter()
+    writes = [database.write(INSERT, ("!room", "@user{}".format(number), "5", "6")) for number in range(QUERIES)]
+    await asyncio.gather(*writes)
+    return (time.perf_counter() - start) / QUERIES
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        old_path, new_path = os.path.join(directory, "old.db"), os.path.join(directory, "new.db")
+        rows = [("!room", "@user{}".format(number), "1.0", "2.0") for number in range(ROWS)]
+        with closing(sqlite3.connect(old_path)) as conn:
+            conn.execute(CREATE_TABLE)
+            conn.executemany(INSERT, rows)
+            conn.commit()
+        database = Database(new_path)
+        database.run_blocking(lambda conn: conn.execute(CREATE_TABLE))
+        await database.executemany(INSERT, rows)
+
+        results = [
+            ("Select, new connection", measure(
+                lambda number: new_connection_per_query(old_path, SELECT, ("!room", "@user{}".format(number))))),
+            ("Select, database thread", await measure_async(
+                lambda number: database.fetchone(SELECT, ("!room", "@user{}".format(number))))),
+            ("Insert, new connection", measure(
+                lambda number: new_connection_per_query(old_path, INSERT,
+                                                        ("!room", "@user{}".format(number), "3", "4")))),
+            ("Insert, database thread", await measure_async(
+                lambda number: database.execute(INSERT, ("!room", "@user{}".format(number), "3", "4")))),
+            ("Insert, queued writes", await measure_queued_writes(database)),
+        ]
+        await database.close()
+
+    print("{} queries each on a table with {} rows".format(QUERIES, ROWS))
+    for name, seconds in results:
+        print("{:25} {:10.2f} us per query".format(name + ":", seconds * 1e6))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+""" Benchmark of looking up users in a room with 10 000 members, like highlighting a group does for each member.
+Compares the indexed Matrix.get_user with the linear scan it replaced.
+
+Run with: python -m benchmarks.bench_get_user
+"""
+import timeit
+from unittest.mock import Mock
+
+from nio import MatrixRoom
+
+from chaanbot.matrix import Matrix
+
+MEMBERS = 10000
+LOOKUPS = 1000
+
+
+def linear_get_user(room, user_id_or_display_name):
+    for user in room.users.values():
+        if (user_id_or_display_name.lower() == user.user_id.lower()) or (
+                user_id_or_display_name.lower() == user.display_name.lower()):
+            return user
+    return None
+
+
+def main():
+    room = MatrixRoom("!room:example.com", "@bot:example.com")
+    for number in range(MEMBERS):
+        room.add_member("@user{}:example.com".format(number), "User {}".format(number), None)
+    config = Mock()
+    config.get.return_value = None
+    matrix = Matrix(config, Mock())
+    names = ["user {}".format(number * (MEMBERS // LOOKUPS)) for number in range(LOOKUPS)]
+
+    build_seconds = timeit.timeit(lambda: matrix._get_user_index(room), number=1)
+    indexed_seconds = timeit.timeit(lambda: [matrix.get_user(room, name) for name in names], number=1)
+    linear_seconds = timeit.timeit(lambda: [linear_get_user(room, name) for name in names], number=1)
+
+    print("Room with {} members, {} lookups by display name".format(MEMBERS, LOOKUPS))
+    print("Building index:  {:10.3f} ms".format(build_seconds * 1000))
+    print("Indexed lookups: {:10.3f} ms ({:.2f} us per lookup)".format(indexed_seconds * 1000,
+                                                                       indexed_seconds / LOOKUPS * 1e6))
+    print("Linear lookups:  {:10.3f} ms ({:.2f} us per lookup)".format(linear_seconds * 1000,
+                                                                       linear_seconds / LOOKUPS * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+""" Benchmark of rewriting links in chat messages as the number of rewrite rules grows. Compares a module per rule,
+each searching the message for links and checking them like the revamp and rewrite_youtube_shorts modules did, with the
+rewrite_links module, where the links of a message are parsed once and rules are looked up by host and combined into
+one regex.
+
+Run with: python -m benchmarks.bench_rewrite_links
+"""
+import random
+import re
+import time
+
+from chaanbot import url_rewriter
+from chaanbot.parsed_message import ParsedMessage
+from chaanbot.url_rewriter import UrlRewriter
+
+MESSAGES = 5000
+RULE_COUNTS = [2, 10, 25, 50]
+REPEATS = 5
+
+WORDS = ("the a is it that what lol yeah no ok think this was just like have not but so when did you see "
+         "new update anyone going tonight game server build broken again works for me thanks").split()
+LINK_HOSTS = ["www.youtube.com", "youtube.com", "x.com", "twitter.com", "www.reddit.com", "news.com", "github.com",
+              "boards.4chan.org", "i.4cdn.org", "en.wikipedia.org", "example.org", "site7.com", "www.site23.com"]
+
+
+def create_rules(count):
+    """ The default rules, followed by rules for other hosts and a few for any host """
+    rules = dict(url_rewriter.DEFAULT_RULES)
+    for index in range(count - len(rules)):
+        if index % 10 == 9:
+            rules["any{}".format(index)] = r"* [?&]tracking{}=[^&#]* => ".format(index)
+        else:
+            rules["site{}".format(index)] = r"site{0}.com ^https://(www\.)?site{0}\.com/old/ => " \
+                                            r"https://site{0}.com/new/".format(index)
+    return [url_rewriter.parse_rule(name, rule) for name, rule in rules.items()]
+
+
+def create_messages(count):
+    """ Chat messages, most without links, some with one or two links of which some match a rule """
+    generator = random.Random(1)
+    messages = []
+    for _ in range(count):
+        words = generator.choices(WORDS, k=generator.randint(3, 25))
+        links = generator.choices(range(len(LINK_HOSTS)), k=generator.choice([0, 0, 0, 0, 0, 0, 1, 1, 2]))
+        for link in links:
+            host = LINK_HOSTS[link]
+            path = generator.choice(["/watch?v=dQw4w9WgXcQ", "/shorts/6j6ksOu1231", "/amp/story-123", "/old/page",
+                                     "/user/status/1445078208190291973", "/r/python/comments/abc/",
+                                     "/g/thread/123#p456"])
+            words.insert(generator.randint(0, len(words)), "https://{}{}".format(host, path))
+        messages.append(" ".join(words))
+    return messages
+
+
+class ModulePerRule:
+    """ Each rule searches the message for links on its own, like a module per rewrite """
+
+    url_regex = re.compile(r"https?://([^/\s]+)[^\s]*", re.IGNORECASE)
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def rewrite(self, message):
+        replies = []
+        for rule in self.rules:
+            hits = []
+            for match in self.url_regex.finditer(message):
+                host = match.group(1).lower()
+                if rule.host == "*" or host == rule.host or host.endswith("." + rule.host):
+                    rewritten = rule.pattern.sub(rule.replacement, match.group(0))
+                    if rewritten != match.group(0):
+                        hits.append(rewritten)
+            if hits:
+                replies.append(hits)
+        return replies
+
+
+def rewrite_links(rewriter):
+    return lambda message: rewriter.rewrite_all(ParsedMessage(message).urls)
+
+
+def measure(rewrite, messages) -> float:
+    """ Return the lowest CPU microseconds per message of the repeats """
+    timings = []
+    for _ in range(REPEATS):
+        start = time.process_time()
+        for message in messages:
+            rewrite(message)
+        timings.append((time.process_time() - start) / len(messages) * 1000000)
+    return min(timings)
+
+
+def main():
+    messages = create_messages(MESSAGES)
+    print("{} messages, {} with links".format(len(messages), sum("https://" in message for message in messages)))
+    print("{:>6} {:>18} {:>18}".format("Rules", "Module per rule", "rewrite_links"))
+    for rule_count in RULE_COUNTS:
+        rules = create_rules(rule_count)
+        module_per_rule = measure(ModulePerRule(rules).rewrite, messages)
+        combined = measure(rewrite_links(UrlRewriter(rules)), messages)
+        print("{:>6} {:>13.2f} µs {:>15.2f} µs".format(rule_count, module_per_rule, combined))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+""" Benchmark of extracting the text of a tweet from a Nitter page with a reply thread, like the Twitter module does
+for each link. Compares parsing the whole page with BeautifulSoup with reading it in chunks until the tweet body has
+been extracted.
+
+Run with: python -m benchmarks.bench_twitter_extraction
+"""
+import codecs
+import os
+import time
+import tracemalloc
+
+from chaanbot.html_extractor import ElementTextExtractor
+from chaanbot.modules.twitter import Twitter
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "nitter_tweet.html")
+EXTRACTIONS = 50
+CHUNK_SIZE = 16 * 1024
+
+
+def extract_with_beautiful_soup(page: bytes) -> str:
+    return Twitter._get_text_from_page(page)
+
+
+def extract_incrementally(page: bytes) -> str:
+    extractor = ElementTextExtractor("div", Twitter.tweet_body_classes)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for index in range(0, len(page), CHUNK_SIZE):
+        extractor.feed(decoder.decode(page[index:index + CHUNK_SIZE]))
+        if extractor.done:
+            break
+    return extractor.text
+
+
+def measure(extract, page: bytes) -> (float, int, str):
+    """ Return CPU seconds per extraction, peak memory of an extraction and the extracted text """
+    start = time.process_time()
+    for _ in range(EXTRACTIONS):
+        text = extract(page)
+    cpu_seconds = (time.process_time() - start) / EXTRACTIONS
+    tracemalloc.start()
+    extract(page)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return cpu_seconds, peak_bytes, text
+
+
+def main():
+    with open(FIXTURE, "rb") as fixture:
+        page = fixture.read()
+
+    print("Nitter page of {} kB, {} extractions each".format(len(page) // 1024, EXTRACTIONS))
+    for name, extract in [("BeautifulSoup", extract_with_beautiful_soup), ("Incremental", extract_incrementally)]:
+        cpu_seconds, peak_bytes, text = measure(extract, page)
+        print("{:15} {:8.3f} ms CPU, {:8.1f} kB peak memory: {!r}".format(name + ":", cpu_seconds * 1000,
+                                                                          peak_bytes / 1024, text))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import sys
 
-if sys.version_info < (3, 5):
-    print("Chaanbot requires at least Python 3.5.")
+if sys.version_info < (3, 7):
+    print("Chaanbot requires at least Python 3.7.")
     sys.exit(1)
 
-__version__ = "3.1.1"
+__version__ = "3.2.0"
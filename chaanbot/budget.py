@@ -0,0 +1,145 @@
+""" Keeps calls to external services within their rate limits and daily quotas """
+
+import asyncio
+import datetime
+import logging
+import time
+from typing import Dict, Optional
+
+from chaanbot import config_utility
+
+logger = logging.getLogger("budget")
+
+
+class BudgetExhaustedError(Exception):
+    """ Raised by modules when a call could not be made as the budget of the service is used up """
+
+
+class ServiceBudget:
+    """ Token bucket for the rate of calls to a service, and the number of calls made today for its daily quota """
+
+    def __init__(self, service, requests_per_minute, daily_quota, used_today, day, now):
+        self.service = service
+        self.capacity = max(1.0, float(requests_per_minute))
+        self.tokens_per_second = requests_per_minute / 60
+        self.tokens = self.capacity
+        self.daily_quota = daily_quota  # 0 means no daily quota
+        self.used_today = used_today
+        self.day = day
+        self.refilled_at = now
+
+    def refill(self, now, day):
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.tokens_per_second)
+        self.refilled_at = now
+        if day != self.day:
+            self.day, self.used_today = day, 0
+
+    def remaining_today(self) -> Optional[int]:
+        return max(0, self.daily_quota - self.used_today) if self.daily_quota else None
+
+
+class BudgetManager:
+    """ Shared by modules, which ask it before calling an external service. Calls made interactively, i.e. to answer
+    a user, have priority: background work such as prefetching may only use the share of the budget given by
+    [budget] background_share, the rest is kept for users. Calls made today are persisted, so restarting the bot does
+    not reset the daily quotas. The remaining budget of each service is logged every [budget] metrics_log_interval
+    seconds while it is used. """
+
+    INTERACTIVE, BACKGROUND = "interactive", "background"
+    DEFAULT_BACKGROUND_SHARE = 0.5
+    DEFAULT_METRICS_LOG_INTERVAL_SECONDS = 60 * 60
+
+    def __init__(self, config, database=None, clock=time.monotonic):
+        self.database = database
+        self.clock = clock
+        background_share = config_utility.get_float(config, "budget", "background_share",
+                                                    self.DEFAULT_BACKGROUND_SHARE)
+        self.background_share = min(1.0, max(0.0, background_share))
+        self.metrics_log_interval_seconds = config_utility.get_float(config, "budget", "metrics_log_interval",
+                                                                     self.DEFAULT_METRICS_LOG_INTERVAL_SECONDS)
+        self._metrics_task = None  # type: Optional[asyncio.Future]
+        self.services = {}  # type: Dict[str, ServiceBudget]
+        if database:
+            database.run_blocking(lambda conn: conn.execute('''CREATE TABLE IF NOT EXISTS service_budget_usage
+            (SERVICE TEXT NOT NULL,
+            DAY TEXT NOT NULL,
+            USED INTEGER NOT NULL,
+            PRIMARY KEY(SERVICE, DAY));
+            '''))
+
+    def start(self):
+        if not self._metrics_task and self.metrics_log_interval_seconds > 0:
+            self._metrics_task = asyncio.ensure_future(self._log_metrics_periodically())
+
+    async def stop(self):
+        if self._metrics_task:
+            self._metrics_task.cancel()
+            await asyncio.gather(self._metrics_task, return_exceptions=True)
+            self._metrics_task = None
+
+    def register(self, service, requests_per_minute, daily_quota=0):
+        """ Set the budget of a service. Called by modules when they are initialized """
+        day = self._get_day()
+        used_today = 0
+        if self.database:
+            result = self.database.run_blocking(lambda conn: conn.execute(
+                "SELECT USED FROM service_budget_usage WHERE SERVICE = ? AND DAY = ?", (service, day)).fetchone())
+            used_today = result[0] if result else 0
+        self.services[service] = ServiceBudget(service, requests_per_minute, daily_quota, used_today, day,
+                                               self.clock())
+        logger.debug("Budget of {}: {} requests per minute, daily quota {}, used today {}".format(
+            service, requests_per_minute, daily_quota or "none", used_today))
+
+    def try_acquire(self, service, priority=INTERACTIVE) -> bool:
+        """ Use one call from the budget of the service. Returns False if the budget does not allow the call """
+        budget = self.services.get(service)
+        if not budget:
+            return True
+        budget.refill(self.clock(), self._get_day())
+        share = 1.0 if priority == self.INTERACTIVE else self.background_share
+        # Background calls may not take the tokens or daily quota which is kept for interactive calls
+        if budget.tokens - budget.capacity * (1 - share) < 1:
+            logger.info("Rate limit of {} reached for {} calls".format(service, priority))
+            return False
+        if budget.daily_quota and budget.used_today >= budget.daily_quota * share:
+            logger.info("Daily quota of {} reached for {} calls".format(service, priority))
+            return False
+        budget.tokens -= 1
+        budget.used_today += 1
+        if budget.daily_quota and self.database:
+            self.database.write("INSERT OR REPLACE INTO service_budget_usage(SERVICE, DAY, USED) VALUES(?,?,?)",
+                                (service, budget.day, budget.used_today))
+        return True
+
+    def get_metrics(self) -> dict:
+        metrics = {}
+        for service, budget in self.services.items():
+            budget.refill(self.clock(), self._get_day())
+            metrics[service] = {
+                "tokens": int(budget.tokens),
+                "capacity": int(budget.capacity),
+                "used_today": budget.used_today,
+                "daily_quota": budget.daily_quota,
+                "remaining_today": budget.remaining_today(),
+            }
+        return metrics
+
+    def log_metrics(self):
+        for service, metrics in self.get_metrics().items():
+            logger.info("Budget of {}: {} of {} requests available this minute, {} used today, {} remaining".format(
+                service, metrics["tokens"], metrics["capacity"], metrics["used_today"],
+                "no quota" if metrics["remaining_today"] is None else metrics["remaining_today"]))
+
+    async def _log_metrics_periodically(self):
+        logged_usage = None
+        while True:
+            await asyncio.sleep(self.metrics_log_interval_seconds)
+            usage = {service: budget.used_today for service, budget in self.services.items()}
+            if usage != logged_usage:  # Only log while services are used, not when the bot is idle
+                self.log_metrics()
+                logged_usage = usage
+
+    @staticmethod
+    def _get_day() -> str:
+        """ Daily quotas of services are usually reset at midnight UTC """
+        return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
@@ -0,0 +1,79 @@
+""" Caches for modules, to avoid repeating slow or rate limited requests """
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+MISSING = object()  # Returned by TtlCache.get for keys without a value, as None may be a cached value
+
+
+class TtlCache:
+    """ Cache whose values expire after a time to live. When full, the least recently used value is removed.
+    Values may be given their own time to live, e.g. a shorter one for caching that something was not found. """
+
+    def __init__(self, max_size=1000, ttl_seconds=600.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits, self.misses = 0, 0
+        self._entries = OrderedDict()  # type: OrderedDict[Hashable, tuple] # key: (value, stored_at, expires_at)
+
+    def get(self, key, default=MISSING, max_age_seconds=None) -> Any:
+        """ Get a value which has not expired. If max_age_seconds is given, the value must also be at most that old """
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is None or entry[2] <= now or (max_age_seconds is not None and now - entry[1] > max_age_seconds):
+            if entry is not None and entry[2] <= now:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl_seconds=None):
+        now = self.clock()
+        self._entries[key] = (value, now, now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_age(self, key) -> Optional[float]:
+        """ Seconds since the value was set, or None if there is no value. Not counted as a hit or miss """
+        entry = self._entries.get(key)
+        now = self.clock()
+        return None if entry is None or entry[2] <= now else now - entry[1]
+
+    def pop(self, key, default=None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_metrics(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SingleFlight:
+    """ Lets concurrent calls for the same key share one call, e.g. one request for users asking at the same time """
+
+    def __init__(self):
+        self._calls = {}  # type: Dict[Hashable, asyncio.Future]
+
+    async def run(self, key, function: Callable[[], Awaitable[Any]]) -> Any:
+        """ Await function, or the call already running for the key """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(function())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(call)  # A caller being cancelled should not cancel the call for the others
+
+    def __len__(self):
+        return len(self._calls)
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
 import logging
+from functools import partial
 
-from nio import MatrixRoom, InviteMemberEvent, RoomMessage
+from nio import MatrixRoom, InviteMemberEvent, RoomMessage, SyncResponse, UploadFilterResponse
 
+from chaanbot import sync_filter
+from chaanbot.database import Database
+from chaanbot.event_queue import EventQueue
 from chaanbot.matrix import Matrix
 from chaanbot.module_runner import ModuleRunner
+from chaanbot.parsed_message import ParsedMessage
 
 logger = logging.getLogger("chaanbot")
 
@@ -13,13 +18,18 @@ logger = logging.getLogger("chaanbot")
 class Client:
     """ Main class for the bot. The client receives messages, joins rooms etc. """
 
+    SYNC_TOKEN_KEY = "next_batch"
+
     blacklisted_room_ids, whitelisted_room_ids, loaded_modules, allowed_inviters = [], [], [], []
+    sync_token, resumed_sync, sync_filter = None, False, None
 
-    def __init__(self, module_runner: ModuleRunner, config, matrix: Matrix):
+    def __init__(self, module_runner: ModuleRunner, config, matrix: Matrix, database: Database = None):
         try:
             self.module_runner = module_runner
             self.config = config
             self.matrix = matrix
+            self.database = database
+            self.event_queue = EventQueue(config, self._process_event)
 
             allowed_inviters = config.get("chaanbot", "allowed_inviters", fallback=None)
             if allowed_inviters:
@@ -35,11 +45,47 @@ class Client:
         await self._join_rooms(self.config)
         self.matrix.matrix_client.add_event_callback(self._on_invite, (InviteMemberEvent,))
         self.matrix.matrix_client.add_event_callback(self._on_room_event, (RoomMessage,))
+        self.matrix.matrix_client.add_response_callback(self._on_sync, (SyncResponse,))
+        self.sync_filter = await self._upload_sync_filter()
         logger.info("Listeners added, now running...")
-        await self._run_forever()
+        self.event_queue.start()
+        await self.module_runner.start()
+        try:
+            await self._run_forever()
+        finally:
+            await self.event_queue.stop()
+            await self.module_runner.stop()
 
     async def _run_forever(self):
-        await self.matrix.matrix_client.sync_forever(timeout=30000, full_state=True)
+        self.sync_token = await self.database.get_state(self.SYNC_TOKEN_KEY) if self.database else None
+        self.resumed_sync = bool(self.sync_token)
+        if self.resumed_sync:
+            logger.info("Resuming sync from stored sync token")
+        else:
+            logger.info("No stored sync token, syncing full state")
+        await self.matrix.matrix_client.sync_forever(timeout=30000, sync_filter=self.sync_filter,
+                                                     since=self.sync_token, full_state=not self.sync_token)
+
+    async def _upload_sync_filter(self):
+        """ Upload the sync filter and return its id. If the upload fails the filter is sent with each sync instead """
+        filter_to_upload = sync_filter.build(self.config, self.module_runner.get_event_types())
+        if not filter_to_upload:
+            logger.info("Sync filter turned off, all events will be synced")
+            return None
+        response = await self.matrix.matrix_client.upload_filter(**filter_to_upload)
+        if isinstance(response, UploadFilterResponse):
+            logger.debug("Uploaded sync filter with id {}".format(response.filter_id))
+            return response.filter_id
+        logger.warning("Could not upload sync filter: {}".format(response))
+        return filter_to_upload
+
+    async def _on_sync(self, response: SyncResponse):
+        """ Store the sync token once the events in the sync response have been processed, so they are not received
+        again after a restart. Events still queued when the bot stops are then received again instead of lost """
+        if self.database and response.next_batch != self.sync_token:
+            self.sync_token = response.next_batch
+            await self.event_queue.when_processed(partial(self.database.set_state, self.SYNC_TOKEN_KEY,
+                                                          response.next_batch))
 
     async def _join_rooms(self, config):
         if not self.matrix.matrix_client.rooms:
@@ -80,5 +126,12 @@ class Client:
             return
         if event.source["content"]["msgtype"] != "m.text":
             return
-        message = event.source["content"]["body"].strip()
+        message = ParsedMessage(event.source["content"]["body"].strip())
+        self.event_queue.put(room, event, message)  # Processed by event workers, so syncing is not held up
+
+    async def _process_event(self, event: RoomMessage, room: MatrixRoom, message):
+        if self.resumed_sync and not room.members_synced:
+            # State is not fully synced when resuming from a sync token, get the members when they are first needed
+            logger.debug("Getting members of {}".format(room.room_id))
+            await self.matrix.matrix_client.joined_members(room.room_id)
         await self.module_runner.run(event, room, message)
@@ -2,6 +2,8 @@
 
 import logging
 
+from chaanbot.parsed_message import parse
+
 logger = logging.getLogger("command_utility")
 
 
@@ -11,37 +13,35 @@ def matches(command_dict_or_operation, message) -> bool:
 
     if "commands" in command_dict_or_operation:  # If operation was passed in then dict should have "commands" key
         operation = command_dict_or_operation
-        return _operation_matches_message(operation, message)
+        return _operation_matches_message(operation, parse(message))
     else:
+        parsed_message = parse(message)
         for operation, value in command_dict_or_operation.items():
-            if _operation_matches_message(value, message):
+            if _operation_matches_message(value, parsed_message):
                 return True
     return False
 
 
 def _operation_matches_message(operation, message) -> bool:
     for command in operation["commands"]:
-        if command and command.lower() == get_command(message).lower():
+        if command and command.lower() == message.command_token:
             has_argument_regex = "argument_regex" in operation
-            if not has_argument_regex and not get_argument(message):
+            if not has_argument_regex and not message.argument:
                 return True
-            if operation["argument_regex"].search(get_argument(message)):
+            if operation["argument_regex"].search(message.argument):
                 logger.debug("Message matches command dict and argument regex")
                 return True
     return False
 
 
 def get_command(message) -> str:
-    return get_command_and_argument(message)[0]
+    return parse(message).command
 
 
 def get_argument(message) -> str:
     """Get the argument to a message. A message looks like: [command] [argument].
     E.g. the argument to "!hl test" would be "test"."""
-    try:
-        return get_command_and_argument(message)[1]
-    except IndexError:
-        return ""
+    return parse(message).argument
 
 
 def get_command_and_argument(message) -> (str, str):
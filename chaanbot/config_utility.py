@@ -0,0 +1,36 @@
+""" Help methods for reading values from the config file """
+
+import logging
+
+logger = logging.getLogger("config_utility")
+
+
+def get_int(config, section, option, default) -> int:
+    return _get_number(config, section, option, default, int)
+
+
+def get_float(config, section, option, default) -> float:
+    return _get_number(config, section, option, default, float)
+
+
+def get_bool(config, section, option, default) -> bool:
+    value = config.get(section, option, fallback=None)
+    if not isinstance(value, str) or not value.strip():
+        return default
+    if value.strip().lower() in ("true", "yes", "on", "1"):
+        return True
+    if value.strip().lower() in ("false", "no", "off", "0"):
+        return False
+    logger.warning("Invalid value for {} in [{}]: {}, using {}".format(option, section, value, default))
+    return default
+
+
+def _get_number(config, section, option, default, number_type):
+    value = config.get(section, option, fallback=None)
+    if value is None or value == "":
+        return default
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        logger.warning("Invalid value for {} in [{}]: {}, using {}".format(option, section, value, default))
+        return default
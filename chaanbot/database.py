@@ -1,11 +1,186 @@
+import asyncio
+import logging
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Any, Iterable, List, Tuple
+
+from chaanbot import config_utility
+
+logger = logging.getLogger("database")
 
 
 class Database:
-    """ Responsible for the database """
+    """ Responsible for the database. Owns one long-lived connection which is only used from a dedicated thread,
+    so modules can await queries without blocking the event loop.
+    Writes may be queued with write/writemany, they are then committed together in one transaction. """
+
+    CACHE_SIZE_KIB = 8 * 1024
+    CACHED_STATEMENTS = 256
+    DEFAULT_FLUSH_INTERVAL_MS = 100
+    DEFAULT_FLUSH_MAX_OPERATIONS = 100
 
-    def __init__(self, sqlite_database_path):
+    def __init__(self, sqlite_database_path, config=None):
         self.sqlite_database_path = sqlite_database_path
+        if config:
+            self.flush_interval_ms = config_utility.get_float(config, "chaanbot", "database_flush_interval_ms",
+                                                              self.DEFAULT_FLUSH_INTERVAL_MS)
+            self.flush_max_operations = config_utility.get_int(config, "chaanbot", "database_flush_max_operations",
+                                                               self.DEFAULT_FLUSH_MAX_OPERATIONS)
+        else:
+            self.flush_interval_ms = self.DEFAULT_FLUSH_INTERVAL_MS
+            self.flush_max_operations = self.DEFAULT_FLUSH_MAX_OPERATIONS
+        self._connection = None  # type: Optional[sqlite3.Connection]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._pending_writes = []  # type: List[Tuple[str, Any, bool, asyncio.Future]]
+        self._flush_handle = None  # type: Optional[asyncio.TimerHandle]
+        self._closed = False
 
     def connect(self):
+        """ Open a new, separate connection. Prefer the methods below, which use the long-lived connection """
         return sqlite3.connect(self.sqlite_database_path)
+
+    def write(self, sql, parameters=()) -> asyncio.Future:
+        """ Queue a statement to be committed together with other queued writes, within flush_interval_ms.
+        Returns a future with the id of the last inserted row. It does not need to be awaited: failures are logged,
+        and queries made after queueing the write will see it. """
+        return self._queue_write(sql, parameters, False)
+
+    def writemany(self, sql, seq_of_parameters: Iterable) -> asyncio.Future:
+        """ Queue a statement for each set of parameters, see write """
+        return self._queue_write(sql, list(seq_of_parameters), True)
+
+    async def flush(self):
+        """ Commit all queued writes now """
+        flushed = self._flush_pending_writes()
+        if flushed:
+            await flushed
+
+    async def execute(self, sql, parameters=()) -> int:
+        """ Execute a statement in its own transaction and return the id of the last inserted row """
+        return await self.run(lambda conn: conn.execute(sql, parameters).lastrowid)
+
+    async def executemany(self, sql, seq_of_parameters: Iterable):
+        """ Execute a statement for each set of parameters, all in one transaction """
+        await self.run(lambda conn: conn.executemany(sql, seq_of_parameters))
+
+    async def fetchone(self, sql, parameters=()) -> Optional[tuple]:
+        return await self.run(lambda conn: conn.execute(sql, parameters).fetchone())
+
+    async def fetchall(self, sql, parameters=()) -> list:
+        return await self.run(lambda conn: conn.execute(sql, parameters).fetchall())
+
+    async def run(self, function: Callable[[sqlite3.Connection], Any]) -> Any:
+        """ Run function with the connection in a transaction on the database thread, and return its result """
+        self._flush_pending_writes()  # The database thread runs one function at a time, so they are written first
+        return await asyncio.get_event_loop().run_in_executor(self._executor, self._run_in_transaction, function)
+
+    def run_blocking(self, function: Callable[[sqlite3.Connection], Any]) -> Any:
+        """ Like run, but waits for the result. Only meant for initialization, e.g. creating tables """
+        self._flush_pending_writes()
+        return self._executor.submit(self._run_in_transaction, function).result()
+
+    async def get_state(self, key) -> Optional[str]:
+        """ Get a value stored by the bot itself, e.g. the sync token """
+        result = await self.run(lambda conn: conn.execute("SELECT VALUE FROM chaanbot_state WHERE KEY = ?",
+                                                          (key,)).fetchone())
+        return result[0] if result else None
+
+    async def set_state(self, key, value):
+        """ Queue storing a value, see write """
+        self.write("INSERT OR REPLACE INTO chaanbot_state(KEY, VALUE) VALUES(?,?)", (key, value))
+
+    async def close(self):
+        """ Commit queued writes and close the connection """
+        if self._closed:
+            return
+        self._closed = True
+        await self.flush()
+        await asyncio.get_event_loop().run_in_executor(self._executor, self._close_connection)
+        self._executor.shutdown()
+
+    def _queue_write(self, sql, parameters, many: bool) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(self._log_failed_write)
+        self._pending_writes.append((sql, parameters, many, future))
+        if len(self._pending_writes) >= self.flush_max_operations:
+            self._flush_pending_writes()
+        elif not self._flush_handle:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.flush_interval_ms / 1000,
+                                                                     self._flush_pending_writes)
+        return future
+
+    def _flush_pending_writes(self) -> Optional[asyncio.Future]:
+        """ Hand the queued writes over to the database thread, which commits them in one transaction """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending_writes:
+            return None
+        writes, self._pending_writes = self._pending_writes, []
+        logger.debug("Writing {} queued writes to database".format(len(writes)))
+        flushed = asyncio.get_event_loop().run_in_executor(self._executor, self._run_in_transaction,
+                                                           lambda conn: self._write(conn, writes))
+        flushed.add_done_callback(lambda flushed_future: self._set_write_results(writes, flushed_future))
+        return flushed
+
+    @staticmethod
+    def _write(conn, writes) -> list:
+        """ Run each write in its own savepoint, so a failing write does not undo the others in the transaction """
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        results = []
+        for sql, parameters, many, _ in writes:
+            conn.execute("SAVEPOINT queued_write")
+            try:
+                cursor = conn.executemany(sql, parameters) if many else conn.execute(sql, parameters)
+                results.append(cursor.lastrowid)
+            except sqlite3.Error as error:
+                conn.execute("ROLLBACK TO queued_write")
+                results.append(error)
+            conn.execute("RELEASE queued_write")
+        return results
+
+    @staticmethod
+    def _set_write_results(writes, flushed: asyncio.Future):
+        if flushed.cancelled():
+            results = asyncio.CancelledError()
+        else:
+            results = flushed.exception() or flushed.result()
+        for index, (_, _, _, future) in enumerate(writes):
+            result = results if isinstance(results, BaseException) else results[index]
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    def _log_failed_write(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.error("Failed to write to database: {}".format(future.exception()))
+
+    def _run_in_transaction(self, function):
+        connection = self._get_connection()
+        with connection:  # Commits, or rolls back if function raises
+            return function(connection)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if not self._connection:
+            logger.debug("Connecting to database at {}".format(self.sqlite_database_path))
+            self._connection = sqlite3.connect(self.sqlite_database_path, check_same_thread=False,
+                                               cached_statements=self.CACHED_STATEMENTS)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, only syncs on checkpoints
+            self._connection.execute("PRAGMA cache_size=-{}".format(self.CACHE_SIZE_KIB))
+            self._connection.execute("PRAGMA temp_store=MEMORY")
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS chaanbot_state
+            (KEY TEXT PRIMARY KEY NOT NULL,
+            VALUE TEXT);
+            ''')
+        return self._connection
+
+    def _close_connection(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,164 @@
+import asyncio
+import inspect
+import logging
+from collections import deque, OrderedDict
+from typing import Dict, Deque, Tuple, Any, Callable, Optional
+
+from nio import MatrixRoom, RoomMessage
+
+from chaanbot import config_utility
+
+logger = logging.getLogger("event_queue")
+
+
+class EventQueue:
+    """ Bounded queue between receiving room events and running modules on them.
+    Events are processed by a pool of workers, events in the same room are always processed in the order received.
+    Callbacks may be registered with when_processed, e.g. to store the sync token once the events of a sync have been
+    processed. Queue depth and dropped events are logged every metrics_log_interval seconds while events arrive. """
+
+    DEFAULT_WORKERS = 4
+    DEFAULT_MAX_SIZE = 1000
+    DEFAULT_METRICS_LOG_INTERVAL_SECONDS = 300
+    DROP_OLDEST, REJECT = "drop_oldest", "reject"
+
+    def __init__(self, config, handler):
+        self.handler = handler
+        self.number_of_workers = max(1, config_utility.get_int(config, "chaanbot", "event_workers",
+                                                               self.DEFAULT_WORKERS))
+        self.max_size = max(1, config_utility.get_int(config, "chaanbot", "event_queue_size", self.DEFAULT_MAX_SIZE))
+        overflow_policy = config.get("chaanbot", "event_queue_overflow", fallback=None)
+        if overflow_policy in (self.DROP_OLDEST, self.REJECT):
+            self.overflow_policy = overflow_policy
+        else:
+            if overflow_policy:
+                logger.warning("Unknown event queue overflow policy: {}, using {}".format(overflow_policy,
+                                                                                         self.DROP_OLDEST))
+            self.overflow_policy = self.DROP_OLDEST
+        self.metrics_log_interval_seconds = config_utility.get_float(config, "chaanbot",
+                                                                     "event_queue_metrics_log_interval",
+                                                                     self.DEFAULT_METRICS_LOG_INTERVAL_SECONDS)
+
+        self.size, self.max_size_reached, self.processed, self.dropped, self.rejected = 0, 0, 0, 0, 0
+        self._room_queues = {}  # type: Dict[str, Deque[Tuple[int, Tuple[Any, Any, Any]]]]
+        self._queued_room_ids = OrderedDict()  # type: OrderedDict[int, str] # Room of each queued event, oldest first
+        self._scheduled_room_ids = set()  # Rooms waiting in _ready_room_ids or being processed by a worker
+        self._ready_room_ids = asyncio.Queue()
+        self._next_sequence = 0
+        self._pending_sequences = {}  # type: Dict[int, None] # Queued or processing events, oldest first
+        self._processed_callbacks = deque()  # type: Deque[Tuple[int, Callable]] # (Sequence of next event, callback)
+        self._processed_callbacks_lock = asyncio.Lock()  # Keeps callbacks in order when several workers finish
+        self._workers = []
+        self._metrics_task = None  # type: Optional[asyncio.Future]
+
+    def start(self):
+        if not self._workers:
+            logger.info("Starting {} event workers".format(self.number_of_workers))
+            self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.number_of_workers)]
+        if not self._metrics_task and self.metrics_log_interval_seconds > 0:
+            self._metrics_task = asyncio.ensure_future(self._log_metrics_periodically())
+
+    async def stop(self):
+        tasks = self._workers + ([self._metrics_task] if self._metrics_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._metrics_task = [], None
+
+    def put(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
+        """ Queue an event for processing. Returns False if the event was rejected because the queue is full """
+        if self.size >= self.max_size:
+            if self.overflow_policy == self.REJECT:
+                self.rejected += 1
+                logger.warning("Event queue is full ({} events), rejecting event in {}".format(self.size,
+                                                                                               room.room_id))
+                return False
+            self._drop_oldest()
+
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._pending_sequences[sequence] = None
+        self._queued_room_ids[sequence] = room.room_id
+        room_queue = self._room_queues.setdefault(room.room_id, deque())
+        room_queue.append((sequence, (room, event, message)))
+        self.size += 1
+        self.max_size_reached = max(self.max_size_reached, self.size)
+        if room.room_id not in self._scheduled_room_ids:
+            self._scheduled_room_ids.add(room.room_id)
+            self._ready_room_ids.put_nowait(room.room_id)
+        logger.debug("Queued event in {}, queue depth is {}".format(room.room_id, self.size))
+        return True
+
+    async def when_processed(self, callback: Callable):
+        """ Call callback once every event queued so far has been processed or dropped, or now if there are none.
+        Callbacks are called in the order they were registered, and may be coroutine functions """
+        self._processed_callbacks.append((self._next_sequence, callback))
+        await self._call_processed_callbacks()
+
+    def get_metrics(self) -> dict:
+        return {
+            "depth": self.size,
+            "max_depth_reached": self.max_size_reached,
+            "rooms_with_events": len(self._room_queues),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    def log_metrics(self):
+        metrics = self.get_metrics()
+        logger.info("Event queue depth is {depth} (at most {max_depth_reached}), {processed} events processed, "
+                    "{dropped} dropped and {rejected} rejected".format(**metrics))
+
+    async def _log_metrics_periodically(self):
+        logged_metrics = None
+        while True:
+            await asyncio.sleep(self.metrics_log_interval_seconds)
+            metrics = self.get_metrics()
+            if metrics != logged_metrics:  # Only log while events arrive, not when the bot is idle
+                self.log_metrics()
+                logged_metrics = metrics
+
+    def _drop_oldest(self):
+        """ The oldest queued event is the first in the room of the oldest entry of _queued_room_ids, as events are
+        queued in order in each room """
+        sequence, room_id = self._queued_room_ids.popitem(last=False)
+        self._room_queues[room_id].popleft()
+        self._pending_sequences.pop(sequence, None)
+        self.size -= 1
+        self.dropped += 1
+        logger.warning("Event queue is full, dropped oldest event in {}".format(room_id))
+
+    async def _work(self):
+        while True:
+            room_id = await self._ready_room_ids.get()
+            room_queue = self._room_queues.get(room_id)
+            if room_queue:
+                sequence, (room, event, message) = room_queue.popleft()
+                self._queued_room_ids.pop(sequence, None)
+                self.size -= 1
+                try:
+                    await self.handler(event, room, message)
+                except Exception as exception:
+                    logger.exception("Failed to process event in {}: {}".format(room_id, str(exception)))
+                self.processed += 1
+                self._pending_sequences.pop(sequence, None)
+                await self._call_processed_callbacks()
+
+            if room_queue:
+                self._ready_room_ids.put_nowait(room_id)  # Let other rooms be processed before the next event
+            else:
+                self._room_queues.pop(room_id, None)
+                self._scheduled_room_ids.discard(room_id)
+
+    async def _call_processed_callbacks(self):
+        async with self._processed_callbacks_lock:
+            oldest_pending_sequence = next(iter(self._pending_sequences), self._next_sequence)
+            while self._processed_callbacks and self._processed_callbacks[0][0] <= oldest_pending_sequence:
+                _, callback = self._processed_callbacks.popleft()
+                try:
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as exception:
+                    logger.exception("Failed to run callback for processed events: {}".format(str(exception)))
@@ -0,0 +1,54 @@
+""" Serves saved files over HTTP, so small deployments do not need a separate web server """
+
+import logging
+import os
+import re
+from typing import Callable, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("file_server")
+
+
+class FileServer:
+    """ Serves the files in a directory at path_prefix. Files are sent with sendfile where the OS supports it, so their
+    content is not copied through Python. Range and conditional requests (ETag, If-Modified-Since) are handled by
+    aiohttp. Only files named by a hash are served, and as those never change clients may cache them forever. """
+
+    filename_regex = re.compile(r"^[0-9a-f]{40,64}\.[0-9a-z]{1,5}$")  # Not e.g. .part files or the database
+    cache_control = "public, max-age=31536000, immutable"
+
+    def __init__(self, directory, host, port, path_prefix="/", on_file_access: Optional[Callable[[str], None]] = None):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.path_prefix = path_prefix if path_prefix.endswith("/") else path_prefix + "/"
+        self.on_file_access = on_file_access  # Called with the filename each time a file is served
+        self._runner = None  # type: Optional[web.AppRunner]
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get(self.path_prefix + "{filename}", self._serve_file)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Serving files in {} at http://{}:{}{}".format(self.directory, self.host, self.port,
+                                                                   self.path_prefix))
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _serve_file(self, request: web.Request) -> web.StreamResponse:
+        filename = request.match_info["filename"]
+        filepath = os.path.join(self.directory, filename)
+        if not self.filename_regex.match(filename) or not os.path.isfile(filepath):
+            raise web.HTTPNotFound()
+        if self.on_file_access:
+            self.on_file_access(filename)
+        return web.FileResponse(filepath, headers={"Cache-Control": self.cache_control,
+                                                   "X-Content-Type-Options": "nosniff"})
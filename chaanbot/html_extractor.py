@@ -0,0 +1,54 @@
+""" Extracts the text of an element from html as it is received, without parsing the whole page """
+
+from html.parser import HTMLParser
+from typing import Iterable, List
+
+# Elements which have no end tag
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source",
+                 "track", "wbr"}
+
+
+class ElementTextExtractor(HTMLParser):
+    """ Collects the text of the first element with the tag and classes. Feed it html until done is True, at which
+    point the element has been closed and the rest of the page does not need to be read. """
+
+    def __init__(self, tag, classes: Iterable[str]):
+        super().__init__(convert_charrefs=True)
+        self.tag = tag
+        self.classes = set(classes)
+        self.found = False
+        self.done = False
+        self._depth = 0  # Open elements inside the element
+        self._texts = []  # type: List[str]
+
+    @property
+    def text(self) -> str:
+        return "".join(self._texts)
+
+    def feed(self, data):
+        if not self.done:
+            super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.found:
+            if tag not in VOID_ELEMENTS:
+                self._depth += 1
+        elif tag == self.tag and self.classes <= set((dict(attrs).get("class") or "").split()):
+            self.found = True
+
+    def handle_startendtag(self, tag, attrs):
+        pass  # Self-closing elements, e.g. <br/>, have no text
+
+    def handle_endtag(self, tag):
+        if not self.found or self.done:
+            return
+        if self._depth == 0:
+            self.done = tag == self.tag  # Ignore stray end tags
+        elif tag not in VOID_ELEMENTS:
+            self._depth -= 1
+
+    def handle_data(self, data):
+        if self.found and not self.done:
+            self._texts.append(data)
@@ -0,0 +1,113 @@
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator
+
+import aiohttp
+import requests
+
+from chaanbot import config_utility
+
+logger = logging.getLogger("http_client")
+
+
+class HttpResponse:
+    """ A response with its content fully read """
+
+    def __init__(self, url, status_code, headers, content: bytes):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class StreamedHttpResponse:
+    """ A response whose content is read in chunks, e.g. to stop reading once the needed part has been read """
+
+    DEFAULT_CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, url, status_code, headers, content: aiohttp.StreamReader):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self._content = content
+
+    async def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        async for chunk in self._content.iter_chunked(chunk_size):
+            yield chunk
+
+
+class HttpClient:
+    """ Asynchronous http client shared by all modules. Connections are pooled per host and kept alive between
+    requests, so modules should await it instead of making blocking requests. """
+
+    DEFAULT_CONNECT_TIMEOUT_SECONDS = 10
+    DEFAULT_READ_TIMEOUT_SECONDS = 30
+    DEFAULT_MAX_CONNECTIONS = 100
+    DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+    DEFAULT_KEEPALIVE_SECONDS = 30
+
+    def __init__(self, config):
+        self.connect_timeout_seconds = config_utility.get_float(config, "http", "connect_timeout",
+                                                                self.DEFAULT_CONNECT_TIMEOUT_SECONDS)
+        self.read_timeout_seconds = config_utility.get_float(config, "http", "read_timeout",
+                                                             self.DEFAULT_READ_TIMEOUT_SECONDS)
+        self.max_connections = config_utility.get_int(config, "http", "max_connections",
+                                                      self.DEFAULT_MAX_CONNECTIONS)
+        self.max_connections_per_host = config_utility.get_int(config, "http", "max_connections_per_host",
+                                                               self.DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        self.keepalive_seconds = config_utility.get_float(config, "http", "keepalive",
+                                                          self.DEFAULT_KEEPALIVE_SECONDS)
+        self._session = None  # type: Optional[aiohttp.ClientSession]
+
+    async def get(self, url, headers=None, params=None, allow_redirects=True) -> HttpResponse:
+        async with self._get_session().get(url, headers=headers, params=params,
+                                           allow_redirects=allow_redirects) as response:
+            content = await response.read()
+            return HttpResponse(str(response.url), response.status, response.headers, content)
+
+    @asynccontextmanager
+    async def stream(self, url, headers=None, params=None,
+                     allow_redirects=True) -> AsyncIterator[StreamedHttpResponse]:
+        """ Get a response without reading its content. Use as "async with http_client.stream(url) as response:".
+        Content not read when leaving the block is discarded. """
+        async with self._get_session().get(url, headers=headers, params=params,
+                                           allow_redirects=allow_redirects) as response:
+            yield StreamedHttpResponse(str(response.url), response.status, response.headers, response.content)
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """ Create the session on first use, as it has to be created while the event loop is running """
+        if not self._session or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections_per_host,
+                                             keepalive_timeout=self.keepalive_seconds)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout_seconds,
+                                            sock_read=self.read_timeout_seconds)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+
+class BlockingRequests:
+    """ Compatibility shim for modules whose __init__ still takes the requests library as its last argument.
+    Calls are passed on to requests, which blocks the event loop while waiting, so modules should move to HttpClient.
+    """
+
+    _warned = False
+
+    def __getattr__(self, name):
+        if not BlockingRequests._warned:
+            BlockingRequests._warned = True
+            logger.warning("A module is using the blocking requests library, which halts the bot during requests. "
+                           "Modules should use the asynchronous http client instead")
+        return getattr(requests, name)
@@ -1,16 +1,95 @@
 import logging
-from typing import Optional, Dict
+import time
+from typing import Optional, Dict, Set, List
 
-from nio import MatrixRoom, AsyncClient, MatrixUser
+from nio import MatrixRoom, AsyncClient, MatrixUser, RoomMemberEvent, RoomNameEvent, RoomAliasEvent, \
+    RoomResolveAliasResponse, SyncResponse
 
 logger = logging.getLogger("matrix_utility")
 
 
+class AmbiguousUserError(LookupError):
+    """ Raised when getting a user by a display name which several members of the room have """
+
+
+class RoomIndex:
+    """ Rooms by room id, canonical alias and name """
+
+    def __init__(self, rooms: Dict[str, MatrixRoom]):
+        self.rooms_by_id, self.rooms_by_alias, self.rooms_by_name = {}, {}, {}
+        for room in rooms.values():
+            self.rooms_by_id.setdefault(room.room_id, room)
+            if room.canonical_alias:
+                self.rooms_by_alias.setdefault(room.canonical_alias, room)
+            if room.name:
+                self.rooms_by_name.setdefault(room.name, room)
+        self.rooms = rooms
+        self.size = len(rooms)
+
+    def get(self, id_or_name_or_alias) -> Optional[MatrixRoom]:
+        """ Prio: room_id > canonical_alias > name """
+        for rooms in (self.rooms_by_id, self.rooms_by_alias, self.rooms_by_name):
+            room = rooms.get(id_or_name_or_alias)
+            if room is not None:
+                return room
+        return None
+
+
+class RoomUserIndex:
+    """ The users of a room by lowercase user id and display name """
+
+    def __init__(self, room: MatrixRoom):
+        self.users_by_id = {}  # type: Dict[str, MatrixUser]
+        self.users_by_display_name = {}  # type: Dict[str, Dict[str, MatrixUser]]
+        self.indexed_display_names = {}  # type: Dict[str, str] # Users are updated in place, so keep their old name
+        for user in room.users.values():
+            self.add(user)
+        self.size = len(room.users)
+
+    def add(self, user: MatrixUser):
+        if isinstance(user.user_id, str):
+            self.users_by_id[user.user_id.lower()] = user
+        if isinstance(user.display_name, str):
+            display_name = user.display_name.lower()
+            self.users_by_display_name.setdefault(display_name, {})[user.user_id] = user
+            self.indexed_display_names[user.user_id] = display_name
+
+    def remove(self, user_id):
+        self.users_by_id.pop(user_id.lower(), None)
+        display_name = self.indexed_display_names.pop(user_id, None)
+        if display_name is not None:
+            users_with_display_name = self.users_by_display_name.get(display_name, {})
+            users_with_display_name.pop(user_id, None)
+            if not users_with_display_name:
+                self.users_by_display_name.pop(display_name, None)
+
+    def get(self, user_id_or_display_name) -> Optional[MatrixUser]:
+        """ Get user by user id, or by display name if no user has the id.
+        Raises AmbiguousUserError if several users have the display name """
+        user = self.users_by_id.get(user_id_or_display_name.lower())
+        if user:
+            return user
+        users_with_display_name = self.users_by_display_name.get(user_id_or_display_name.lower(), {})
+        if len(users_with_display_name) > 1:
+            logger.debug("Several users have display name {}".format(user_id_or_display_name))
+            raise AmbiguousUserError("Several users have display name {}".format(user_id_or_display_name))
+        return next(iter(users_with_display_name.values()), None)
+
+
 class Matrix:
     """ Contains the matrix client and help methods """
 
+    ALIAS_NOT_FOUND_CACHE_SECONDS = 5 * 60
+
     def __init__(self, config, matrix_client: AsyncClient):
         self.matrix_client = matrix_client
+        self.user_indexes = {}  # type: Dict[str, RoomUserIndex]
+        self.room_index = None  # type: Optional[RoomIndex]
+        self.resolved_room_ids = {}  # type: Dict[str, Set[str]] # Whitelisted/blacklisted room ids for room_index
+        self.alias_directory = {}  # type: Dict[str, tuple] # Alias -> (room_id or None, time of lookup)
+        matrix_client.add_event_callback(self._on_member_event, (RoomMemberEvent,))
+        matrix_client.add_event_callback(self._on_room_name_or_alias_event, (RoomNameEvent, RoomAliasEvent))
+        matrix_client.add_response_callback(self._on_sync, (SyncResponse,))
         blacklisted_rooms = config.get("chaanbot", "blacklisted_room_ids", fallback=None)
         if blacklisted_rooms:
             self.blacklisted_room_ids = [str.strip(room) for room in blacklisted_rooms.split(",")]
@@ -29,28 +108,51 @@ class Matrix:
         """ Attempt to get a room. Prio: room_id > canonical_alias > name.
         Will not be able to get room if not in room
         """
+        return self._get_room_index(rooms).get(id_or_name_or_alias)
 
-        for room in rooms.values():
-            if room.room_id == id_or_name_or_alias:
-                return room
-
-        for room_id in rooms:
-            room = rooms.get(room_id)
-            if room.canonical_alias == id_or_name_or_alias:
-                return room
+    def _get_room_index(self, rooms: Dict[str, MatrixRoom]) -> RoomIndex:
+        index = self.room_index
+        if not index or index.rooms is not rooms or index.size != len(rooms):  # Rooms were joined or left
+            index = RoomIndex(rooms)
+            self.room_index = index
+            self.resolved_room_ids = {}
+        return index
 
-        for room_id in rooms:
-            room = rooms.get(room_id)
-            if room.name == id_or_name_or_alias:
-                return room
-        return None
+    async def _on_room_name_or_alias_event(self, room: MatrixRoom, event):
+        """ Index rooms again when they are renamed or get a new canonical alias """
+        self.room_index = None
 
     def get_user(self, room: MatrixRoom, user_id_or_display_name) -> Optional[MatrixUser]:
-        for user in room.users.values():
-            if (user_id_or_display_name.lower() == user.user_id.lower()) or (
-                    user_id_or_display_name.lower() == user.display_name.lower()):
-                return user
-        return None
+        """ Get a member of the room by user id or display name, or None if not in room.
+        Raises AmbiguousUserError if several members have the display name """
+        return self._get_user_index(room).get(user_id_or_display_name)
+
+    def _get_user_index(self, room: MatrixRoom) -> RoomUserIndex:
+        index = self.user_indexes.get(room.room_id)
+        if not index or index.size != len(room.users):  # Members might have changed without a member event
+            index = RoomUserIndex(room)
+            self.user_indexes[room.room_id] = index
+        return index
+
+    async def _on_member_event(self, room: MatrixRoom, event: RoomMemberEvent):
+        """ Update the user index of the room when a user joins, leaves or changes display name """
+        index = self.user_indexes.get(room.room_id)
+        if index:
+            index.remove(event.state_key)
+            user = room.users.get(event.state_key)
+            if user:
+                index.add(user)
+            index.size = len(room.users)
+
+    async def _on_sync(self, response: SyncResponse):
+        """ Event callbacks are only called for timeline events, so index rooms whose state changed in the state section
+        of the sync again, e.g. display names changed during a gap in a limited sync """
+        for room_id, room_info in response.rooms.join.items():
+            for event in room_info.state:
+                if isinstance(event, RoomMemberEvent):
+                    self.user_indexes.pop(room_id, None)
+                elif isinstance(event, (RoomNameEvent, RoomAliasEvent)):
+                    self.room_index = None
 
     def is_online(self, room_id, user_id):
         presence = self.get_presence(room_id, user_id)
@@ -81,23 +183,50 @@ class Matrix:
         )
 
     async def join_room(self, room_id_or_alias):
+        if isinstance(room_id_or_alias, MatrixRoom):  # Invites give the room itself
+            room_id_or_alias = room_id_or_alias.room_id
         room = self.get_room(self.matrix_client.rooms, room_id_or_alias)
-        room_id = room.room_id if room else room_id_or_alias  # Might not be able to get room_id if room was unlisted
+        room_id = room.room_id if room else await self._resolve_room_id(room_id_or_alias)
         if self.whitelisted_room_ids and len(self.whitelisted_room_ids) > 0:
-            for whitelisted_room_id_or_alias in self.whitelisted_room_ids:
-                whitelisted_room = self.get_room(self.matrix_client.rooms, whitelisted_room_id_or_alias)
-                if whitelisted_room and whitelisted_room.room_id == room_id:
-                    logger.info("Room {} is whitelisted, joining it".format(room_id_or_alias))
-                    await self.matrix_client.join(whitelisted_room_id_or_alias)
-            logger.info("Room {} is not whitelisted, will not join it".format(room_id_or_alias))
+            if room_id in await self._get_resolved_room_ids("whitelisted", self.whitelisted_room_ids):
+                logger.info("Room {} is whitelisted, joining it".format(room_id_or_alias))
+                await self.matrix_client.join(room_id_or_alias)
+            else:
+                logger.info("Room {} is not whitelisted, will not join it".format(room_id_or_alias))
         elif self.blacklisted_room_ids and len(self.blacklisted_room_ids) > 0:
-            for blacklisted_room_id_or_alias in self.blacklisted_room_ids:
-                blacklisted_room = self.get_room(self.matrix_client.rooms, blacklisted_room_id_or_alias)
-                if blacklisted_room and blacklisted_room.room_id == room_id:
-                    logger.info("Room {} is blacklisted, will not join it".format(blacklisted_room_id_or_alias))
-                    return
+            if room_id in await self._get_resolved_room_ids("blacklisted", self.blacklisted_room_ids):
+                logger.info("Room {} is blacklisted, will not join it".format(room_id_or_alias))
+                return
             logger.info("Room {} is not blacklisted, will join it".format(room_id_or_alias))
             await self.matrix_client.join(room_id_or_alias)
         else:
             logger.info("Joining room {}".format(room_id_or_alias))
             await self.matrix_client.join(room_id_or_alias)
+
+    async def _get_resolved_room_ids(self, list_name, room_ids_or_aliases: List[str]) -> Set[str]:
+        """ Get the room ids of a whitelist or blacklist. Resolved again when the bot's rooms have changed """
+        self._get_room_index(self.matrix_client.rooms)
+        if list_name not in self.resolved_room_ids:
+            room_ids = set()
+            for room_id_or_alias in room_ids_or_aliases:
+                room = self.get_room(self.matrix_client.rooms, room_id_or_alias)
+                room_id = room.room_id if room else await self._resolve_room_id(room_id_or_alias)
+                if room_id:
+                    room_ids.add(room_id)
+            logger.debug("Resolved {} rooms: {}".format(list_name, room_ids))
+            self.resolved_room_ids[list_name] = room_ids
+        return self.resolved_room_ids[list_name]
+
+    async def _resolve_room_id(self, room_id_or_alias) -> Optional[str]:
+        """ Resolve the room id of a room the bot is not in. Aliases are looked up in the room directory """
+        if not room_id_or_alias.startswith("#"):
+            return room_id_or_alias  # Room id, or a name which can not be resolved
+        room_id, lookup_time = self.alias_directory.get(room_id_or_alias, (None, None))
+        if room_id or (lookup_time and time.time() - lookup_time < self.ALIAS_NOT_FOUND_CACHE_SECONDS):
+            return room_id
+        response = await self.matrix_client.room_resolve_alias(room_id_or_alias)
+        room_id = response.room_id if isinstance(response, RoomResolveAliasResponse) else None
+        if not room_id:
+            logger.debug("Could not resolve alias {}".format(room_id_or_alias))
+        self.alias_directory[room_id_or_alias] = (room_id, time.time())
+        return room_id
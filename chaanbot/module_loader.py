@@ -1,18 +1,22 @@
 import importlib
+import inspect
 import logging
 from typing import List, Any
 
 import pkg_resources
 
+from chaanbot.http_client import BlockingRequests
+
 logger = logging.getLogger("module_loader")
 
 
 class ModuleLoader:
     """ Responsible for loading modules """
 
-    def __init__(self, config, database, requests):
+    def __init__(self, config, database, http_client, budget=None):
         self.database = database
-        self.requests = requests
+        self.http_client = http_client
+        self.budget = budget  # Budget manager given to modules taking a budget argument
 
         enabled_modules = config.get("modules", "enabled", fallback=None)
         if enabled_modules:
@@ -63,6 +67,7 @@ class ModuleLoader:
         module_class = getattr(module, self._get_class_name(relative_module_path))
         instance = self._instantiate_module_class(module_class, config, matrix)
         instance.always_run = instance.always_run if hasattr(instance, "always_run") else False
+        instance.run_concurrently = instance.run_concurrently if hasattr(instance, "run_concurrently") else True
         return instance
 
     def _get_class_name(self, relative_module_path) -> str:
@@ -86,6 +91,27 @@ class ModuleLoader:
 
     def _instantiate_module_class(self, module_class, config, matrix):
         try:
-            return module_class(config, matrix, self.database, self.requests)
+            return module_class(config, matrix, self.database, self._get_http_argument(module_class),
+                                **self._get_optional_arguments(module_class))
         except TypeError:  # Module might not require any parameters, try without
             return module_class()
+
+    def _get_optional_arguments(self, module_class) -> dict:
+        """ Give services only to the modules declaring them, so modules without them keep working """
+        try:
+            parameter_names = inspect.signature(module_class).parameters
+        except (TypeError, ValueError):
+            return {}
+        return {"budget": self.budget} if "budget" in parameter_names else {}
+
+    def _get_http_argument(self, module_class):
+        """ Modules used to be given the blocking requests library, keep giving it to modules still asking for it """
+        try:
+            parameter_names = list(inspect.signature(module_class).parameters)
+        except (TypeError, ValueError):
+            return self.http_client
+        if len(parameter_names) >= 4 and parameter_names[3] == "requests":
+            logger.warning("Module {} uses blocking requests, it should take the async http client instead".format(
+                module_class.__name__))
+            return BlockingRequests()
+        return self.http_client
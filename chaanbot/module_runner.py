@@ -1,29 +1,172 @@
+import asyncio
+import inspect
 import logging
+import re
 import time
+from collections import namedtuple
+from typing import Dict, List, Any
 
 from nio import MatrixRoom, RoomMessage
 
+from chaanbot import config_utility
+from chaanbot.parsed_message import parse
+
 logger = logging.getLogger("module_runner")
 
 """ Responsible for running modules on messages in rooms """
 
+# The modules offered a message, in order of priority, split by how they are run
+ModulePlan = namedtuple("ModulePlan", ["modules", "concurrent_modules", "sequential_modules", "handling_modules"])
+
 
 class ModuleRunner:
     MAX_AGE_OF_EVENT_TO_BE_NEW_SECONDS = 30 * 60  # Events older than 30 minutes can be ignored
+    DEFAULT_MODULE_TIMEOUT_SECONDS = 60
+    DEFAULT_EVENT_TYPES = ["m.room.message"]
+
+    loaded_modules = []
 
     def __init__(self, config, matrix, module_loader):
         try:
             self.loaded_modules = module_loader.load_modules(config, matrix)
         except IOError as e:
             logger.warning("Could not load module(s) due to: {}".format(str(e)), e)
+        self.module_timeout_seconds = config_utility.get_float(config, "modules", "timeout",
+                                                               self.DEFAULT_MODULE_TIMEOUT_SECONDS)
+        self._sort_modules_by_priority(config.get("modules", "order", fallback=None))
+        self._build_command_index()
+
+    async def start(self):
+        """ Let modules start work they do in the background, by calling their start function if they have one """
+        await self._call_lifecycle_function("start")
+
+    async def stop(self):
+        await self._call_lifecycle_function("stop")
+
+    async def _call_lifecycle_function(self, function_name):
+        for module in self.loaded_modules:
+            function = getattr(module, function_name, None)
+            if not callable(function):
+                continue
+            try:
+                result = function()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as exception:
+                logger.exception("Module {} failed to {}: {}".format(type(module).__name__, function_name,
+                                                                     str(exception)))
 
     async def run(self, event: RoomMessage, room: MatrixRoom, message):
-        logger.debug("Running {} modules on message".format(len(self.loaded_modules)))
         if self._is_old_event(event):
             logger.warning("Event is too old, discard it. This should happen very rarely")
-        else:
-            for module in self.loaded_modules:
-                await module.run(room, event, message)
+            return
+
+        message = parse(message)
+        plan = self._get_module_plan(message)
+        logger.debug("Running {} of {} modules on message".format(len(plan.modules), len(self.loaded_modules)))
+
+        tasks = [asyncio.ensure_future(self._run_module(module, event, room, message))
+                 for module in plan.concurrent_modules]
+        if plan.sequential_modules:
+            tasks.append(asyncio.ensure_future(self._run_modules_in_order(plan.sequential_modules, event, room,
+                                                                          message)))
+        if plan.handling_modules:
+            tasks.append(asyncio.ensure_future(self._run_modules_until_handled(plan.handling_modules, event, room,
+                                                                               message)))
+        await asyncio.gather(*tasks)
+
+    async def _run_modules_until_handled(self, modules, event: RoomMessage, room: MatrixRoom, message) -> bool:
+        """ Run modules in order of priority until one of them has handled the message """
+        for module in modules:
+            if await self._run_module(module, event, room, message):
+                logger.debug("Message handled by {}".format(type(module).__name__))
+                return True
+        return False
+
+    async def _run_modules_in_order(self, modules, event: RoomMessage, room: MatrixRoom, message):
+        """ Run modules one after another, for modules whose replies must keep their order """
+        for module in modules:
+            await self._run_module(module, event, room, message)
+
+    async def _run_module(self, module, event: RoomMessage, room: MatrixRoom, message) -> bool:
+        """ Run a module on the message. A module failing or timing out will not affect other modules """
+        try:
+            return await asyncio.wait_for(module.run(room, event, message), self.module_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Module {} timed out after {} seconds".format(type(module).__name__,
+                                                                         self.module_timeout_seconds))
+        except Exception as exception:
+            logger.exception("Module {} failed with exception: {}".format(type(module).__name__, str(exception)))
+        return False
+
+    def get_event_types(self) -> List[str]:
+        """ Get the event types loaded modules handle. Modules may declare an event_types list, else they are
+        assumed to handle messages """
+        event_types = set()
+        for module in self.loaded_modules:
+            module_event_types = getattr(module, "event_types", None)
+            event_types.update(module_event_types if isinstance(module_event_types, list) else
+                               self.DEFAULT_EVENT_TYPES)
+        return sorted(event_types)
+
+    def _sort_modules_by_priority(self, order):
+        """ Put the modules listed in order first, in that order. Other modules keep the order they were loaded in """
+        if not isinstance(order, str) or not order.strip():
+            return
+        priorities = {}
+        for module_name in [module_name.strip() for module_name in order.split(",") if module_name.strip()]:
+            priorities.setdefault(module_name, len(priorities))
+        self.loaded_modules = sorted(self.loaded_modules, key=lambda module: priorities.get(
+            self._get_module_name(module), len(priorities)))
+        logger.debug("Modules in order of priority: {}".format([self._get_module_name(module)
+                                                                for module in self.loaded_modules]))
+
+    @staticmethod
+    def _get_module_name(module) -> str:
+        """ Get the snake_case name of a module from its UpperCamelCase class name, e.g. chan_save for ChanSave """
+        return re.sub(r"(?<!^)(?=[A-Z])", "_", type(module).__name__).lower()
+
+    def _build_command_index(self):
+        """ Index the commands declared in each module's operations, and plan which modules run on messages with each
+        command, so a message is routed with a single lookup. Modules without operations receive every message. """
+        modules_by_command = {}  # type: Dict[str, List[Any]]
+        command_modules = []
+        for module in self.loaded_modules:
+            operations = getattr(module, "operations", None)
+            if not isinstance(operations, dict):
+                continue
+            command_modules.append(module)
+            for operation in operations.values():
+                for command in operation.get("commands", []):
+                    if not command:
+                        continue
+                    modules = modules_by_command.setdefault(command.lower(), [])
+                    if module in modules:
+                        continue
+                    if modules:
+                        logger.warning("Command {} is declared by several modules".format(command))
+                    modules.append(module)
+
+        self.default_plan = self._plan_modules([module for module in self.loaded_modules
+                                                if module not in command_modules])
+        self.command_plans = {}  # type: Dict[str, ModulePlan]
+        for command, modules in modules_by_command.items():
+            self.command_plans[command] = self._plan_modules([module for module in self.loaded_modules
+                                                              if module in modules or module not in command_modules])
+        logger.debug("Indexed commands: {}".format(list(self.command_plans.keys())))
+
+    @staticmethod
+    def _plan_modules(modules) -> ModulePlan:
+        always_run_modules = [module for module in modules if getattr(module, "always_run", False) is True]
+        concurrent_modules = [module for module in always_run_modules
+                              if getattr(module, "run_concurrently", True) is not False]
+        return ModulePlan(modules, concurrent_modules,
+                          [module for module in always_run_modules if module not in concurrent_modules],
+                          [module for module in modules if module not in always_run_modules])
+
+    def _get_module_plan(self, message) -> ModulePlan:
+        """ Get the modules which should be offered the message """
+        return self.command_plans.get(message.command_token, self.default_plan)
 
     def _is_old_event(self, event: RoomMessage):
         return (time.time() - (event.server_timestamp / 1000)) > self.MAX_AGE_OF_EVENT_TO_BE_NEW_SECONDS
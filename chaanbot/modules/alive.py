@@ -15,13 +15,14 @@ from nio import MatrixRoom, RoomMessage
 
 from chaanbot import command_utility
 from chaanbot.database import Database
+from chaanbot.http_client import HttpClient
 from chaanbot.matrix import Matrix
 
 logger = logging.getLogger("ping")
 
 
 class Alive:
-    def __init__(self, config, matrix: Matrix, database: Database, requests):
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient):
         self.matrix = matrix
 
     always_run = False
@@ -8,29 +8,92 @@ Usage example:
 
 Would results in:
 "Bot: Image saved at [website-url]"
+
+Files are downloaded by background workers from a queue kept in the database, so downloads are retried and are not
+lost when the bot restarts. If max_archive_size_mb is set, the least recently used files are removed when the saved
+files take up more space.
 """
+import asyncio
 import hashlib
 import logging
 import os
 import re
-from typing import List
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 from nio import RoomMessage, MatrixRoom
 
+from chaanbot import config_utility
 from chaanbot.database import Database
+from chaanbot.file_server import FileServer
+from chaanbot.http_client import HttpClient
 from chaanbot.matrix import Matrix
+from chaanbot.parsed_message import parse, Url
 
 logger = logging.getLogger("chan_save")
 
 
+class UnsavableFileError(IOError):
+    """ Raised when a file can not be saved, so downloading it again would not help """
+
+
+class DownloadJob:
+    """ A file to download, and the rooms to tell where it was saved """
+
+    def __init__(self, normalized_url, link, file_extension, room_ids: List[str], attempts=0, next_attempt_at=0.0):
+        self.normalized_url = normalized_url
+        self.link = link
+        self.file_extension = file_extension
+        self.room_ids = room_ids
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at  # Unix time, as it is persisted across restarts
+
+
 class ChanSave:
-    url_regexes = [re.compile(r"4chan.org"), re.compile(r"i.4cdn.org", re.IGNORECASE)]
+    hosts_to_save_from = ["4chan.org", "4cdn.org"]
     file_extensions_to_save = ["jpg", "png", "bmp", "gif", "jpeg", "webm", "pdf"]
     always_run = True
+    default_max_concurrent_fetches = 4
+    default_max_file_size_mb = 50
+    default_download_attempts = 5
+    default_retry_delay_seconds = 30
+    max_retry_delay_seconds = 60 * 60
+    default_serve_host = "127.0.0.1"
+    write_buffer_bytes = 1024 * 1024
+    content_range_regex = re.compile(r"^bytes (\d+)-")
+    default_max_archive_size_mb = 0  # No limit
+    eviction_batch_size = 100
+    access_persist_interval_seconds = 60
 
-    def __init__(self, config, matrix: Matrix, database: Database, requests):
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient):
         self.matrix = matrix
-        self.requests = requests
+        self.http_client = http_client
+        self.worker_count = max(1, config_utility.get_int(config, "chan_save", "max_concurrent_fetches",
+                                                          self.default_max_concurrent_fetches))
+        self.download_attempts = max(1, config_utility.get_int(config, "chan_save", "download_attempts",
+                                                               self.default_download_attempts))
+        self.retry_delay_seconds = config_utility.get_float(config, "chan_save", "retry_delay_seconds",
+                                                            self.default_retry_delay_seconds)
+        self.max_file_size_bytes = config_utility.get_float(config, "chan_save", "max_file_size_mb",
+                                                            self.default_max_file_size_mb) * 1024 * 1024
+        self.database = database
+        self.saved_filenames = {}  # type: Dict[str, str] # Normalized url: name of the saved file
+        self.saved_urls = {}  # type: Dict[str, List[str]] # Name of a saved file: normalized urls it was saved from
+        self.jobs = {}  # type: Dict[str, DownloadJob] # Normalized url: job, one per file however often it is posted
+        self.job_queue = asyncio.Queue()  # Normalized urls of jobs ready to be processed
+        self.workers = []  # type: List[asyncio.Future]
+        self.retry_handles = {}  # type: Dict[str, asyncio.TimerHandle] # Normalized url: handle of waiting job
+        self.file_server = None  # type: Optional[FileServer]
+        self.max_archive_size_bytes = config_utility.get_float(config, "chan_save", "max_archive_size_mb",
+                                                               self.default_max_archive_size_mb) * 1024 * 1024
+        # Name of each saved file: (size, last access time as persisted), least recently accessed first
+        self.archive = OrderedDict()  # type: OrderedDict[str, Tuple[int, float]]
+        self.archive_size_bytes = 0
+        self.eviction_needed = asyncio.Event()
+        self.eviction_task = None  # type: Optional[asyncio.Future]
         save_dirpath = config.get("chan_save", "save_dirpath", fallback=None)
         url_to_access_saved_files = config.get("chan_save", "url_to_access_saved_files", fallback=None)
 
@@ -51,36 +114,301 @@ class ChanSave:
                 "/") else url_to_access_saved_files + "/"
             logger.debug("Saved media will be accessible at {}".format(self.url_to_access_saved_files))
 
+        serve_port = config_utility.get_int(config, "chan_save", "serve_port", 0)
+        if serve_port:
+            # Serve the files at the path of url_to_access_saved_files, so it may point directly at the bot
+            path_prefix = urlsplit(self.url_to_access_saved_files).path if hasattr(
+                self, "url_to_access_saved_files") else "/"
+            self.file_server = FileServer(self.save_dirpath,
+                                          config.get("chan_save", "serve_host", fallback=None) or
+                                          self.default_serve_host, serve_port, path_prefix or "/",
+                                          self._record_access)
+
+        if database:
+            self.saved_filenames, self.jobs, self.archive = database.run_blocking(self._create_tables_and_load)
+            for url, filename in self.saved_filenames.items():
+                self.saved_urls.setdefault(filename, []).append(url)
+            if not self.archive:  # Saved before the sizes of saved files were stored
+                self._add_existing_files_to_archive()
+            self.archive_size_bytes = sum(size for size, _ in self.archive.values())
+            logger.debug("Loaded {} saved files ({} MB) and {} queued downloads".format(
+                len(self.archive), self.archive_size_bytes // (1024 * 1024), len(self.jobs)))
+
+    async def start(self):
+        if hasattr(self, "disabled") or self.workers:
+            return
+        self.job_queue = asyncio.Queue()  # Queue every job once, including those left from before a restart
+        for job in self.jobs.values():
+            self._queue_job(job)
+        self.workers = [asyncio.ensure_future(self._process_jobs()) for _ in range(self.worker_count)]
+        if self.max_archive_size_bytes:
+            self.eviction_task = asyncio.ensure_future(self._evict_forever())
+            if self._is_archive_too_large():
+                self.eviction_needed.set()
+        if self.file_server:
+            await self.file_server.start()
+
+    async def stop(self):
+        if self.file_server:
+            await self.file_server.stop()
+        if self.eviction_task:
+            self.eviction_task.cancel()
+            await asyncio.gather(self.eviction_task, return_exceptions=True)
+            self.eviction_task = None
+        for retry_handle in self.retry_handles.values():
+            retry_handle.cancel()
+        self.retry_handles = {}
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
     async def run(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
-        links = self._get_links(message)
-        for link in links:
-            if link and self._should_run(link):
+        for url in parse(message).urls:
+            link = url.url
+            if self._should_run(url.host):
                 logger.debug("Should run chan_save, checking if which (if any) file to save")
                 file_extension = self._get_file_extension(link)
                 if file_extension:
-                    filename, filepath = self._get_filename_and_filepath(link, file_extension)
-                    if not os.path.exists(filepath):
-                        self._save_media(link, filepath)
-                        if hasattr(self, "url_to_access_saved_files"):
-                            await self.matrix.send_text_to_room(
-                                "File saved to {}{} .".format(self.url_to_access_saved_files, filename), room.room_id)
-                    else:
-                        logger.debug("File from url {} already saved at {}".format(link, filepath))
+                    self._add_job(self._normalize_url(url), link, file_extension, room.room_id)
 
         return False  # ChanSave does not use commands and should not return that it has handled one
 
-    def _get_links(self, message) -> List[str]:
-        http_message = re.sub(r"www\.", message, re.IGNORECASE) \
-            if re.match(r"www\.", message, re.IGNORECASE) and not (
-                re.match("http:", message, re.IGNORECASE) or re.match("https:", message, re.IGNORECASE)) \
-            else message
+    def _add_job(self, normalized_url, link, file_extension, room_id):
+        """ Queue downloading the file, unless it has been saved before or is already queued """
+        if normalized_url in self.saved_filenames:
+            logger.debug("File from url {} already saved as {}".format(link, self.saved_filenames[normalized_url]))
+            self._record_access(self.saved_filenames[normalized_url])
+            return
+        job = self.jobs.get(normalized_url)
+        if job:
+            if room_id in job.room_ids:
+                return
+            logger.debug("File from url {} is already queued, will also tell room {}".format(link, room_id))
+            job.room_ids.append(room_id)
+        else:
+            job = DownloadJob(normalized_url, link, file_extension, [room_id])
+            self.jobs[normalized_url] = job
+            self.job_queue.put_nowait(normalized_url)
+        if self.database:
+            self.database.write("INSERT OR IGNORE INTO chan_save_jobs(URL, ROOM_ID, LINK, FILE_EXTENSION, ATTEMPTS, "
+                                "NEXT_ATTEMPT_AT) VALUES(?,?,?,?,?,?)",
+                                (normalized_url, room_id, link, file_extension, job.attempts, job.next_attempt_at))
+
+    def _queue_job(self, job: DownloadJob):
+        """ Queue the job for the workers, now or when its next attempt is due """
+        delay_seconds = job.next_attempt_at - time.time()
+        if delay_seconds <= 0:
+            self.job_queue.put_nowait(job.normalized_url)
+            return
+        self.retry_handles[job.normalized_url] = asyncio.get_event_loop().call_later(
+            delay_seconds, self._retry_job, job.normalized_url)
+
+    def _retry_job(self, normalized_url):
+        self.retry_handles.pop(normalized_url, None)
+        self.job_queue.put_nowait(normalized_url)
+
+    async def _process_jobs(self):
+        while True:
+            normalized_url = await self.job_queue.get()
+            try:
+                job = self.jobs.get(normalized_url)
+                if job:
+                    await self._process_job(job)
+            except Exception as exception:
+                logger.exception("Failed to process download of {}: {}".format(normalized_url, str(exception)))
+            finally:
+                self.job_queue.task_done()
+
+    async def _process_job(self, job: DownloadJob):
+        try:
+            filename = await self._save_media_if_new(job.link, job.normalized_url, job.file_extension)
+        except Exception as exception:
+            job.attempts += 1
+            if isinstance(exception, UnsavableFileError) or job.attempts >= self.download_attempts:
+                logger.warning("Failed to save media from {}: {}".format(job.link, str(exception)))
+                await self._remove_job(job)
+                return
+            delay_seconds = min(self.max_retry_delay_seconds, self.retry_delay_seconds * 2 ** (job.attempts - 1))
+            logger.info("Failed to save media from {}, retrying in {} seconds: {}".format(
+                job.link, delay_seconds, str(exception)))
+            job.next_attempt_at = time.time() + delay_seconds
+            if self.database:
+                self.database.write("UPDATE chan_save_jobs SET ATTEMPTS = ?, NEXT_ATTEMPT_AT = ? WHERE URL = ?",
+                                    (job.attempts, job.next_attempt_at, job.normalized_url))
+            self._queue_job(job)
+            return
+
+        await self._remove_job(job)
+        if filename and hasattr(self, "url_to_access_saved_files"):
+            for room_id in job.room_ids:
+                await self.matrix.send_text_to_room(
+                    "File saved to {}{} .".format(self.url_to_access_saved_files, filename), room_id)
 
-        links = re.findall(r"http[^(\s)]+", http_message, re.IGNORECASE)  # Match from http to next space to get links
-        return links
+    async def _remove_job(self, job: DownloadJob):
+        """ Remove the job, and the part file it may have left when it failed """
+        self.jobs.pop(job.normalized_url, None)
+        await asyncio.get_event_loop().run_in_executor(
+            None, self._remove_part_file, self._get_part_filepath(job.normalized_url, job.file_extension))
+        if self.database:
+            self.database.write("DELETE FROM chan_save_jobs WHERE URL = ?", (job.normalized_url,))
 
-    def _should_run(self, link) -> bool:
-        return not hasattr(self, "disabled") and list(
-            filter(lambda regex_url: regex_url.search(link), self.url_regexes))
+    async def _save_media_if_new(self, link, normalized_url, file_extension) -> Optional[str]:
+        """ Save the media unless it has been saved before, and return the name of the saved file """
+        if normalized_url in self.saved_filenames:
+            logger.debug("File from url {} already saved as {}".format(link, self.saved_filenames[normalized_url]))
+            return None
+        legacy_filename, legacy_filepath = self._get_filename_and_filepath(link, file_extension)
+        if os.path.exists(legacy_filepath):  # Saved before files were named by their content
+            logger.debug("File from url {} already saved at {}".format(link, legacy_filepath))
+            self._add_to_index(normalized_url, legacy_filename, None, os.path.getsize(legacy_filepath), None)
+            return None
+        filename, content_hash, size, mime_type = await self._save_media(link, normalized_url, file_extension)
+        self._add_to_index(normalized_url, filename, content_hash, size, mime_type)
+        return filename
+
+    def _add_to_index(self, normalized_url, filename, content_hash, size, mime_type):
+        self.saved_filenames[normalized_url] = filename
+        self.saved_urls.setdefault(filename, []).append(normalized_url)
+        if self.database:
+            self.database.write("INSERT OR IGNORE INTO chan_save_files(URL, FILENAME, HASH, SIZE, MIME_TYPE, "
+                                "FIRST_SEEN) VALUES(?,?,?,?,?,?)",
+                                (normalized_url, filename, content_hash, size, mime_type, int(time.time())))
+        self._record_access(filename, size)
+
+    def _record_access(self, filename, size=None):
+        """ Mark the file as recently used, when it is saved, posted again or served. Files not in the archive are
+        added if their size is given """
+        now = time.time()
+        entry = self.archive.get(filename)
+        if entry is None:
+            if size is None:
+                return
+            self.archive[filename] = (size, now)
+            self.archive_size_bytes += size
+            if self.database:
+                self.database.write("INSERT OR REPLACE INTO chan_save_archive(FILENAME, SIZE, LAST_ACCESSED) "
+                                    "VALUES(?,?,?)", (filename, size, now))
+            if self._is_archive_too_large():
+                self.eviction_needed.set()
+            return
+        self.archive.move_to_end(filename)
+        # Files are often served many times in a row, e.g. when videos are streamed with range requests
+        if now - entry[1] >= self.access_persist_interval_seconds:
+            self.archive[filename] = (entry[0], now)
+            if self.database:
+                self.database.write("UPDATE chan_save_archive SET LAST_ACCESSED = ? WHERE FILENAME = ?",
+                                    (now, filename))
+
+    def _is_archive_too_large(self) -> bool:
+        return bool(self.max_archive_size_bytes) and self.archive_size_bytes > self.max_archive_size_bytes
+
+    async def _evict_forever(self):
+        """ Remove the least recently used files whenever the archive is too large """
+        while True:
+            await self.eviction_needed.wait()
+            self.eviction_needed.clear()
+            try:
+                while self._is_archive_too_large():
+                    self._evict_least_recently_used(self.eviction_batch_size)
+                    await asyncio.sleep(0)  # Let messages be handled between batches
+            except Exception as exception:
+                logger.exception("Failed to remove saved files: {}".format(str(exception)))
+
+    def _evict_least_recently_used(self, max_files):
+        """ Remove up to max_files of the least recently used files, until the archive is small enough. Files are
+        removed here rather than in another thread, so a file saved again meanwhile is never removed """
+        evicted_filenames = set()
+        while self.archive and len(evicted_filenames) < max_files and self._is_archive_too_large():
+            filename, (size, _) = self.archive.popitem(last=False)
+            self.archive_size_bytes -= size
+            evicted_filenames.add(filename)
+            try:
+                os.remove(self.save_dirpath + filename)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                logger.warning("Failed to remove saved file {}: {}".format(filename, str(error)))
+        if not evicted_filenames:
+            return
+        logger.info("Removed {} least recently used saved files, {} MB left".format(
+            len(evicted_filenames), self.archive_size_bytes // (1024 * 1024)))
+        evicted_urls = []
+        for filename in evicted_filenames:
+            evicted_urls.extend(self.saved_urls.pop(filename, []))
+        for url in evicted_urls:
+            self.saved_filenames.pop(url, None)
+        if self.database:
+            self.database.writemany("DELETE FROM chan_save_archive WHERE FILENAME = ?",
+                                    [(filename,) for filename in evicted_filenames])
+            self.database.writemany("DELETE FROM chan_save_files WHERE URL = ?", [(url,) for url in evicted_urls])
+
+    def _add_existing_files_to_archive(self):
+        """ Add the files already in save_dirpath to the archive, oldest first. Only done once, as the archive is
+        kept up to date from then on """
+        existing_files = []
+        try:
+            with os.scandir(self.save_dirpath) as entries:
+                for entry in entries:
+                    if FileServer.filename_regex.match(entry.name) and entry.is_file():
+                        stat = entry.stat()
+                        existing_files.append((entry.name, stat.st_size, stat.st_mtime))
+        except OSError as error:
+            logger.warning("Failed to list saved files in {}: {}".format(self.save_dirpath, str(error)))
+        existing_files.sort(key=lambda existing_file: existing_file[2])
+        for filename, size, modified_at in existing_files:
+            self.archive[filename] = (size, modified_at)
+        if existing_files and self.database:
+            logger.info("Added {} existing saved files to the archive".format(len(existing_files)))
+            self.database.writemany("INSERT OR IGNORE INTO chan_save_archive(FILENAME, SIZE, LAST_ACCESSED) "
+                                    "VALUES(?,?,?)", existing_files)
+
+    @staticmethod
+    def _create_tables_and_load(conn) -> (Dict[str, str], Dict[str, DownloadJob], OrderedDict):
+        conn.execute('''CREATE TABLE IF NOT EXISTS chan_save_files
+        (URL TEXT PRIMARY KEY NOT NULL,
+        FILENAME TEXT NOT NULL,
+        HASH TEXT,
+        SIZE INTEGER,
+        MIME_TYPE TEXT,
+        FIRST_SEEN INTEGER NOT NULL);
+        ''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chan_save_jobs
+        (URL TEXT NOT NULL,
+        ROOM_ID TEXT NOT NULL,
+        LINK TEXT NOT NULL,
+        FILE_EXTENSION TEXT NOT NULL,
+        ATTEMPTS INTEGER NOT NULL,
+        NEXT_ATTEMPT_AT REAL NOT NULL,
+        PRIMARY KEY(URL, ROOM_ID));
+        ''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS chan_save_archive
+        (FILENAME TEXT PRIMARY KEY NOT NULL,
+        SIZE INTEGER NOT NULL,
+        LAST_ACCESSED REAL NOT NULL);
+        ''')
+        saved_filenames = dict(conn.execute("SELECT URL, FILENAME FROM chan_save_files"))
+        jobs = {}
+        for url, room_id, link, file_extension, attempts, next_attempt_at in conn.execute(
+                "SELECT URL, ROOM_ID, LINK, FILE_EXTENSION, ATTEMPTS, NEXT_ATTEMPT_AT FROM chan_save_jobs "
+                "ORDER BY ROWID"):
+            if url in jobs:
+                jobs[url].room_ids.append(room_id)
+            else:
+                jobs[url] = DownloadJob(url, link, file_extension, [room_id], attempts, next_attempt_at)
+        archive = OrderedDict((filename, (size, last_accessed)) for filename, size, last_accessed in conn.execute(
+            "SELECT FILENAME, SIZE, LAST_ACCESSED FROM chan_save_archive ORDER BY LAST_ACCESSED"))
+        return saved_filenames, jobs, archive
+
+    @staticmethod
+    def _normalize_url(url: Url) -> str:
+        """ The same file is available from several 4chan hosts, e.g. i.4cdn.org and is2.4chan.org """
+        return "4cdn.org" + url.path
+
+    def _should_run(self, host) -> bool:
+        return not hasattr(self, "disabled") and any(
+            host == host_to_save_from or host.endswith("." + host_to_save_from)
+            for host_to_save_from in self.hosts_to_save_from)
 
     def _get_file_extension(self, link):
         for extension in self.file_extensions_to_save:
@@ -92,7 +420,103 @@ class ChanSave:
         filepath = "{}{}".format(self.save_dirpath, filename)
         return filename, filepath
 
-    def _save_media(self, link, filepath):
-        request = self.requests.get(link, allow_redirects=True)
-        with open(filepath, 'wb') as file:
-            file.write(request.content)
+    async def _save_media(self, link, normalized_url, file_extension) -> (str, str, int, Optional[str]):
+        """ Stream the file to a .part file, which is renamed once complete so saved files are never partial.
+        Files are named by the sha256 of their content, so the same file posted from different urls is stored once.
+        If an earlier download was interrupted, it is resumed from the .part file when the server supports it.
+        Returns the filename, content hash, size and mime type of the saved file. """
+        part_filepath = self._get_part_filepath(normalized_url, file_extension)
+        loop = asyncio.get_event_loop()
+        try:
+            resume_from = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+            downloaded = await self._download_to_part_file(link, part_filepath, resume_from)
+            if downloaded is None:
+                logger.info("Could not resume download of {}, downloading it from the start".format(link))
+                await loop.run_in_executor(None, self._remove_part_file, part_filepath)
+                downloaded = await self._download_to_part_file(link, part_filepath, 0)
+        except UnsavableFileError:
+            await loop.run_in_executor(None, self._remove_part_file, part_filepath)
+            raise
+        content_hash, size, mime_type = downloaded
+
+        filename = "{}.{}".format(content_hash, file_extension)
+        if not await loop.run_in_executor(None, self._move_part_file, part_filepath, self.save_dirpath + filename):
+            logger.debug("File from url {} is the same as the already saved {}".format(link, filename))
+        return filename, content_hash, size, mime_type
+
+    async def _download_to_part_file(self, link, part_filepath, resume_from) -> Optional[Tuple[str, int, str]]:
+        """ Download the file, or the rest of it if resume_from is given. Returns the content hash, size and mime type,
+        or None if the download can not be resumed from the part file. File I/O is done in the executor, so writing
+        large files does not block the event loop """
+        loop = asyncio.get_event_loop()
+        headers = {"Range": "bytes={}-".format(resume_from)} if resume_from else None
+        async with self.http_client.stream(link, headers=headers) as response:
+            content_hash = hashlib.sha256()
+            if response.status_code == 206 and resume_from:
+                content_range = self.content_range_regex.match(response.headers.get("Content-Range", ""))
+                if not content_range or int(content_range.group(1)) != resume_from:
+                    return None
+                logger.debug("Resuming download of {} from {} bytes".format(link, resume_from))
+                downloaded_bytes, mode = resume_from, "ab"
+                await loop.run_in_executor(None, self._hash_file, part_filepath, content_hash)
+            elif response.status_code == 416 and resume_from:  # E.g. the part file is complete, or of another file
+                return None
+            elif response.status_code == 200:
+                downloaded_bytes, mode = 0, "wb"
+            elif response.status_code in (404, 410):  # The post has been deleted
+                raise UnsavableFileError("Got status code {} when downloading {}".format(response.status_code, link))
+            else:
+                raise IOError("Got status code {} when downloading {}".format(response.status_code, link))
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and \
+                    downloaded_bytes + int(content_length) > self.max_file_size_bytes:
+                raise UnsavableFileError("File at {} is larger than the maximum file size".format(link))
+
+            file = await loop.run_in_executor(None, open, part_filepath, mode)
+            try:
+                buffer = bytearray()
+                async for chunk in response.iter_chunks():
+                    downloaded_bytes += len(chunk)
+                    if downloaded_bytes > self.max_file_size_bytes:
+                        raise UnsavableFileError("File at {} is larger than the maximum file size".format(link))
+                    content_hash.update(chunk)
+                    buffer += chunk
+                    if len(buffer) >= self.write_buffer_bytes:
+                        await loop.run_in_executor(None, file.write, bytes(buffer))
+                        buffer.clear()
+                await loop.run_in_executor(None, self._write_and_sync, file, bytes(buffer))
+            finally:
+                await loop.run_in_executor(None, file.close)
+            return content_hash.hexdigest(), downloaded_bytes, response.headers.get("Content-Type")
+
+    def _get_part_filepath(self, normalized_url, file_extension) -> str:
+        return "{}{}.{}.part".format(self.save_dirpath, hashlib.sha1(normalized_url.encode()).hexdigest(),
+                                     file_extension)
+
+    @staticmethod
+    def _hash_file(filepath, content_hash):
+        with open(filepath, "rb") as file:
+            for block in iter(partial(file.read, 1024 * 1024), b""):
+                content_hash.update(block)
+
+    @staticmethod
+    def _write_and_sync(file, data):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    def _move_part_file(self, part_filepath, filepath) -> bool:
+        """ Rename the part file to the saved file. Returns False if the file was already saved """
+        if os.path.exists(filepath):
+            self._remove_part_file(part_filepath)
+            return False
+        os.replace(part_filepath, filepath)
+        return True
+
+    @staticmethod
+    def _remove_part_file(part_filepath):
+        try:
+            os.remove(part_filepath)
+        except FileNotFoundError:
+            pass
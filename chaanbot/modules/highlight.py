@@ -18,12 +18,15 @@ Note: Groups are room-dependent and case-insensitive.
 """
 import logging
 import re
+from typing import Dict, Set
 
 from nio import RoomMessage, MatrixRoom
 
 from chaanbot import command_utility
 from chaanbot.database import Database
-from chaanbot.matrix import Matrix
+from chaanbot.http_client import HttpClient
+from chaanbot.matrix import Matrix, AmbiguousUserError
+from chaanbot.parsed_message import parse
 
 logger = logging.getLogger("highlight")
 
@@ -49,24 +52,31 @@ class Highlight:
         },
     }
 
-    def __init__(self, config, matrix: Matrix, database: Database, requests):
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient):
         self.matrix = matrix
+        self.groups = {}  # type: Dict[str, Dict[str, Set[str]]] # Members of each group in each room
         if database:
             self.database = database
             logger.debug("Initializing highlight database if needed")
-            conn = database.connect()
-            conn.execute('''CREATE TABLE IF NOT EXISTS highlight_groups
-            (ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            ROOM_ID TEXT NOT NULL,
-            "GROUP_NAME" TEXT NOT NULL,
-            MEMBER TEXT NOT NULL,
-            UNIQUE(ROOM_ID,GROUP_NAME,MEMBER));    
-            ''')
-            conn.commit()
+            for room_id, group, member in database.run_blocking(self._create_table_and_get_groups):
+                self.groups.setdefault(room_id, {}).setdefault(group, set()).add(member)
+            logger.debug("Loaded highlight groups for {} rooms".format(len(self.groups)))
         else:
             logger.info("No database provided, highlight module disabled")
 
+    @staticmethod
+    def _create_table_and_get_groups(conn) -> list:
+        conn.execute('''CREATE TABLE IF NOT EXISTS highlight_groups
+        (ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        ROOM_ID TEXT NOT NULL,
+        "GROUP_NAME" TEXT NOT NULL,
+        MEMBER TEXT NOT NULL,
+        UNIQUE(ROOM_ID,GROUP_NAME,MEMBER));
+        ''')
+        return conn.execute("SELECT ROOM_ID, GROUP_NAME, MEMBER FROM highlight_groups").fetchall()
+
     async def run(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
+        message = parse(message)
         if self._should_run(message):
             if command_utility.matches(self.operations["highlight_all"], message):
                 logger.debug("Highlighting all")
@@ -90,7 +100,7 @@ class Highlight:
 
     async def _highlight_all(self, room: MatrixRoom, sender_user_id, message):
         user_ids = [user.user_id for user in room.users.values()]
-        argument = command_utility.get_argument(message)
+        argument = message.argument
         user_ids = self._remove_element(user_ids, sender_user_id)
         if user_ids:
             message = ", ".join(user_ids)
@@ -105,7 +115,7 @@ class Highlight:
         return
 
     async def _highlight(self, room: MatrixRoom, sender_user_id, message):
-        argument = command_utility.get_argument(message)
+        argument = message.argument
         if not argument:
             await self.matrix.send_text_to_room("Correct syntax is !hl [group] [optional text].", room.room_id)
             return
@@ -125,32 +135,29 @@ class Highlight:
                                                 room.room_id)
 
     async def _add_or_create_group(self, room: MatrixRoom, message):
-        arguments = command_utility.get_argument(message).split()
+        arguments = message.argument_tokens
         group = arguments[0].lower()
         users_to_add = arguments[1:]
         logger.debug("User wants to add {} to {}".format(users_to_add, group))
         if group and len(users_to_add) > 0:
             for user in users_to_add:
-                found_user = self.matrix.get_user(room, user)
-                if not found_user:
-                    await self.matrix.send_text_to_room("User: \"{}\" is not in room".format(user), room.room_id)
+                if not await self._is_user_in_room(room, user, "User: \"{}\" is not in room"):
                     return
 
             new_members = []
+            for user in users_to_add:
+                if self._is_in_group(room.room_id, group, user) or user in new_members:
+                    logger.debug(
+                        "User {} is already a member of group {} in room {}".format(user, group, room.room_id))
+                else:
+                    new_members.append(user)
 
-            with self.database.connect() as conn:
-                for user in users_to_add:
-                    if self._is_in_group(conn, room.room_id, group, user):
-                        logger.debug(
-                            "User {} is already a member of group {} in room {}".format(user, group, room.room_id))
-                    else:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            "INSERT OR IGNORE INTO highlight_groups(ROOM_ID,GROUP_NAME,MEMBER) VALUES(?,?,?)",
-                            (room.room_id, group, user))
-                        conn.commit()
-                        logger.debug("Inserted {} into group {} with id {}".format(user, group, cursor.lastrowid))
-                        new_members.append(user)
+            if new_members:
+                self.database.writemany(
+                    "INSERT OR IGNORE INTO highlight_groups(ROOM_ID,GROUP_NAME,MEMBER) VALUES(?,?,?)",
+                    [(room.room_id, group, user) for user in new_members])
+                self.groups.setdefault(room.room_id, {}).setdefault(group, set()).update(new_members)
+                logger.debug("Inserted {} into group {}".format(new_members, group))
 
             if new_members:
                 await self.matrix.send_text_to_room(
@@ -165,27 +172,22 @@ class Highlight:
         return
 
     async def _delete_from_group(self, room: MatrixRoom, message):
-        arguments = command_utility.get_argument(message).split()
+        arguments = message.argument_tokens
         group = arguments[0].lower()
         members_to_remove = arguments[1:]
         logger.debug("User wants to remove {} from {}".format(members_to_remove, group))
         if group and len(members_to_remove) > 0:
             for member in members_to_remove:
-                if not self.matrix.get_user(room, member):
-                    await self.matrix.send_text_to_room("User: {} is not in room".format(member), room.room_id)
+                if not await self._is_user_in_room(room, member, "User: {} is not in room"):
                     return
 
-            removed_members = []
-            with self.database.connect() as conn:
-                for member in members_to_remove:
-                    if self._is_in_group(conn, room.room_id, group, member):
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            "DELETE FROM highlight_groups WHERE room_id = ? AND group_name = ? and member = ?",
-                            (room.room_id, group, member))
-                        conn.commit()
-                        removed_members.append(member)
+            removed_members = [member for member in dict.fromkeys(members_to_remove)
+                               if self._is_in_group(room.room_id, group, member)]
             if removed_members:
+                self.database.writemany(
+                    "DELETE FROM highlight_groups WHERE room_id = ? AND group_name = ? and member = ?",
+                    [(room.room_id, group, member) for member in removed_members])
+                self._remove_from_index(room.room_id, group, removed_members)
                 logger.debug(
                     "Removed {} from group {} in room {}".format(", ".join(removed_members), group, room.room_id))
                 await self.matrix.send_text_to_room(
@@ -203,23 +205,39 @@ class Highlight:
                 room.room_id)
         return
 
-    @staticmethod
-    def _is_in_group(conn, room_id, group, member) -> bool:
-        result = conn.execute(
-            "SELECT 1 FROM highlight_groups WHERE room_id = ? AND group_name = ? AND member = ? LIMIT 1",
-            (room_id, group, member))
-        result = result.fetchone()
-        return result is not None
+    async def _is_user_in_room(self, room: MatrixRoom, user, not_in_room_message) -> bool:
+        """ Tell the room if the user is not in it, or if several members have the user as display name """
+        try:
+            if self.matrix.get_user(room, user):
+                return True
+            await self.matrix.send_text_to_room(not_in_room_message.format(user), room.room_id)
+        except AmbiguousUserError:
+            await self.matrix.send_text_to_room(
+                "User: \"{}\" matches several members, use their user id instead".format(user), room.room_id)
+        return False
+
+    def _is_in_group(self, room_id, group, member) -> bool:
+        return member in self.groups.get(room_id, {}).get(group, ())
+
+    def _remove_from_index(self, room_id, group, members):
+        room_groups = self.groups.get(room_id, {})
+        room_groups.get(group, set()).difference_update(members)
+        if not room_groups.get(group):
+            room_groups.pop(group, None)
 
     def _get_members(self, room: MatrixRoom, group) -> list:
-        return [row[0] for row in
-                self.database.connect().execute(
-                    "SELECT member FROM highlight_groups WHERE room_id = ? AND group_name = ?",
-                    (room.room_id, group)).fetchall()]
+        return sorted(self.groups.get(room.room_id, {}).get(group, ()))
 
     def _get_member_user_ids_except_sender(self, room: MatrixRoom, group, sender_user_id) -> list:
-        member_user_ids = [self.matrix.get_user(room, member).user_id for member in self._get_members(room, group) if
-                           self.matrix.get_user(room, member) is not None]
+        member_user_ids = []
+        for member in self._get_members(room, group):
+            try:
+                user = self.matrix.get_user(room, member)
+            except AmbiguousUserError:
+                logger.debug("Not highlighting {}, as several members have the display name".format(member))
+                continue
+            if user is not None:
+                member_user_ids.append(user.user_id)
         return self._remove_element(member_user_ids, sender_user_id)
 
     def _remove_element(self, list_to_remove_from, element_to_remove):
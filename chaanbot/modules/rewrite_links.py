@@ -0,0 +1,41 @@
+""" The rewrite links module rewrites links by rules in the config, e.g. AMP urls into normal urls and youtube shorts
+into normal youtube urls. All links rewritten in a message are sent in one reply.
+Available commands:
+None, will trigger on links matching a rule.
+Usage example:
+[Xhark]: https://news.com/amp/russia-loses-ukraine-war and https://youtube.com/shorts/_mLniGHJwzI
+Would results in:
+"Bot: Fixed your link(s): https://news.com/russia-loses-ukraine-war
+https://youtube.com/watch?v=_mLniGHJwzI"
+"""
+
+import os
+
+from nio import RoomMessage, MatrixRoom
+
+from chaanbot import url_rewriter
+from chaanbot.database import Database
+from chaanbot.http_client import HttpClient
+from chaanbot.matrix import Matrix
+from chaanbot.parsed_message import parse
+from chaanbot.url_rewriter import UrlRewriter
+
+
+class RewriteLinks:
+    always_run = True  # Run on all messages, even if other modules has activated
+    output_message_prefix = ""
+
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient):
+        self.matrix = matrix
+        self.http_client = http_client
+        self.output_message_prefix = config.get("rewrite_links", "prefix_message",
+                                                fallback="Fixed your link(s): ")
+        self.url_rewriter = UrlRewriter(url_rewriter.load_rules(config, "rewrite_links"))
+
+    async def run(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
+        hits = self.url_rewriter.rewrite_all(parse(message).urls)
+        if hits:
+            msg = self.output_message_prefix + os.linesep.join(hits)
+            await self.matrix.send_text_to_room(msg, room.room_id)
+
+        return False  # The module does not use commands and should not return that it has handled one
@@ -7,46 +7,134 @@ https://twitter.com/Twitter/status/1445078208190291973
 Would result in:
 "Bot: hello literally everyone"
 """
+import asyncio
+import codecs
 import logging
 import re
+from typing import Optional
 
+import aiohttp
 from bs4 import BeautifulSoup
 from nio import MatrixRoom, RoomMessage
 
+from chaanbot import config_utility
+from chaanbot.budget import BudgetManager
+from chaanbot.cache import TtlCache, SingleFlight, MISSING
 from chaanbot.database import Database
+from chaanbot.html_extractor import ElementTextExtractor
+from chaanbot.http_client import HttpClient
 from chaanbot.matrix import Matrix
+from chaanbot.parsed_message import parse, Url
 
 logger = logging.getLogger("weather")
 
 
 class Twitter:
     always_run = True  # Run on all messages, even if other modules has activated
+    twitter_hosts = ["twitter.com", "www.twitter.com", "mobile.twitter.com", "nitter.net"]
+    nitter_url = "https://nitter.net"
+    status_id_regex = re.compile(r"/status(?:es)?/(\d+)")
+    tweet_body_classes = ["tweet-content", "media-body"]
+    budget_service = "nitter"
+    default_requests_per_minute = 10  # Nitter rate limits scraping aggressively
+    default_cache_seconds = 60 * 60
+    default_failure_cache_seconds = 60
+    max_cached_tweets = 1000
+    default_max_concurrent_fetches = 4
 
-    def __init__(self, config, matrix: Matrix, database: Database, requests):
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient,
+                 budget: Optional[BudgetManager] = None):
         self.matrix = matrix
-        self.requests = requests
+        self.http_client = http_client
         self.output_message_prefix = config.get("twitter", "prefix_message", fallback="Tweet body text:")
+        # Texts of tweets by status id, as the same tweet is often posted in several rooms
+        self.tweet_cache = TtlCache(self.max_cached_tweets, config_utility.get_float(
+            config, "twitter", "cache_seconds", self.default_cache_seconds))
+        self.failure_cache_seconds = config_utility.get_float(config, "twitter", "failure_cache_seconds",
+                                                              self.default_failure_cache_seconds)
+        self.fetch_semaphore = asyncio.Semaphore(max(1, config_utility.get_int(
+            config, "twitter", "max_concurrent_fetches", self.default_max_concurrent_fetches)))
+        self.tweet_requests = SingleFlight()
+        self.budget = budget
+        if self.budget:
+            self.budget.register(self.budget_service, config_utility.get_float(
+                config, "twitter", "requests_per_minute", self.default_requests_per_minute))
 
     async def run(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
-        links = re.findall(r"http[s]*://[w{3}.]*twitter\.com[^\s]+", message, re.IGNORECASE)
-        links = [link.replace("twitter.com", "nitter.net") for link in links]
-        texts = [self._getText(link) for link in links]
-        if texts and all(texts):
+        urls = [url for url in parse(message).urls if url.host in self.twitter_hosts]
+        # Fetched at once and kept in order. A tweet which could not be fetched does not stop the others being sent
+        results = await asyncio.gather(*[self._get_tweet_text(url) for url in urls], return_exceptions=True)
+        texts = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to get tweet {}: {!r}".format(url.url, result))
+            elif result:
+                texts.append(result)
+        if texts:
             await self.matrix.send_text_to_room("\n".join([self.output_message_prefix + ' ' + link for link in texts]),
                                                 room.room_id)
 
         return False  # The module does not use commands and should not return that it has handled one
 
-    def _getText(self, link) -> str:
+    async def _get_tweet_text(self, url: Url) -> str:
+        """ Get the text of the tweet from the cache, or fetch it from Nitter. Failures are cached for a short while """
+        status_id = self._get_status_id(url)
+        text = self.tweet_cache.get(status_id, MISSING) if status_id else MISSING
+        if text is not MISSING:
+            logger.debug("Using cached text of tweet {}".format(status_id))
+            return text
+
+        link = self.nitter_url + url.path  # Any twitter or nitter link, without query string
+        return await self.tweet_requests.run(status_id or link, lambda: self._fetch_tweet_text(link, status_id))
+
+    async def _fetch_tweet_text(self, link, status_id) -> str:
+        if self.budget and not self.budget.try_acquire(self.budget_service):
+            logger.info("No budget left for fetching tweet {}".format(link))
+            return ""
+        try:
+            async with self.fetch_semaphore:
+                text = await self._getText(link)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:  # E.g. the Nitter instance is down
+            logger.warning("Failed to fetch tweet {}: {!r}".format(link, error))
+            text = ""
+        if status_id:
+            self.tweet_cache.set(status_id, text, None if text else self.failure_cache_seconds)
+        return text
+
+    def _get_status_id(self, url: Url) -> Optional[str]:
+        match = self.status_id_regex.search(url.path)
+        return match.group(1) if match else None
+
+    async def _getText(self, link) -> str:
+        """ Read the page until the tweet body has been received. If the tweet body could not be extracted from it,
+        the whole page is parsed with BeautifulSoup instead """
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/111.0'
         }
-        response = self.requests.get(link, headers=headers)
-        if response.status_code == 200:
-            content = response.content
-            soup = BeautifulSoup(content, 'html.parser')
-            found = soup.find('div', {
-                'class': 'tweet-content media-body'})
-            if found:
-                return found.get_text()
+        async with self.http_client.stream(link, headers=headers) as response:
+            if response.status_code != 200:
+                return ""
+            extractor = ElementTextExtractor("div", self.tweet_body_classes)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            content = bytearray()
+            async for chunk in response.iter_chunks():
+                content.extend(chunk)
+                try:
+                    extractor.feed(decoder.decode(chunk))
+                except Exception as exception:
+                    logger.debug("Could not extract tweet from {} while reading: {}".format(link, str(exception)))
+                    break
+                if extractor.done:
+                    return extractor.text
+            async for chunk in response.iter_chunks():  # Read the rest of the page for BeautifulSoup
+                content.extend(chunk)
+        return self._get_text_from_page(bytes(content))
+
+    @staticmethod
+    def _get_text_from_page(content: bytes) -> str:
+        soup = BeautifulSoup(content, 'html.parser')
+        found = soup.find('div', {
+            'class': 'tweet-content media-body'})
+        if found:
+            return found.get_text()
         return ""
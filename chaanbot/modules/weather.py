@@ -14,15 +14,20 @@ Would results in (something similar to):
         Tomorrow: Min: 25.1, Max: 30.3. Sunny
         2 days from now: Min: -15, Max: -10. Heavy snow"
 """
+import asyncio
 import logging
 import re
-from typing import Optional
+from typing import Optional, Tuple
 
 from nio import MatrixRoom, RoomMessage
 
-from chaanbot import command_utility
+from chaanbot import command_utility, config_utility
+from chaanbot.budget import BudgetManager, BudgetExhaustedError
+from chaanbot.cache import TtlCache, SingleFlight, MISSING
 from chaanbot.database import Database
+from chaanbot.http_client import HttpClient
 from chaanbot.matrix import Matrix
+from chaanbot.parsed_message import parse
 
 logger = logging.getLogger("weather")
 
@@ -43,9 +48,40 @@ class Weather:
         }
     }
 
-    def __init__(self, config, matrix: Matrix, database: Database, requests):
+    default_cache_grid_degrees = 0.1  # Roughly 10 km
+    default_current_cache_seconds = 10 * 60  # Current weather is updated about every 10 minutes
+    default_daily_cache_seconds = 60 * 60
+    max_cached_forecasts = 1000
+    cache_metrics_log_every = 100  # Log the hit rate of the forecast cache every this many lookups
+    default_prefetch_daily_budget = 500
+    budget_service = "openweathermap"
+    default_requests_per_minute = 60
+    default_daily_quota = 1000  # Free calls per day of the One Call API
+
+    def __init__(self, config, matrix: Matrix, database: Database, http_client: HttpClient,
+                 budget: Optional[BudgetManager] = None):
         self.matrix = matrix
-        self.requests = requests
+        self.http_client = http_client
+        self.cache_grid_degrees = config_utility.get_float(config, "weather", "cache_grid_degrees",
+                                                           self.default_cache_grid_degrees)
+        self.current_cache_seconds = config_utility.get_float(config, "weather", "current_cache_seconds",
+                                                              self.default_current_cache_seconds)
+        self.daily_cache_seconds = config_utility.get_float(config, "weather", "daily_cache_seconds",
+                                                            self.default_daily_cache_seconds)
+        # Forecasts for an area, i.e. coordinates rounded to the grid, kept as long as their daily part is fresh
+        self.forecast_cache = TtlCache(self.max_cached_forecasts, max(self.current_cache_seconds,
+                                                                      self.daily_cache_seconds))
+        self.forecast_requests = SingleFlight()
+        self.prefetch = config_utility.get_bool(config, "weather", "prefetch", False)
+        self.prefetch_daily_budget = config_utility.get_int(config, "weather", "prefetch_daily_budget",
+                                                            self.default_prefetch_daily_budget)
+        self.prefetch_task = None  # type: Optional[asyncio.Future]
+        self.budget = budget
+        if self.budget:
+            self.budget.register(self.budget_service,
+                                 config_utility.get_float(config, "weather", "requests_per_minute",
+                                                          self.default_requests_per_minute),
+                                 config_utility.get_int(config, "weather", "daily_quota", self.default_daily_quota))
         api_key = config.get("weather", "api_key", fallback=None)
         if api_key:
             self.api_key = api_key
@@ -56,21 +92,31 @@ class Weather:
         if database:
             self.database = database
             logger.debug("Initializing database if needed")
-            conn = database.connect()
-            conn.execute('''CREATE TABLE IF NOT EXISTS user_coordinates
+            database.run_blocking(lambda conn: conn.execute('''CREATE TABLE IF NOT EXISTS user_coordinates
             (ID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
             ROOM_ID TEXT NOT NULL,
             USER_ID TEXT NOT NULL,
             LATITUDE TEXT NOT NULL,
             LONGITUDE TEXT NOT NULL,
-            UNIQUE(ROOM_ID, USER_ID));    
-            ''')
-            conn.commit()
+            UNIQUE(ROOM_ID, USER_ID));
+            '''))
         else:
             self.disabled = True
             logger.info("No database provided, weather module disabled")
 
+    async def start(self):
+        if self.prefetch and self.prefetch_daily_budget > 0 and not hasattr(self, "disabled"):
+            logger.info("Prefetching forecasts using at most {} requests per day".format(self.prefetch_daily_budget))
+            self.prefetch_task = asyncio.ensure_future(self._prefetch_forever())
+
+    async def stop(self):
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+            await asyncio.gather(self.prefetch_task, return_exceptions=True)
+            self.prefetch_task = None
+
     async def run(self, room: MatrixRoom, event: RoomMessage, message) -> bool:
+        message = parse(message)
         if self.should_run(message):
             logger.debug("Should run weather, checking next command")
             if command_utility.matches(self.operations["weather"], message):
@@ -88,21 +134,22 @@ class Weather:
         return not hasattr(self, "disabled") and command_utility.matches(self.operations, message)
 
     async def _send_weather(self, room: MatrixRoom, user_id, message):
-        latitude, longitude = self._get_coordinates(room, user_id)
+        latitude, longitude = await self._get_coordinates(room, user_id)
         if not latitude or not longitude:
             await self.matrix.send_text_to_room("Set your coordinates by using !setcoordinates [LATITUDE] [LONGITUDE].",
                                                 room.room_id)
             return
 
-        argument = command_utility.get_argument(message)
+        argument = message.argument
 
-        if argument:
-            days = argument.strip().split(" ")
-            await self._send_several_days_weather(room, latitude, longitude, days)
-            return
-        else:
-            await self._send_todays_weather(room, latitude, longitude)
-            return
+        try:
+            if argument:
+                days = argument.strip().split(" ")
+                await self._send_several_days_weather(room, latitude, longitude, days)
+            else:
+                await self._send_todays_weather(room, latitude, longitude)
+        except BudgetExhaustedError:
+            await self.matrix.send_text_to_room("Weather quota exhausted, try again later.", room.room_id)
 
     async def _send_several_days_weather(self, room: MatrixRoom, latitude, longitude, days):
         if len(days) > self.max_days_to_send_at_once:
@@ -111,10 +158,7 @@ class Weather:
                 room.room_id)
             return
 
-        url = "{}?exclude=minutely,hourly&lat={}&lon={}&appid={}&units=metric" \
-            .format(self.weather_api_url, latitude, longitude, self.api_key)
-
-        contents = self.requests.get(url).json()
+        contents = await self._get_forecast(latitude, longitude, self.daily_cache_seconds)
         message_for_one_day = "{} Max: {}, Min: {}\t{}\n"
         message = ""
         for days_from_today in days:
@@ -129,10 +173,7 @@ class Weather:
         await self.matrix.send_text_to_room(message, room.room_id)
 
     async def _send_todays_weather(self, room: MatrixRoom, latitude, longitude):
-        url = "{}?exclude=minutely,hourly&lat={}&lon={}&appid={}&units=metric" \
-            .format(self.weather_api_url, latitude, longitude, self.api_key)
-
-        contents = self.requests.get(url).json()
+        contents = await self._get_forecast(latitude, longitude, self.current_cache_seconds)
         current_temp = str(contents["current"]["temp"])
         min_temp = str(contents["daily"][0]["temp"]["min"])
         max_temp = str(contents["daily"][0]["temp"]["max"])
@@ -142,29 +183,89 @@ class Weather:
             .format(current_temp, max_temp, min_temp, summary)
         await self.matrix.send_text_to_room(message, room.room_id)
 
+    async def _get_forecast(self, latitude, longitude, max_age_seconds) -> dict:
+        """ Get the forecast for the area of the coordinates, from the cache if it is at most max_age_seconds old.
+        Users asking for the same area at the same time share one request. """
+        area = self._get_area(latitude, longitude)
+        forecast = self.forecast_cache.get(area, MISSING, max_age_seconds)
+        if (self.forecast_cache.hits + self.forecast_cache.misses) % self.cache_metrics_log_every == 0:
+            self._log_cache_metrics()
+        if forecast is not MISSING:
+            logger.debug("Using cached forecast for {}".format(area))
+            return forecast
+        return await self.forecast_requests.run(area, lambda: self._request_forecast(area, BudgetManager.INTERACTIVE))
+
+    def _log_cache_metrics(self):
+        metrics = self.forecast_cache.get_metrics()
+        lookups = metrics["hits"] + metrics["misses"]
+        logger.info("Forecast cache has {} areas, {} of {} lookups were hits ({:.0%})".format(
+            metrics["size"], metrics["hits"], lookups, metrics["hits"] / lookups if lookups else 0))
+
+    async def _prefetch_forever(self):
+        """ Prefetch one forecast at a time, spread out so at most prefetch_daily_budget requests are made a day """
+        interval_seconds = 24 * 60 * 60 / self.prefetch_daily_budget
+        prefetches, prefetches_per_hour = 0, max(1, round(60 * 60 / interval_seconds))
+        while True:
+            try:
+                await self._prefetch(interval_seconds)
+            except BudgetExhaustedError:
+                logger.debug("No budget left for prefetching forecasts")
+            except Exception as exception:
+                logger.warning("Failed to prefetch forecast: {}".format(str(exception)))
+            prefetches += 1
+            if prefetches % prefetches_per_hour == 0:
+                self._log_cache_metrics()
+            await asyncio.sleep(interval_seconds)
+
+    async def _prefetch(self, interval_seconds) -> Optional[Tuple[float, float]]:
+        """ Refresh the oldest forecast of the areas users have set coordinates in, unless it will still be recent
+        enough for the current weather at the next prefetch. Returns the refreshed area """
+        areas = {self._get_area(latitude, longitude) for latitude, longitude in
+                 await self.database.fetchall("SELECT DISTINCT LATITUDE, LONGITUDE FROM user_coordinates")}
+        if not areas:
+            return None
+        ages = {area: self.forecast_cache.get_age(area) for area in areas}
+        area = max(areas, key=lambda area_to_compare: float("inf") if ages[area_to_compare] is None
+                   else ages[area_to_compare])
+        if ages[area] is not None and ages[area] + interval_seconds < self.current_cache_seconds:
+            return None
+        logger.debug("Prefetching forecast for {}".format(area))
+        await self.forecast_requests.run(area, lambda: self._request_forecast(area, BudgetManager.BACKGROUND))
+        return area
+
+    async def _request_forecast(self, area: Tuple[float, float], priority) -> dict:
+        if self.budget and not self.budget.try_acquire(self.budget_service, priority):
+            raise BudgetExhaustedError("No budget left for {}".format(self.budget_service))
+        url = "{}?exclude=minutely,hourly&lat={}&lon={}&appid={}&units=metric" \
+            .format(self.weather_api_url, area[0], area[1], self.api_key)
+        forecast = (await self.http_client.get(url)).json()
+        if isinstance(forecast, dict) and "daily" in forecast:  # Do not cache errors
+            self.forecast_cache.set(area, forecast)
+        return forecast
+
+    def _get_area(self, latitude, longitude) -> Tuple[float, float]:
+        """ Round the coordinates to the cache grid, so nearby users share cached forecasts """
+        if self.cache_grid_degrees <= 0:
+            return float(latitude), float(longitude)
+        return (round(round(float(latitude) / self.cache_grid_degrees) * self.cache_grid_degrees, 6),
+                round(round(float(longitude) / self.cache_grid_degrees) * self.cache_grid_degrees, 6))
+
     async def _add_coordinates(self, room: MatrixRoom, user_id, message):
-        argument = command_utility.get_argument(message).strip()
+        argument = message.argument.strip()
 
         split_argument = re.split(';|,|\\s', argument, 1)
         latitude = split_argument[0].strip()
         longitude = split_argument[1].strip()
-        conn = self.database.connect()
-        cursor = conn.cursor()
-        cursor.execute(
+        self.database.write(
             "INSERT OR REPLACE INTO user_coordinates(ROOM_ID, USER_ID, LATITUDE, LONGITUDE) "
             "VALUES(?,?,?,?)",
             (room.room_id, user_id, latitude, longitude))
-        conn.commit()
         logger.debug(
-            "Inserted Lat {} Long {} for user_id {} and room {} with id {}".format(latitude, longitude, user_id,
-                                                                                   room.room_id, cursor.lastrowid))
+            "Inserted Lat {} Long {} for user_id {} and room {}".format(latitude, longitude, user_id, room.room_id))
         await self.matrix.send_text_to_room("Coordinates set to {},{}.".format(latitude, longitude), room.room_id)
 
-    def _get_coordinates(self, room: MatrixRoom, user_id) -> (Optional[str], Optional[str]):
-        conn = self.database.connect()
-        result = conn.execute(
+    async def _get_coordinates(self, room: MatrixRoom, user_id) -> (Optional[str], Optional[str]):
+        result = await self.database.fetchone(
             "SELECT LATITUDE,LONGITUDE FROM user_coordinates WHERE ROOM_ID = ? AND USER_ID = ?",
             (room.room_id, user_id))
-        conn.commit()
-        result = result.fetchone()
         return (result[0], result[1]) if result else (None, None)
@@ -0,0 +1,67 @@
+""" A message which is parsed once and shared by all modules """
+
+import re
+from collections import namedtuple
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+Url = namedtuple("Url", ["url", "host", "path"])
+
+_url_regex = re.compile(r"https?://[^\s]+", re.IGNORECASE)
+
+
+class ParsedMessage(str):
+    """ The text of a message, which parses its command, argument and urls when first needed and then keeps them.
+    A message looks like: [command] [argument]. E.g. the command of "!hl test" is "!hl" and the argument "test".
+    As it is a str, modules may still treat it as the text of the message. """
+
+    _command_and_argument = None  # type: Optional[Tuple[str, str]]
+    _argument_tokens = None  # type: Optional[List[str]]
+    _urls = None  # type: Optional[List[Url]]
+
+    @property
+    def command(self) -> str:
+        return self._get_command_and_argument()[0]
+
+    @property
+    def command_token(self) -> str:
+        """ The command in lowercase, as commands are case-insensitive """
+        return self.command.lower()
+
+    @property
+    def argument(self) -> str:
+        return self._get_command_and_argument()[1]
+
+    @property
+    def argument_tokens(self) -> List[str]:
+        if self._argument_tokens is None:
+            self._argument_tokens = self.argument.split()
+        return self._argument_tokens
+
+    @property
+    def urls(self) -> List[Url]:
+        """ The http(s) urls in the message, with their lowercase host and path """
+        if self._urls is None:
+            self._urls = [_parse_url(url) for url in _url_regex.findall(self)]
+        return self._urls
+
+    def _get_command_and_argument(self) -> Tuple[str, str]:
+        if self._command_and_argument is None:
+            split_message = self.split(None, 1)
+            if not split_message:
+                self._command_and_argument = ("", "")
+            else:
+                self._command_and_argument = (split_message[0], split_message[1] if len(split_message) > 1 else "")
+        return self._command_and_argument
+
+
+def parse(message) -> ParsedMessage:
+    return message if isinstance(message, ParsedMessage) else ParsedMessage(message)
+
+
+def _parse_url(url) -> Url:
+    try:
+        split_url = urlsplit(url)
+        return Url(url, split_url.hostname or "", split_url.path)
+    except ValueError:  # E.g. an invalid port
+        return Url(url, "", "")
@@ -6,11 +6,12 @@ from time import sleep
 
 import appdirs
 import pkg_resources
-import requests as requests
 from nio import LoginError, AsyncClient
 
+from chaanbot.budget import BudgetManager
 from chaanbot.client import Client
 from chaanbot.database import Database
+from chaanbot.http_client import HttpClient
 from chaanbot.matrix import Matrix
 from chaanbot.module_loader import ModuleLoader
 from chaanbot.module_runner import ModuleRunner
@@ -30,11 +31,19 @@ async def main():
     if config.read(config_path):
         matrix_client = await _connect(config)
         matrix = Matrix(config, matrix_client)
-        database = Database(config.get("chaanbot", "sqlite_database_location", fallback=None))
-        module_loader = ModuleLoader(config, database, requests)
+        database = Database(config.get("chaanbot", "sqlite_database_location", fallback=None), config)
+        http_client = HttpClient(config)
+        budget = BudgetManager(config, database)
+        module_loader = ModuleLoader(config, database, http_client, budget)
         module_runner = ModuleRunner(config, matrix, module_loader)
-        chaanbot = Client(module_runner, config, matrix)
-        await chaanbot.run()
+        chaanbot = Client(module_runner, config, matrix, database)
+        budget.start()
+        try:
+            await chaanbot.run()
+        finally:
+            await budget.stop()
+            await http_client.close()
+            await database.close()
     else:
         logger.error("Could not read config file")
 
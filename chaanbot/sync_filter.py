@@ -0,0 +1,39 @@
+""" Builds the filter for syncing, so the server only sends the events the bot handles """
+
+import logging
+from typing import Iterable, Optional
+
+from chaanbot import config_utility
+
+logger = logging.getLogger("sync_filter")
+
+DEFAULT_TIMELINE_LIMIT = 20
+
+# State the bot itself uses: room members for invites and highlights, names and aliases to find rooms
+STATE_EVENT_TYPES = ["m.room.member", "m.room.name", "m.room.canonical_alias", "m.room.join_rules"]
+
+
+def build(config, event_types: Iterable[str]) -> Optional[dict]:
+    """ Build the sync filter for the event types modules handle. Returns None if filtering is turned off """
+    if not config_utility.get_bool(config, "chaanbot", "sync_filter", True):
+        return None
+
+    timeline_types = sorted(set(event_types) | set(STATE_EVENT_TYPES))
+    sync_filter = {
+        "presence": {"not_types": ["*"]},
+        "account_data": {"not_types": ["*"]},
+        "room": {
+            "state": {
+                "types": STATE_EVENT_TYPES,
+                "lazy_load_members": config_utility.get_bool(config, "chaanbot", "sync_lazy_load_members", False),
+            },
+            "timeline": {
+                "types": timeline_types,
+                "limit": config_utility.get_int(config, "chaanbot", "sync_timeline_limit", DEFAULT_TIMELINE_LIMIT),
+            },
+            "ephemeral": {"not_types": ["*"]},
+            "account_data": {"not_types": ["*"]},
+        },
+    }
+    logger.debug("Sync filter: {}".format(sync_filter))
+    return sync_filter
@@ -0,0 +1,141 @@
+""" Rewrites urls by rules from the config, e.g. to link to pages without AMP or to videos instead of shorts """
+
+import logging
+import re
+from collections import namedtuple
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from chaanbot import config_utility
+from chaanbot.parsed_message import Url
+
+logger = logging.getLogger("url_rewriter")
+
+ANY_HOST = "*"
+RULE_OPTION_PREFIX = "rule_"
+
+# Rewrites of the revamp and rewrite_youtube_shorts modules, which they replace. Rules with the same name override them
+DEFAULT_RULES = {
+    "amp": r"* /amp/(?=[^?#]) => /",
+    "youtube_shorts": r"youtube.com ^(https?://[^/]+)/shorts/(?=[^/?#]) => \1/watch?v=",
+}
+
+RewriteRule = namedtuple("RewriteRule", ["name", "host", "pattern", "replacement"])
+
+_rule_regex = re.compile(r"^(\S+)\s+(.+?)\s+=>(?:\s+(.*))?$")
+_backreference_regex = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def parse_rule(name, rule) -> RewriteRule:
+    """ Parse a rule written as: <host or *> <regex> => <replacement>. The regex is searched for in the url ignoring
+    case and every match is replaced, the replacement may refer to groups of the regex, e.g. \\1. A rule for a host
+    also applies to its subdomains. Raises ValueError if the rule is invalid """
+    match = _rule_regex.match(rule.strip())
+    if not match:
+        raise ValueError("Rule {} should look like: <host or *> <regex> => <replacement>".format(name))
+    host, pattern, replacement = match.groups()
+    try:
+        compiled_pattern = re.compile(pattern, re.IGNORECASE)
+    except re.error as error:
+        raise ValueError("Invalid regex in rule {}: {}".format(name, error))
+    return RewriteRule(name, host.lower(), compiled_pattern, replacement or "")
+
+
+def load_rules(config, section) -> List[RewriteRule]:
+    """ Load the rules in the section of the config, i.e. its options named rule_<name>, after the default rules.
+    An empty rule turns off the default rule with the same name, as does setting default_rules to false """
+    rules = dict(DEFAULT_RULES) if config_utility.get_bool(config, section, "default_rules", True) else {}
+    if config.has_section(section):
+        for option, rule in config.items(section):
+            if option.startswith(RULE_OPTION_PREFIX):
+                rules[option[len(RULE_OPTION_PREFIX):]] = rule
+
+    parsed_rules = []
+    for name, rule in rules.items():
+        if not rule.strip():
+            continue
+        try:
+            parsed_rules.append(parse_rule(name, rule))
+        except ValueError as error:
+            logger.warning("Ignoring rewrite rule: {}".format(error))
+    logger.debug("Loaded {} rewrite rules".format(len(parsed_rules)))
+    return parsed_rules
+
+
+class UrlRewriter:
+    """ Rewrites urls with the rules for their host. Rules are indexed by host, and the rules which may apply to a host
+    are combined into one regex, so each url is only searched once however many rules there are. """
+
+    def __init__(self, rules: Iterable[RewriteRule]):
+        self.rules = list(rules)
+        self._rules_by_host = {}  # type: Dict[str, List[int]] # Host: indexes of its rules
+        for index, rule in enumerate(self.rules):
+            self._rules_by_host.setdefault(rule.host, []).append(index)
+        self._any_host_rules = self._rules_by_host.pop(ANY_HOST, [])
+        self._any_host_matcher = _CombinedRules([self.rules[index] for index in self._any_host_rules])
+        # Matchers by the rule hosts a url host matched, which are few, unlike the hosts of urls
+        self._matchers = {}  # type: Dict[Tuple[str, ...], _CombinedRules]
+
+    def rewrite(self, url: Url) -> Optional[str]:
+        """ Rewrite the url with the rule matching earliest in it. Returns None if no rule changed the url """
+        matcher = self._get_matcher(url.host)
+        try:
+            rewritten_url = matcher.rewrite(url.url)
+        except re.error as error:  # E.g. a replacement referring to a group the regex does not have
+            logger.warning("Failed to rewrite {}: {}".format(url.url, error))
+            return None
+        return rewritten_url if rewritten_url != url.url else None
+
+    def rewrite_all(self, urls: Iterable[Url]) -> List[str]:
+        """ Rewrite the urls, and return those which were rewritten in the same order """
+        rewritten_urls = (self.rewrite(url) for url in urls)
+        return [rewritten_url for rewritten_url in rewritten_urls if rewritten_url]
+
+    def _get_matcher(self, host) -> "_CombinedRules":
+        rule_hosts = tuple(suffix for suffix in _get_host_suffixes(host) if suffix in self._rules_by_host)
+        if not rule_hosts:
+            return self._any_host_matcher
+        matcher = self._matchers.get(rule_hosts)
+        if matcher is None:
+            indexes = sorted(chain(self._any_host_rules, *(self._rules_by_host[rule_host] for rule_host in rule_hosts)))
+            matcher = _CombinedRules([self.rules[index] for index in indexes])
+            self._matchers[rule_hosts] = matcher
+        return matcher
+
+
+class _CombinedRules:
+    """ Rules combined into one regex, where the group which matched tells which rule it was """
+
+    def __init__(self, rules: List[RewriteRule]):
+        self.rules = rules
+        self.regex = None
+        # Backreferences would refer to the wrong groups in the combined regex, those rules are searched one by one
+        if rules and not any(_backreference_regex.search(rule.pattern.pattern) for rule in rules):
+            try:
+                self.regex = re.compile("|".join("({})".format(rule.pattern.pattern) for rule in rules), re.IGNORECASE)
+            except re.error:  # E.g. several rules using the same group name
+                pass
+            else:
+                # Number of the group enclosing each rule, as the groups of earlier rules come before it
+                group_indexes = [1]
+                for rule in rules[:-1]:
+                    group_indexes.append(group_indexes[-1] + rule.pattern.groups + 1)
+                self._rules_by_group_index = dict(zip(group_indexes, rules))
+
+    def rewrite(self, url) -> str:
+        if self.regex:
+            match = self.regex.search(url)
+            if not match:
+                return url
+            rule = self._rules_by_group_index[match.lastindex]  # The enclosing group is the last to close
+            return rule.pattern.sub(rule.replacement, url)
+        for rule in self.rules:
+            if rule.pattern.search(url):
+                return rule.pattern.sub(rule.replacement, url)
+        return url
+
+
+def _get_host_suffixes(host) -> List[str]:
+    """ E.g. www.youtube.com, youtube.com and com for www.youtube.com """
+    labels = host.split(".")
+    return [".".join(labels[index:]) for index in range(len(labels))]
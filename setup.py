@@ -37,13 +37,11 @@ setuptools.setup(
     license="GPLv3+",
     url="https://github.com/RichardNysater/chaanbot",
     packages=setuptools.find_packages(exclude=["chaanbot.modules.private"]),
-    install_requires=["matrix-nio", "appdirs", "requests", "beautifulsoup4"],
+    install_requires=["matrix-nio", "appdirs", "aiohttp", "requests", "beautifulsoup4"],
     package_data={'': ['chaanbot.cfg.sample']},
     classifiers=[
         "Development Status :: 4 - Beta",
         "Topic :: Communications :: Chat",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -51,7 +49,7 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     keywords="matrix chat bot",
-    python_requires=">=3.5",
+    python_requires=">=3.7",
     entry_points={
         'console_scripts': [
             'chaanbot=chaanbot.start:main',
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+from chaanbot.budget import BudgetManager
+from chaanbot.database import Database
+
+
+class TestBudgetManager(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.now = 0
+        self.config = Mock()
+        self.config.get.return_value = None
+        self.database_directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.database_directory.name, "chaanbot.db"))
+        self.budget = BudgetManager(self.config, self.database, clock=lambda: self.now)
+
+    async def asyncTearDown(self) -> None:
+        await self.database.close()
+        self.database_directory.cleanup()
+
+    def test_allow_calls_to_services_without_budget(self):
+        self.assertTrue(self.budget.try_acquire("service"))
+
+    def test_limit_rate_of_calls(self):
+        self.budget.register("service", requests_per_minute=2)
+
+        self.assertTrue(self.budget.try_acquire("service"))
+        self.assertTrue(self.budget.try_acquire("service"))
+        self.assertFalse(self.budget.try_acquire("service"))
+        self.now = 30
+        self.assertTrue(self.budget.try_acquire("service"))
+        self.assertFalse(self.budget.try_acquire("service"))
+
+    def test_limit_calls_per_day(self):
+        self.budget.register("service", requests_per_minute=60, daily_quota=2)
+
+        self.assertTrue(self.budget.try_acquire("service"))
+        self.assertTrue(self.budget.try_acquire("service"))
+        self.assertFalse(self.budget.try_acquire("service"))
+        self.assertEqual(0, self.budget.get_metrics()["service"]["remaining_today"])
+
+    def test_keep_budget_for_interactive_calls(self):
+        self.budget.register("service", requests_per_minute=60, daily_quota=4)
+
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertFalse(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.INTERACTIVE))
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.INTERACTIVE))
+        self.assertFalse(self.budget.try_acquire("service", BudgetManager.INTERACTIVE))
+
+    def test_keep_tokens_for_interactive_calls(self):
+        self.budget.register("service", requests_per_minute=4)
+
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertFalse(self.budget.try_acquire("service", BudgetManager.BACKGROUND))
+        self.assertTrue(self.budget.try_acquire("service", BudgetManager.INTERACTIVE))
+
+    async def test_keep_calls_made_today_after_restart(self):
+        self.budget.register("service", requests_per_minute=60, daily_quota=10)
+        self.budget.try_acquire("service")
+        self.budget.try_acquire("service")
+        await self.database.flush()
+
+        budget_after_restart = BudgetManager(self.config, self.database)
+        budget_after_restart.register("service", requests_per_minute=60, daily_quota=10)
+
+        self.assertEqual({"tokens": 60, "capacity": 60, "used_today": 2, "daily_quota": 10, "remaining_today": 8},
+                         budget_after_restart.get_metrics()["service"])
+
+    def test_reset_calls_made_today_on_new_day(self):
+        self.budget.register("service", requests_per_minute=60, daily_quota=1)
+        self.budget.try_acquire("service")
+        self.budget.services["service"].day = "2000-01-01"
+
+        self.assertTrue(self.budget.try_acquire("service"))
+
+    async def test_log_remaining_budget_periodically_while_used(self):
+        self.budget.metrics_log_interval_seconds = 0.01
+        self.budget.register("service", requests_per_minute=60, daily_quota=10)
+        self.budget.start()
+
+        with self.assertLogs("budget", "INFO") as logs:
+            self.budget.try_acquire("service")
+            await asyncio.sleep(0.05)
+        await self.budget.stop()
+
+        self.assertEqual(["INFO:budget:Budget of service: 59 of 60 requests available this minute, 1 used today, "
+                          "9 remaining"], logs.output)
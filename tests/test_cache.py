@@ -0,0 +1,89 @@
+import asyncio
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from chaanbot.cache import TtlCache, SingleFlight, MISSING
+
+
+class TestTtlCache(TestCase):
+
+    def setUp(self) -> None:
+        self.now = 0
+        self.cache = TtlCache(max_size=2, ttl_seconds=10, clock=lambda: self.now)
+
+    def test_get_cached_value(self):
+        self.cache.set("key", "value")
+
+        self.assertEqual("value", self.cache.get("key"))
+        self.assertEqual({"size": 1, "hits": 1, "misses": 0}, self.cache.get_metrics())
+
+    def test_get_missing_value(self):
+        self.assertIs(MISSING, self.cache.get("key"))
+        self.assertIsNone(self.cache.get("key", None))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_cache_none(self):
+        self.cache.set("key", None)
+
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_values_expire(self):
+        self.cache.set("key", "value")
+        self.cache.set("short", "value", ttl_seconds=1)
+        self.now = 5
+
+        self.assertIs(MISSING, self.cache.get("short"))
+        self.assertEqual("value", self.cache.get("key"))
+        self.now = 10
+        self.assertIs(MISSING, self.cache.get("key"))
+        self.assertEqual(0, len(self.cache))
+
+    def test_max_age_of_value(self):
+        self.cache.set("key", "value")
+        self.now = 5
+
+        self.assertIs(MISSING, self.cache.get("key", max_age_seconds=4))
+        self.assertEqual("value", self.cache.get("key", max_age_seconds=5))
+
+    def test_remove_least_recently_used_when_full(self):
+        self.cache.set("key1", "value1")
+        self.cache.set("key2", "value2")
+        self.cache.get("key1")
+
+        self.cache.set("key3", "value3")
+
+        self.assertIs(MISSING, self.cache.get("key2"))
+        self.assertEqual("value1", self.cache.get("key1"))
+        self.assertEqual("value3", self.cache.get("key3"))
+
+
+class TestSingleFlight(IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_share_one_call(self):
+        function = AsyncMock()
+
+        async def slow_call():
+            await asyncio.sleep(0.01)
+            return await function()
+
+        function.return_value = "value"
+        single_flight = SingleFlight()
+
+        results = await asyncio.gather(single_flight.run("key", slow_call), single_flight.run("key", slow_call),
+                                       single_flight.run("other key", slow_call))
+
+        self.assertEqual(["value", "value", "value"], results)
+        self.assertEqual(2, function.await_count)
+        self.assertEqual(0, len(single_flight))
+
+    async def test_failing_call_fails_all_callers(self):
+        async def failing_call():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("failure")
+
+        single_flight = SingleFlight()
+
+        results = await asyncio.gather(single_flight.run("key", failing_call), single_flight.run("key", failing_call),
+                                       return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
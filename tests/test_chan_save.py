@@ -1,6 +1,12 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
 from unittest import IsolatedAsyncioTestCase
-from unittest.mock import patch, mock_open, AsyncMock, Mock
+from unittest.mock import patch, mock_open, AsyncMock, Mock, MagicMock, call
 
+from chaanbot.database import Database
 from chaanbot.modules.chan_save import ChanSave
 
 
@@ -10,15 +16,27 @@ class TestChanSave(IsolatedAsyncioTestCase):
     event = {"sender": "user_id"}
     link = "https://4chan.org/g/stallman.jpg"
     sha1_hash_of_link = "5e323b28aa4445bf42f9359ce7b66cbcb12f3c89"
+    part_filename = hashlib.sha1(b"4cdn.org/g/stallman.jpg").hexdigest() + ".jpg.part"
 
     @patch('os.access', return_value=True)
     async def asyncSetUp(self, mock_os_access) -> None:
         config = Mock()
         config.get.side_effect = self.get_config_side_effect
-        self.requests = Mock()
+        self.http_client = AsyncMock()
         self.room = AsyncMock()
+        self.room.room_id = "!room:server"
         self.matrix = AsyncMock()
-        self.chan_save = ChanSave(config, self.matrix, AsyncMock(), self.requests)
+        self.save_directory = tempfile.TemporaryDirectory()
+        self.database_directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.database_directory.name, "chaanbot.db"))
+        self.chan_save = ChanSave(config, self.matrix, self.database, self.http_client)
+        self.chan_save.save_dirpath = self.save_directory.name + "/"
+
+    async def asyncTearDown(self) -> None:
+        await self.chan_save.stop()
+        await self.database.close()
+        self.save_directory.cleanup()
+        self.database_directory.cleanup()
 
     async def test_config_has_properties(self):
         self.assertTrue(self.chan_save.always_run)
@@ -26,75 +44,522 @@ class TestChanSave(IsolatedAsyncioTestCase):
         self.assertIsNotNone(self.chan_save.save_dirpath)
         self.assertFalse(hasattr(self.chan_save, "disabled"))
 
+    @patch('os.access', return_value=True)
+    async def test_serve_saved_files_at_path_of_url_to_access_saved_files(self, mock_os_access):
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: {
+            "save_dirpath": self.save_directory.name,
+            "url_to_access_saved_files": "http://127.0.0.1:8080/i",
+            "serve_port": "8080"}.get(option)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
+
+        self.assertEqual(self.save_directory.name + "/", chan_save.file_server.directory)
+        self.assertEqual("127.0.0.1", chan_save.file_server.host)
+        self.assertEqual(8080, chan_save.file_server.port)
+        self.assertEqual("/i/", chan_save.file_server.path_prefix)
+        self.assertEqual(chan_save._record_access, chan_save.file_server.on_file_access)
+
+    async def test_dont_serve_saved_files_if_no_serve_port(self):
+        self.assertIsNone(self.chan_save.file_server)
+
     @patch('os.access', return_value=True)
     async def test_disabled_if_no_save_dirpath(self, mock_os_access):
         config = Mock()
         config.get.side_effect = self.get_config_side_effect_without_save_dirpath
-        chan_save = ChanSave(config, AsyncMock(), AsyncMock(), self.requests)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
         self.assertTrue(chan_save.disabled)
 
     @patch('os.access', return_value=True)
     async def test_enabled_if_no_url_to_access_saved_files(self, mock_os_access):
         config = Mock()
         config.get.side_effect = self.get_config_side_effect_without_url_to_access_saved_files
-        chan_save = ChanSave(config, AsyncMock(), AsyncMock(), self.requests)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
         self.assertFalse(hasattr(chan_save, "disabled"))
 
     @patch('os.access', return_value=False)  # No write access
     async def test_disabled_if_no_write_access(self, mock_os_access):
         config = Mock()
         config.get.side_effect = self.get_config_side_effect
-        chan_save = ChanSave(config, AsyncMock(), AsyncMock(), self.requests)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
         self.assertTrue(chan_save.disabled)
 
-    @patch("builtins.open", new_callable=mock_open)
-    async def test_save_4chan_media_and_send_URL(self, mock_open):
-        await self.chan_save.run(self.room, self.event, self.link)
+    async def test_save_4chan_media_and_send_URL(self):
+        self._mock_response(200, b"media")
 
-        expected_message = "File saved to {}{}{} .".format(self.chan_save.url_to_access_saved_files,
-                                                           self.sha1_hash_of_link, ".jpg")
+        await self._run(self.link)
+
+        expected_message = "File saved to {}{} .".format(self.chan_save.url_to_access_saved_files,
+                                                         self._get_filename(b"media", "jpg"))
         self.matrix.send_text_to_room.assert_called_with(expected_message, self.room.room_id)
-        self.requests.get.assert_called_once()
-        mock_open().write.assert_called_once()
+        self.http_client.stream.assert_called_once()
+        self.assertEqual(b"media", self._read_saved_file(self._get_filename(b"media", "jpg")))
 
-    @patch("builtins.open", new_callable=mock_open)
     @patch('os.access', return_value=True)
-    async def test_save_4chan_media_and_dont_send_URL(self, mock_os_access, mock_open):
+    async def test_save_4chan_media_and_dont_send_URL(self, mock_os_access):
         config = Mock()
         config.get.side_effect = self.get_config_side_effect_without_url_to_access_saved_files
-        chan_save = ChanSave(config, AsyncMock(), AsyncMock(), self.requests)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
+        chan_save.save_dirpath = self.chan_save.save_dirpath
+        self._mock_response(200, b"media")
 
-        await chan_save.run(self.room, self.event, self.link)
+        await self._run(self.link, chan_save)
 
-        self.requests.get.assert_called_once()
-        mock_open().write.assert_called_once()
+        self.http_client.stream.assert_called_once()
+        self.assertEqual(b"media", self._read_saved_file(self._get_filename(b"media", "jpg")))
         self.room.send_text.assert_not_called()
 
+    async def test_stream_media_to_part_file_and_rename_it_when_complete(self):
+        part_filepath = os.path.join(self.save_directory.name, self.part_filename)
+        chunks_written = []
+
+        def chunk_written():
+            chunks_written.append(os.path.getsize(part_filepath))
+            self.assertEqual([self.part_filename], os.listdir(self.save_directory.name))
+
+        self._mock_response(200, b"0123456789", after_chunk=chunk_written)
+
+        await self._run(self.link)
+
+        self.assertEqual(b"0123456789", self._read_saved_file(self._get_filename(b"0123456789", "jpg")))
+        self.assertFalse(os.path.exists(part_filepath))
+        self.assertEqual(3, len(chunks_written))
+
+    async def test_resume_interrupted_download(self):
+        with open(os.path.join(self.save_directory.name, self.part_filename), "wb") as file:
+            file.write(b"01234")
+        self._mock_response(206, b"56789", headers={"Content-Range": "bytes 5-9/10"})
+
+        await self._run(self.link)
+
+        self.assertEqual({"Range": "bytes=5-"}, self.http_client.stream.call_args.kwargs["headers"])
+        self.assertEqual(b"0123456789", self._read_saved_file(self._get_filename(b"0123456789", "jpg")))
+
+    async def test_restart_download_if_part_file_can_not_be_resumed(self):
+        for response in [self._create_response(416, b""),
+                         self._create_response(206, b"3456789", headers={"Content-Range": "bytes 3-9/10"}),
+                         self._create_response(206, b"56789")]:
+            with open(os.path.join(self.save_directory.name, self.part_filename), "wb") as file:
+                file.write(b"01234")
+            self.http_client.stream = MagicMock(side_effect=[response, self._create_response(200, b"0123456789")])
+            self.chan_save.saved_filenames.clear()
+
+            await self._run(self.link)
+
+            self.assertEqual([call(self.link, headers={"Range": "bytes=5-"}), call(self.link, headers=None)],
+                             self.http_client.stream.call_args_list)
+            self.assertEqual([self._get_filename(b"0123456789", "jpg")], os.listdir(self.save_directory.name))
+
+    async def test_restart_download_if_server_does_not_support_ranges(self):
+        with open(os.path.join(self.save_directory.name, self.part_filename), "wb") as file:
+            file.write(b"old")
+        self._mock_response(200, b"0123456789")
+
+        await self._run(self.link)
+
+        self.assertEqual(b"0123456789", self._read_saved_file(self._get_filename(b"0123456789", "jpg")))
+
+    async def test_dont_save_media_larger_than_max_file_size(self):
+        self.chan_save.max_file_size_bytes = 8
+        self._mock_response(200, b"0123456789")
+
+        await self._run(self.link)
+
+        self.assertEqual([], os.listdir(self.save_directory.name))
+        self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_dont_download_media_with_content_length_larger_than_max_file_size(self):
+        self.chan_save.max_file_size_bytes = 8
+        chunks_read = []
+        self._mock_response(200, b"0123456789", headers={"Content-Length": "10"},
+                            after_chunk=lambda: chunks_read.append(True))
+
+        await self._run(self.link)
+
+        self.assertEqual([], chunks_read)
+        self.assertEqual([], os.listdir(self.save_directory.name))
+
+    async def test_remove_part_file_if_file_can_not_be_saved(self):
+        with open(os.path.join(self.save_directory.name, self.part_filename), "wb") as file:
+            file.write(b"01234")
+        self._mock_response(404, b"not found")
+
+        await self._run(self.link)
+
+        self.assertEqual([], os.listdir(self.save_directory.name))
+
+    async def test_dont_save_error_responses(self):
+        self._mock_response(404, b"not found")
+
+        await self._run(self.link)
+
+        self.assertEqual([], os.listdir(self.save_directory.name))
+        self.matrix.send_text_to_room.assert_not_called()
+        self.http_client.stream.assert_called_once()  # Deleted files are not retried
+        self.assertEqual({}, self.chan_save.jobs)
+
+    @patch('os.path.getsize', return_value=5)
     @patch('os.path.exists', return_value=True)  # Called when checking if the file exists
     @patch("builtins.open", new_callable=mock_open)
     @patch('os.access', return_value=True)
-    async def test_dont_save_if_already_exists(self, mock_os_access, mock_open, mock_file_exists):
+    async def test_dont_save_if_already_exists(self, mock_os_access, mock_open, mock_file_exists, mock_getsize):
         config = Mock()
         config.get.side_effect = self.get_config_side_effect_without_url_to_access_saved_files
-        chan_save = ChanSave(config, AsyncMock(), AsyncMock(), self.requests)
+        chan_save = ChanSave(config, AsyncMock(), self.database, self.http_client)
 
-        await chan_save.run(self.room, self.event, self.link)
+        await self._run(self.link, chan_save)
 
-        self.requests.get.assert_not_called()
+        self.http_client.get.assert_not_called()
         mock_open().write.assert_not_called()
         self.room.send_text.assert_not_called()
 
     async def test_dont_save_media_if_unsupported_file_extension(self):
-        await self.chan_save.run(self.room, self.event, "https://4chan.org/g/stallman.what")
+        await self._run("https://4chan.org/g/stallman.what")
 
         self.room.send_text.assert_not_called()
-        self.requests.get.assert_not_called()
+        self.http_client.get.assert_not_called()
 
     async def test_dont_save_media_and_send_location_if_not_support_4chan_link(self):
-        await self.chan_save.run(self.room, self.event, "https://4chun.org/g/stallman.jpg")
+        await self._run("https://4chun.org/g/stallman.jpg")
 
         self.room.send_text.assert_not_called()
-        self.requests.get.assert_not_called()
+        self.http_client.get.assert_not_called()
+
+    @patch('os.path.exists', return_value=False)
+    async def test_save_files_concurrently_and_send_locations(self, mock_file_exists):
+        saving, max_saving = [0], [0]
+
+        async def save_media(link, normalized_url, file_extension):
+            saving[0] += 1
+            max_saving[0] = max(max_saving[0], saving[0])
+            await asyncio.sleep(0.02 if "first" in link else 0)
+            saving[0] -= 1
+            if "broken" in link:
+                raise IOError("Failed")
+            return self._get_filename(link.encode(), file_extension), "hash", 1, None
+
+        self.chan_save._save_media = save_media
+        self.chan_save.worker_count = 2
+        links = ["https://i.4cdn.org/g/first.jpg", "https://i.4cdn.org/g/broken.jpg", "https://i.4cdn.org/g/third.png",
+                 "https://i.4cdn.org/g/first.jpg"]
+
+        await self._run(" ".join(links))
+
+        self.assertEqual(2, max_saving[0])
+        filenames = [self._get_filename(links[0].encode(), "jpg"), self._get_filename(links[2].encode(), "png")]
+        self.assertCountEqual([call("File saved to {}{} .".format(self.chan_save.url_to_access_saved_files, filename),
+                               self.room.room_id) for filename in filenames],
+                              self.matrix.send_text_to_room.call_args_list)
+
+    async def test_store_same_content_from_different_urls_once(self):
+        self._mock_response(200, b"media")
+
+        await self._run("https://i.4cdn.org/g/first.jpg")
+        await self._run("https://i.4cdn.org/g/second.jpg")
+
+        filename = self._get_filename(b"media", "jpg")
+        self.assertEqual([filename], os.listdir(self.save_directory.name))
+        self.assertEqual({"4cdn.org/g/first.jpg": filename, "4cdn.org/g/second.jpg": filename},
+                         self.chan_save.saved_filenames)
+        self.assertEqual(2, self.matrix.send_text_to_room.call_count)
+
+    async def test_dont_download_same_file_from_other_4chan_host(self):
+        self._mock_response(200, b"media")
+
+        await self._run("https://i.4cdn.org/g/stallman.jpg")
+        await self._run("https://is2.4chan.org/g/stallman.jpg")
+
+        self.assertEqual(1, self.http_client.stream.call_count)
+        self.assertEqual(1, self.matrix.send_text_to_room.call_count)
+
+    @patch('os.access', return_value=True)
+    async def test_load_saved_files_from_database(self, mock_os_access):
+        self._mock_response(200, b"media")
+        await self._run(self.link)
+        self.http_client.stream.reset_mock()
+
+        config = Mock()
+        config.get.side_effect = self.get_config_side_effect
+        chan_save = ChanSave(config, self.matrix, self.database, self.http_client)
+        await self._run(self.link, chan_save)
+
+        self.assertEqual({"4cdn.org/g/stallman.jpg": self._get_filename(b"media", "jpg")}, chan_save.saved_filenames)
+        self.http_client.stream.assert_not_called()
+
+    async def test_dont_download_file_saved_with_name_of_link(self):
+        with open(os.path.join(self.save_directory.name, self.sha1_hash_of_link + ".jpg"), "wb") as file:
+            file.write(b"media")
+        self._mock_response(200, b"media")
+
+        await self._run(self.link)
+
+        self.http_client.stream.assert_not_called()
+        self.matrix.send_text_to_room.assert_not_called()
+        self.assertEqual(self.sha1_hash_of_link + ".jpg", self.chan_save.saved_filenames["4cdn.org/g/stallman.jpg"])
+
+    async def test_handle_message_without_waiting_for_download(self):
+        download_started, finish_download = asyncio.Event(), asyncio.Event()
+
+        async def save_media(link, normalized_url, file_extension):
+            download_started.set()
+            await finish_download.wait()
+            return "file.jpg", "hash", 1, None
+
+        self.chan_save._save_media = save_media
+        await self.chan_save.start()
+
+        self.assertFalse(await self.chan_save.run(self.room, self.event, self.link))
+        await download_started.wait()
+        self.matrix.send_text_to_room.assert_not_called()
+
+        finish_download.set()
+        await self.chan_save.job_queue.join()
+        self.matrix.send_text_to_room.assert_called_once_with(
+            "File saved to {}file.jpg .".format(self.chan_save.url_to_access_saved_files), self.room.room_id)
+
+    async def test_queue_jobs_added_before_start_once(self):
+        self._mock_response(200, b"media")
+        await self.chan_save.run(self.room, self.event, self.link)
+
+        await self.chan_save.start()
+
+        self.assertEqual(1, self.chan_save.job_queue.qsize())
+
+    async def test_retry_failed_download(self):
+        self.chan_save.retry_delay_seconds = 0
+        self.http_client.stream = MagicMock(side_effect=[self._create_response(500, b""),
+                                                         self._create_response(200, b"media")])
+
+        await self._run(self.link)
+
+        self.assertEqual(2, self.http_client.stream.call_count)
+        self.assertEqual(b"media", self._read_saved_file(self._get_filename(b"media", "jpg")))
+        self.matrix.send_text_to_room.assert_called_once()
+        self.assertEqual({}, self.chan_save.jobs)
+
+    async def test_wait_longer_between_each_retry(self):
+        self._mock_response(500, b"")
+        await self.chan_save.start()
+
+        await self.chan_save.run(self.room, self.event, self.link)
+        await self.chan_save.job_queue.join()
+
+        job = self.chan_save.jobs["4cdn.org/g/stallman.jpg"]
+        self.assertEqual(1, job.attempts)
+        self.assertAlmostEqual(time.time() + 30, job.next_attempt_at, delta=5)
+        self.assertIn("4cdn.org/g/stallman.jpg", self.chan_save.retry_handles)
+
+        await self.chan_save._process_job(job)
+        self.assertEqual(2, job.attempts)
+        self.assertAlmostEqual(time.time() + 60, job.next_attempt_at, delta=5)
+        await self.database.flush()
+        self.assertEqual([(2, job.next_attempt_at)],
+                         await self.database.fetchall("SELECT ATTEMPTS, NEXT_ATTEMPT_AT FROM chan_save_jobs"))
+
+    async def test_give_up_download_after_max_attempts(self):
+        self.chan_save.retry_delay_seconds = 0
+        self.chan_save.download_attempts = 3
+        self._mock_response(200, b"0123456789", after_chunk=self._fail_download)
+
+        await self._run(self.link)
+        await self.database.flush()
+
+        self.assertEqual(3, self.http_client.stream.call_count)
+        self.matrix.send_text_to_room.assert_not_called()
+        self.assertEqual([], os.listdir(self.save_directory.name))
+        self.assertEqual({}, self.chan_save.jobs)
+        self.assertEqual([], await self.database.fetchall("SELECT * FROM chan_save_jobs"))
+
+    async def test_download_file_posted_in_several_rooms_once_and_tell_each_room(self):
+        other_room = Mock()
+        other_room.room_id = "!other:server"
+        self._mock_response(200, b"media")
+
+        await self.chan_save.run(self.room, self.event, self.link)
+        await self.chan_save.run(other_room, self.event, "https://i.4cdn.org/g/stallman.jpg")
+        await self.chan_save.run(other_room, self.event, self.link)
+        await self._run("")
+
+        self.http_client.stream.assert_called_once()
+        message = "File saved to {}{} .".format(self.chan_save.url_to_access_saved_files,
+                                                 self._get_filename(b"media", "jpg"))
+        self.assertEqual([call(message, self.room.room_id), call(message, other_room.room_id)],
+                         self.matrix.send_text_to_room.call_args_list)
+
+    @patch('os.access', return_value=True)
+    async def test_resume_queued_downloads_after_restart(self, mock_os_access):
+        await self.chan_save.run(self.room, self.event, self.link)  # Not started, so the job stays queued
+        await self.database.flush()
+
+        config = Mock()
+        config.get.side_effect = self.get_config_side_effect
+        chan_save = ChanSave(config, self.matrix, self.database, self.http_client)
+        chan_save.save_dirpath = self.chan_save.save_dirpath
+        self._mock_response(200, b"media")
+        await self._run("", chan_save)
+
+        self.http_client.stream.assert_called_once()
+        self.matrix.send_text_to_room.assert_called_once_with("File saved to {}{} .".format(
+            chan_save.url_to_access_saved_files, self._get_filename(b"media", "jpg")), self.room.room_id)
+        await self.database.flush()
+        self.assertEqual([], await self.database.fetchall("SELECT * FROM chan_save_jobs"))
+
+    async def test_record_size_of_saved_files(self):
+        self._mock_response(200, b"media")
+
+        await self._run(self.link)
+        await self.database.flush()
+
+        filename = self._get_filename(b"media", "jpg")
+        self.assertEqual([filename], list(self.chan_save.archive))
+        self.assertEqual(5, self.chan_save.archive_size_bytes)
+        self.assertEqual([(filename, 5)], await self.database.fetchall("SELECT FILENAME, SIZE FROM chan_save_archive"))
+
+    async def test_remove_least_recently_used_files_when_archive_is_too_large(self):
+        for content in [b"first", b"second", b"third"]:
+            self._add_saved_file(content)
+        self.chan_save._record_access(self._get_filename(b"first", "jpg"))  # Served, so it is now the most recent
+        self.chan_save.max_archive_size_bytes = 11
+
+        self.chan_save._evict_least_recently_used(10)
+        await self.database.flush()
+
+        self.assertEqual(sorted([self._get_filename(b"third", "jpg"), self._get_filename(b"first", "jpg")]),
+                         sorted(os.listdir(self.save_directory.name)))
+        self.assertEqual(10, self.chan_save.archive_size_bytes)
+        self.assertNotIn("4cdn.org/g/second.jpg", self.chan_save.saved_filenames)
+        self.assertNotIn(self._get_filename(b"second", "jpg"), self.chan_save.saved_urls)
+        self.assertEqual([], await self.database.fetchall("SELECT * FROM chan_save_files WHERE FILENAME = ?",
+                                                          (self._get_filename(b"second", "jpg"),)))
+        self.assertEqual(2, len(await self.database.fetchall("SELECT * FROM chan_save_archive")))
+
+    @patch('os.access', return_value=True)
+    async def test_forget_all_urls_of_removed_files(self, mock_os_access):
+        self._add_saved_file(b"first")
+        filename = self._get_filename(b"first", "jpg")
+        self.chan_save._add_to_index("4cdn.org/g/other.jpg", filename, filename[:-4], 5, "image/jpeg")
+        self._add_saved_file(b"second")
+        await self.database.flush()
+        chan_save = ChanSave(self._get_config(), self.matrix, self.database, self.http_client)
+        chan_save.max_archive_size_bytes = 6
+
+        chan_save._evict_least_recently_used(10)
+        await self.database.flush()
+
+        self.assertEqual({"4cdn.org/g/second.jpg": self._get_filename(b"second", "jpg")}, chan_save.saved_filenames)
+        self.assertEqual([("4cdn.org/g/second.jpg",)], await self.database.fetchall("SELECT URL FROM chan_save_files"))
+
+    async def test_remove_at_most_max_files_at_once(self):
+        for content in [b"first", b"second", b"third"]:
+            self._add_saved_file(content)
+        self.chan_save.max_archive_size_bytes = 1
+
+        self.chan_save._evict_least_recently_used(2)
+
+        self.assertEqual([self._get_filename(b"third", "jpg")], os.listdir(self.save_directory.name))
+
+    async def test_posting_saved_link_again_marks_file_as_recently_used(self):
+        self._add_saved_file(b"first")
+        self._add_saved_file(b"second")
+
+        await self._run("https://i.4cdn.org/g/first.jpg")
+
+        self.assertEqual([self._get_filename(b"second", "jpg"), self._get_filename(b"first", "jpg")],
+                         list(self.chan_save.archive))
+
+    async def test_start_removing_files_once_archive_is_too_large(self):
+        self.chan_save.max_archive_size_bytes = 8
+        self._add_saved_file(b"first")
+        self.assertFalse(self.chan_save.eviction_needed.is_set())
+
+        self._add_saved_file(b"second")
+
+        self.assertTrue(self.chan_save.eviction_needed.is_set())
+
+    @patch('os.access', return_value=True)
+    async def test_load_archive_without_listing_saved_files(self, mock_os_access):
+        self._add_saved_file(b"first")
+        self._add_saved_file(b"second")
+        await self.database.flush()
+
+        with patch("os.scandir") as mock_scandir, patch("os.listdir") as mock_listdir:
+            chan_save = ChanSave(self._get_config(), self.matrix, self.database, self.http_client)
+
+        mock_scandir.assert_not_called()
+        mock_listdir.assert_not_called()
+        self.assertEqual(list(self.chan_save.archive), list(chan_save.archive))
+        self.assertEqual(11, chan_save.archive_size_bytes)
+
+    @patch('os.access', return_value=True)
+    async def test_add_existing_files_to_archive_on_first_start(self, mock_os_access):
+        database = Database(os.path.join(self.database_directory.name, "other.db"))
+        for content in [b"first", b"second"]:
+            with open(os.path.join(self.save_directory.name, self._get_filename(content, "jpg")), "wb") as file:
+                file.write(content)
+        with open(os.path.join(self.save_directory.name, "unrelated.txt"), "wb") as file:
+            file.write(b"unrelated")
+
+        chan_save = ChanSave(self._get_config(), self.matrix, database, self.http_client)
+        await database.close()
+
+        self.assertCountEqual([self._get_filename(b"first", "jpg"), self._get_filename(b"second", "jpg")],
+                              list(chan_save.archive))
+        self.assertEqual(11, chan_save.archive_size_bytes)
+
+    def _add_saved_file(self, content: bytes):
+        """ Save the content as if it was downloaded from a link named after it """
+        filename = self._get_filename(content, "jpg")
+        with open(os.path.join(self.save_directory.name, filename), "wb") as file:
+            file.write(content)
+        self.chan_save._add_to_index("4cdn.org/g/{}.jpg".format(content.decode()), filename, filename[:-4],
+                                     len(content), "image/jpeg")
+
+    def _get_config(self):
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: {
+            "save_dirpath": self.save_directory.name,
+            "url_to_access_saved_files": "url_to_access_saved_files"}.get(option)
+        return config
+
+    @staticmethod
+    def _fail_download():
+        raise IOError("Connection reset")
+
+    async def _run(self, message, chan_save=None):
+        """ Let the chan save module handle the message, and wait until it has processed the queued downloads """
+        chan_save = chan_save or self.chan_save
+        await chan_save.start()
+        await chan_save.run(self.room, self.event, message)
+        await chan_save.job_queue.join()
+        await chan_save.stop()
+
+    def _mock_response(self, status_code, content: bytes, headers=None, after_chunk=None, chunk_size=4):
+        self.http_client.stream = MagicMock(return_value=self._create_response(status_code, content, headers,
+                                                                               after_chunk, chunk_size))
+
+    @staticmethod
+    def _create_response(status_code, content: bytes, headers=None, after_chunk=None, chunk_size=4):
+        """ Create what http_client.stream returns: an async context manager for the streamed response """
+        async def iter_chunks():
+            for index in range(0, len(content), chunk_size):
+                yield content[index:index + chunk_size]
+                if after_chunk:
+                    after_chunk()
+
+        response = Mock()
+        response.status_code = status_code
+        response.headers = headers or {}
+        response.iter_chunks = iter_chunks
+        response_context = MagicMock()
+        response_context.__aenter__.return_value = response
+        return response_context
+
+    @staticmethod
+    def _get_filename(content: bytes, file_extension) -> str:
+        return "{}.{}".format(hashlib.sha256(content).hexdigest(), file_extension)
+
+    def _read_saved_file(self, filename) -> bytes:
+        with open(os.path.join(self.save_directory.name, filename), "rb") as file:
+            return file.read()
 
     def get_config_side_effect(*args, **kwargs):
         if args[1] == "chan_save":
@@ -1,6 +1,9 @@
+import asyncio
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import Mock, patch, AsyncMock
 
+from nio import UploadFilterResponse
+
 from chaanbot.client import Client
 
 
@@ -34,6 +37,7 @@ class TestClient(IsolatedAsyncioTestCase):
     @patch.object(Client, "_run_forever")
     async def test_join_rooms_and_add_listeners_and_listen_forever_when_ran(self, run_forever_method):
         module_runner = AsyncMock()
+        module_runner.get_event_types = Mock(return_value=["m.room.message"])
         matrix = AsyncMock()
         matrix.matrix_client.rooms = {"room": "room1"}
         config = Mock()
@@ -45,3 +49,136 @@ class TestClient(IsolatedAsyncioTestCase):
         self.assertEqual(2, matrix.matrix_client.add_event_callback.call_count)
         matrix.join_room.assert_called_once()
         run_forever_method.assert_called_once()
+        module_runner.start.assert_called_once()
+        module_runner.stop.assert_called_once()
+
+    async def test_queue_text_messages_for_module_runner(self):
+        module_runner = AsyncMock()
+        matrix = AsyncMock()
+        matrix.matrix_client.user_id = "bot"
+        config = Mock()
+        config.get.side_effect = self._get_config_side_effect
+        client = Client(module_runner, config, matrix)
+        client.event_queue = Mock()
+        room = Mock()
+        event = Mock()
+        event.sender = "user"
+        event.source = {"type": "m.room.message", "content": {"msgtype": "m.text", "body": " hello "}}
+
+        await client._on_room_event(room, event)
+
+        client.event_queue.put.assert_called_once_with(room, event, "hello")
+        module_runner.run.assert_not_called()
+
+    async def test_ignore_own_messages(self):
+        module_runner = AsyncMock()
+        matrix = AsyncMock()
+        matrix.matrix_client.user_id = "bot"
+        config = Mock()
+        config.get.side_effect = self._get_config_side_effect
+        client = Client(module_runner, config, matrix)
+        client.event_queue = Mock()
+        event = Mock()
+        event.sender = "bot"
+
+        await client._on_room_event(Mock(), event)
+
+        client.event_queue.put.assert_not_called()
+
+    async def test_sync_full_state_if_no_stored_sync_token(self):
+        matrix = AsyncMock()
+        database = AsyncMock()
+        database.get_state.return_value = None
+        client = self._create_client(matrix, database)
+
+        await client._run_forever()
+
+        matrix.matrix_client.sync_forever.assert_called_once_with(timeout=30000, sync_filter=None, since=None, full_state=True)
+        self.assertFalse(client.resumed_sync)
+
+    async def test_resume_sync_from_stored_sync_token(self):
+        matrix = AsyncMock()
+        database = AsyncMock()
+        database.get_state.return_value = "token"
+        client = self._create_client(matrix, database)
+
+        await client._run_forever()
+
+        database.get_state.assert_called_once_with(Client.SYNC_TOKEN_KEY)
+        matrix.matrix_client.sync_forever.assert_called_once_with(timeout=30000, sync_filter=None, since="token", full_state=False)
+        self.assertTrue(client.resumed_sync)
+
+    async def test_store_new_sync_token_after_sync(self):
+        database = AsyncMock()
+        client = self._create_client(AsyncMock(), database)
+        response = Mock()
+        response.next_batch = "next"
+
+        await client._on_sync(response)
+        await client._on_sync(response)
+
+        database.set_state.assert_called_once_with(Client.SYNC_TOKEN_KEY, "next")
+
+    async def test_store_sync_token_once_events_of_sync_have_been_processed(self):
+        database = AsyncMock()
+        client = self._create_client(AsyncMock(), database)
+        room = Mock()
+        room.room_id = "room"
+        client.event_queue.put(room, Mock(), "message")
+        response = Mock()
+        response.next_batch = "next"
+
+        await client._on_sync(response)
+        database.set_state.assert_not_called()  # The event is still queued, and would be lost if the bot stopped
+
+        client.event_queue.start()
+        for _ in range(100):
+            if database.set_state.called:
+                break
+            await asyncio.sleep(0.01)
+        await client.event_queue.stop()
+
+        database.set_state.assert_called_once_with(Client.SYNC_TOKEN_KEY, "next")
+
+    async def test_get_members_before_processing_event_in_resumed_sync(self):
+        matrix = AsyncMock()
+        module_runner = AsyncMock()
+        client = self._create_client(matrix, Mock(), module_runner)
+        client.resumed_sync = True
+        room = Mock()
+        room.members_synced = False
+        event = Mock()
+
+        await client._process_event(event, room, "message")
+
+        matrix.matrix_client.joined_members.assert_called_once_with(room.room_id)
+        module_runner.run.assert_called_once_with(event, room, "message")
+
+    async def test_use_uploaded_sync_filter(self):
+        matrix = AsyncMock()
+        matrix.matrix_client.upload_filter.return_value = UploadFilterResponse("filter_id")
+        module_runner = AsyncMock()
+        module_runner.get_event_types = Mock(return_value=["m.room.message"])
+        client = self._create_client(matrix, Mock(), module_runner)
+
+        sync_filter = await client._upload_sync_filter()
+
+        self.assertEqual("filter_id", sync_filter)
+        room_filter = matrix.matrix_client.upload_filter.call_args.kwargs["room"]
+        self.assertIn("m.room.message", room_filter["timeline"]["types"])
+
+    async def test_send_sync_filter_with_each_sync_if_upload_fails(self):
+        matrix = AsyncMock()
+        matrix.matrix_client.upload_filter.return_value = Mock()
+        module_runner = AsyncMock()
+        module_runner.get_event_types = Mock(return_value=["m.room.message"])
+        client = self._create_client(matrix, Mock(), module_runner)
+
+        sync_filter = await client._upload_sync_filter()
+
+        self.assertIn("room", sync_filter)
+
+    def _create_client(self, matrix, database, module_runner=None):
+        config = Mock()
+        config.get.side_effect = self._get_config_side_effect
+        return Client(module_runner or AsyncMock(), config, matrix, database)
@@ -0,0 +1,30 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from chaanbot import config_utility
+
+
+class TestConfigUtility(TestCase):
+
+    def _config(self, value):
+        config = Mock()
+        config.get.return_value = value
+        return config
+
+    def test_get_int(self):
+        self.assertEqual(5, config_utility.get_int(self._config("5"), "section", "option", 1))
+
+    def test_get_float(self):
+        self.assertEqual(0.5, config_utility.get_float(self._config("0.5"), "section", "option", 1))
+
+    def test_get_default_if_missing_or_invalid(self):
+        self.assertEqual(1, config_utility.get_int(self._config(None), "section", "option", 1))
+        self.assertEqual(1, config_utility.get_int(self._config("many"), "section", "option", 1))
+        self.assertEqual(1.5, config_utility.get_float(self._config(""), "section", "option", 1.5))
+
+    def test_get_bool(self):
+        self.assertTrue(config_utility.get_bool(self._config("True"), "section", "option", False))
+        self.assertTrue(config_utility.get_bool(self._config("yes"), "section", "option", False))
+        self.assertFalse(config_utility.get_bool(self._config("off"), "section", "option", True))
+        self.assertTrue(config_utility.get_bool(self._config(None), "section", "option", True))
+        self.assertFalse(config_utility.get_bool(self._config("maybe"), "section", "option", False))
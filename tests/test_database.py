@@ -1,4 +1,8 @@
-from unittest import TestCase
+import os
+import tempfile
+import sqlite3
+import threading
+from unittest import TestCase, IsolatedAsyncioTestCase
 
 from chaanbot.database import Database
 
@@ -12,3 +16,106 @@ class TestDatabase(TestCase):
     def test_connect_to_database(self):
         # TODO: Implement
         pass
+
+
+class TestDatabaseQueries(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.database_directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.database_directory.name, "chaanbot.db"))
+        self.database.run_blocking(lambda conn: conn.execute("CREATE TABLE test(ID INTEGER PRIMARY KEY, VALUE TEXT)"))
+
+    async def asyncTearDown(self) -> None:
+        await self.database.close()
+        self.database_directory.cleanup()
+
+    async def test_store_and_get_state(self):
+        self.assertIsNone(await self.database.get_state("key"))
+        await self.database.set_state("key", "value")
+        await self.database.set_state("key", "new value")
+
+        self.assertEqual("new value", await self.database.get_state("key"))
+
+    async def test_execute_and_fetch(self):
+        row_id = await self.database.execute("INSERT INTO test(VALUE) VALUES(?)", ("value1",))
+        await self.database.executemany("INSERT INTO test(VALUE) VALUES(?)", [("value2",), ("value3",)])
+
+        self.assertEqual(("value1",), await self.database.fetchone("SELECT VALUE FROM test WHERE ID = ?", (row_id,)))
+        self.assertEqual([("value1",), ("value2",), ("value3",)],
+                         await self.database.fetchall("SELECT VALUE FROM test ORDER BY ID"))
+
+    async def test_changes_are_visible_to_other_connections(self):
+        await self.database.execute("INSERT INTO test(VALUE) VALUES(?)", ("value",))
+
+        conn = self.database.connect()
+        self.assertEqual([("value",)], conn.execute("SELECT VALUE FROM test").fetchall())
+        conn.close()
+
+    async def test_roll_back_if_function_fails(self):
+        def insert_and_fail(conn):
+            conn.execute("INSERT INTO test(VALUE) VALUES(?)", ("value",))
+            raise RuntimeError("Failed")
+
+        with self.assertRaises(RuntimeError):
+            await self.database.run(insert_and_fail)
+
+        self.assertEqual([], await self.database.fetchall("SELECT VALUE FROM test"))
+
+    async def test_use_write_ahead_log(self):
+        self.assertEqual(("wal",), await self.database.fetchone("PRAGMA journal_mode"))
+
+    async def test_queries_are_run_on_the_same_thread_outside_event_loop(self):
+        first_thread = await self.database.run(lambda conn: threading.get_ident())
+        second_thread = await self.database.run(lambda conn: threading.get_ident())
+
+        self.assertEqual(first_thread, second_thread)
+        self.assertNotEqual(threading.get_ident(), first_thread)
+
+    async def test_queued_writes_are_committed_together_after_flush_interval(self):
+        self.database.flush_interval_ms = 10
+        first = self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value1",))
+        second = self.database.writemany("INSERT INTO test(VALUE) VALUES(?)", [("value2",), ("value3",)])
+
+        self.assertEqual([], self._get_values_from_other_connection())
+        await second
+
+        self.assertTrue(first.done())
+        self.assertEqual(["value1", "value2", "value3"], self._get_values_from_other_connection())
+
+    async def test_flush_when_max_operations_are_queued(self):
+        self.database.flush_max_operations = 2
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value1",))
+        self.assertEqual(1, len(self.database._pending_writes))
+
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value2",))
+
+        self.assertEqual([], self.database._pending_writes)
+
+    async def test_queries_see_queued_writes(self):
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value",))
+
+        self.assertEqual([("value",)], await self.database.fetchall("SELECT VALUE FROM test"))
+
+    async def test_failing_write_does_not_undo_other_writes(self):
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value1",))
+        failing = self.database.write("INSERT INTO missing_table(VALUE) VALUES(?)", ("value2",))
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value3",))
+
+        await self.database.flush()
+
+        with self.assertRaises(sqlite3.OperationalError):
+            await failing
+        self.assertEqual(["value1", "value3"], self._get_values_from_other_connection())
+
+    async def test_commit_queued_writes_when_closing(self):
+        self.database.write("INSERT INTO test(VALUE) VALUES(?)", ("value",))
+
+        await self.database.close()
+
+        self.assertEqual(["value"], self._get_values_from_other_connection())
+
+    def _get_values_from_other_connection(self) -> list:
+        conn = self.database.connect()
+        values = [row[0] for row in conn.execute("SELECT VALUE FROM test ORDER BY ID")]
+        conn.close()
+        return values
@@ -0,0 +1,169 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import Mock, AsyncMock
+
+from chaanbot.event_queue import EventQueue
+
+
+class TestEventQueue(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.handled = []
+        self.handler = AsyncMock(side_effect=self._handle)
+
+    async def asyncTearDown(self) -> None:
+        await self.event_queue.stop()
+
+    async def _handle(self, event, room, message):
+        await asyncio.sleep(0.01 if room.room_id == "slow_room" else 0)
+        self.handled.append((room.room_id, message))
+
+    def _create_event_queue(self, workers="4", size="100", overflow=None, metrics_log_interval=None):
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: {
+            "event_workers": workers,
+            "event_queue_size": size,
+            "event_queue_overflow": overflow,
+            "event_queue_metrics_log_interval": metrics_log_interval
+        }.get(option)
+        self.event_queue = EventQueue(config, self.handler)
+        return self.event_queue
+
+    @staticmethod
+    def _room(room_id):
+        room = Mock()
+        room.room_id = room_id
+        return room
+
+    async def _wait_until_processed(self, count):
+        for _ in range(100):
+            if self.event_queue.processed >= count:
+                return
+            await asyncio.sleep(0.01)
+
+    async def test_initialize_from_config(self):
+        event_queue = self._create_event_queue("2", "10", "reject")
+
+        self.assertEqual(2, event_queue.number_of_workers)
+        self.assertEqual(10, event_queue.max_size)
+        self.assertEqual(EventQueue.REJECT, event_queue.overflow_policy)
+
+    async def test_use_defaults_if_not_configured(self):
+        event_queue = self._create_event_queue(None, None, None)
+
+        self.assertEqual(EventQueue.DEFAULT_WORKERS, event_queue.number_of_workers)
+        self.assertEqual(EventQueue.DEFAULT_MAX_SIZE, event_queue.max_size)
+        self.assertEqual(EventQueue.DROP_OLDEST, event_queue.overflow_policy)
+
+    async def test_process_events_in_order_per_room(self):
+        event_queue = self._create_event_queue()
+        event_queue.start()
+        slow_room, fast_room = self._room("slow_room"), self._room("fast_room")
+
+        for message in ["1", "2", "3"]:
+            event_queue.put(slow_room, Mock(), message)
+            event_queue.put(fast_room, Mock(), message)
+        await self._wait_until_processed(6)
+
+        self.assertEqual(["1", "2", "3"], [message for room_id, message in self.handled if room_id == "slow_room"])
+        self.assertEqual(["1", "2", "3"], [message for room_id, message in self.handled if room_id == "fast_room"])
+        self.assertEqual("fast_room", self.handled[0][0])  # Slow room does not hold up other rooms
+        self.assertEqual(0, event_queue.get_metrics()["depth"])
+
+    async def test_drop_oldest_event_when_full(self):
+        event_queue = self._create_event_queue(size="2")
+        room = self._room("room")
+
+        self.assertTrue(event_queue.put(room, Mock(), "1"))
+        self.assertTrue(event_queue.put(self._room("other_room"), Mock(), "2"))
+        self.assertTrue(event_queue.put(room, Mock(), "3"))
+        event_queue.start()
+        await self._wait_until_processed(2)
+
+        self.assertEqual([("other_room", "2"), ("room", "3")], sorted(self.handled))
+        self.assertEqual(1, event_queue.get_metrics()["dropped"])
+        self.assertEqual(2, event_queue.get_metrics()["max_depth_reached"])
+
+    async def test_drop_oldest_event_of_all_rooms_when_full(self):
+        event_queue = self._create_event_queue(size="3")
+        first_room, second_room = self._room("first_room"), self._room("second_room")
+
+        event_queue.put(second_room, Mock(), "1")
+        event_queue.put(first_room, Mock(), "2")
+        event_queue.put(second_room, Mock(), "3")
+        event_queue.put(first_room, Mock(), "4")
+        event_queue.put(first_room, Mock(), "5")
+        event_queue.start()
+        await self._wait_until_processed(3)
+
+        self.assertEqual([("first_room", "4"), ("first_room", "5"), ("second_room", "3")], sorted(self.handled))
+        self.assertEqual(2, event_queue.get_metrics()["dropped"])
+
+    async def test_log_metrics_periodically_while_events_arrive(self):
+        event_queue = self._create_event_queue(metrics_log_interval="0.01")
+        event_queue.start()
+
+        with self.assertLogs("event_queue", "INFO") as logs:
+            event_queue.put(self._room("room"), Mock(), "1")
+            await self._wait_until_processed(1)
+            await asyncio.sleep(0.05)
+
+        self.assertEqual(1, len([line for line in logs.output if "1 events processed, 0 dropped" in line]))
+
+    async def test_reject_new_event_when_full(self):
+        event_queue = self._create_event_queue(size="1", overflow="reject")
+        room = self._room("room")
+
+        self.assertTrue(event_queue.put(room, Mock(), "1"))
+        self.assertFalse(event_queue.put(room, Mock(), "2"))
+        event_queue.start()
+        await self._wait_until_processed(1)
+
+        self.assertEqual([("room", "1")], self.handled)
+        self.assertEqual(1, event_queue.get_metrics()["rejected"])
+
+    async def test_failing_handler_does_not_stop_worker(self):
+        event_queue = self._create_event_queue(workers="1")
+        self.handler.side_effect = [RuntimeError("failure"), None]
+        event_queue.start()
+
+        event_queue.put(self._room("room"), Mock(), "1")
+        event_queue.put(self._room("room"), Mock(), "2")
+        await self._wait_until_processed(2)
+
+        self.assertEqual(2, self.handler.call_count)
+
+    async def test_call_callback_once_queued_events_have_been_processed(self):
+        event_queue = self._create_event_queue()
+        calls = []
+        event_queue.put(self._room("slow_room"), Mock(), "1")
+        event_queue.put(self._room("room"), Mock(), "2")
+
+        await event_queue.when_processed(lambda: calls.append("first"))
+        event_queue.put(self._room("room"), Mock(), "3")
+        await event_queue.when_processed(AsyncMock(side_effect=lambda: calls.append("second")))
+        self.assertEqual([], calls)
+        event_queue.start()
+        await self._wait_until_processed(3)
+
+        self.assertEqual(["first", "second"], calls)
+
+    async def test_call_callback_now_if_no_events_are_queued(self):
+        event_queue = self._create_event_queue()
+        callback = Mock()
+
+        await event_queue.when_processed(callback)
+
+        callback.assert_called_once()
+
+    async def test_call_callback_when_unprocessed_events_were_dropped(self):
+        event_queue = self._create_event_queue(size="1")
+        callback = Mock()
+        event_queue.put(self._room("room"), Mock(), "1")
+        await event_queue.when_processed(callback)
+
+        event_queue.put(self._room("room"), Mock(), "2")  # Drops the first event
+        event_queue.start()
+        await self._wait_until_processed(1)
+
+        callback.assert_called_once()
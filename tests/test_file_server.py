@@ -0,0 +1,81 @@
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+from aiohttp.test_utils import TestServer, TestClient
+
+from chaanbot.file_server import FileServer
+
+
+class TestFileServer(IsolatedAsyncioTestCase):
+    filename = "e2e2d82b8f7fb4b7b0b4c4a4f8a2dcb7a0c2b2a9e1e3b5f0e2c1d4c3b2a1f0e9.webm"
+    content = b"0123456789" * 1000
+
+    async def asyncSetUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, self.filename), "wb") as file:
+            file.write(self.content)
+        self.on_file_access = Mock()
+        self.file_server = FileServer(self.directory.name, "127.0.0.1", 0, "/i", self.on_file_access)
+        self.client = TestClient(TestServer(self.file_server.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        self.directory.cleanup()
+
+    async def test_serve_file_with_immutable_cache_headers(self):
+        response = await self.client.get("/i/" + self.filename)
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(self.content, await response.read())
+        self.assertEqual("public, max-age=31536000, immutable", response.headers["Cache-Control"])
+        self.assertEqual("video/webm", response.headers["Content-Type"])
+        self.assertIn("ETag", response.headers)
+        self.on_file_access.assert_called_once_with(self.filename)
+
+    async def test_serve_range_of_file(self):
+        response = await self.client.get("/i/" + self.filename, headers={"Range": "bytes=10-19"})
+
+        self.assertEqual(206, response.status)
+        self.assertEqual(self.content[10:20], await response.read())
+        self.assertEqual("bytes 10-19/10000", response.headers["Content-Range"])
+
+    async def test_respond_not_modified_if_etag_matches(self):
+        etag = (await self.client.get("/i/" + self.filename)).headers["ETag"]
+
+        response = await self.client.get("/i/" + self.filename, headers={"If-None-Match": etag})
+
+        self.assertEqual(304, response.status)
+
+    async def test_respond_not_modified_if_not_modified_since(self):
+        last_modified = (await self.client.get("/i/" + self.filename)).headers["Last-Modified"]
+
+        response = await self.client.get("/i/" + self.filename, headers={"If-Modified-Since": last_modified})
+
+        self.assertEqual(304, response.status)
+
+    async def test_dont_serve_missing_files(self):
+        response = await self.client.get("/i/" + "0" * 64 + ".jpg")
+
+        self.assertEqual(404, response.status)
+        self.on_file_access.assert_not_called()
+
+    async def test_dont_serve_files_not_named_by_hash(self):
+        for filename in ["chaanbot.db", self.filename + ".part"]:
+            with open(os.path.join(self.directory.name, filename), "wb") as file:
+                file.write(b"not media")
+
+        for filename in ["chaanbot.db", self.filename + ".part", "..%2F" + self.filename, "%2e%2e%2fchaanbot.db"]:
+            response = await self.client.get("/i/" + filename)
+
+            self.assertEqual(404, response.status, filename)
+
+    async def test_start_and_stop_server(self):
+        file_server = FileServer(self.directory.name, "127.0.0.1", 0)
+
+        await file_server.start()
+        await file_server.stop()
+
+        self.assertIsNone(file_server._runner)
@@ -1,19 +1,28 @@
+import os
+import tempfile
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import Mock, AsyncMock
 
-from chaanbot.matrix import Matrix
+from chaanbot.database import Database
+from chaanbot.matrix import Matrix, AmbiguousUserError
 from chaanbot.modules.highlight import Highlight
 
 
 class TestHighlight(IsolatedAsyncioTestCase):
 
     def setUp(self) -> None:
-        database = Mock()
+        self.database_directory = tempfile.TemporaryDirectory()
+        self.database = Database(os.path.join(self.database_directory.name, "chaanbot.db"))
         self.matrix = AsyncMock(Matrix)
         self.room = AsyncMock()
+        self.room.room_id = "room_id"
         self.event = Mock()
         self.event.sender = "sender_user_id"
-        self.highlight = Highlight(None, self.matrix, database, None)
+        self.highlight = Highlight(None, self.matrix, self.database, None)
+
+    async def asyncTearDown(self) -> None:
+        await self.database.close()
+        self.database_directory.cleanup()
 
     async def test_not_ran_if_wrong_command(self):
         ran = await self.highlight.run(self.room, None, "highlight")
@@ -69,8 +78,7 @@ class TestHighlight(IsolatedAsyncioTestCase):
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
 
     async def test_highlight_without_text(self):
-        conn = Mock()
-        self._mock_get_member(conn, [["user1"]])
+        self._add_members_to_database("group", ["user1"])
         self._mock_get_user("user1")
 
         expected_send_message = "user1"
@@ -78,21 +86,17 @@ class TestHighlight(IsolatedAsyncioTestCase):
         await self.highlight.run(self.room, self.event, "!hl group")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        conn.execute.assert_called_once()
 
     async def test_should_not_run_highlight_operation_if_missing_group_argument(self):
-        conn = Mock()
-        self._mock_get_member(conn, [["user1"]])
+        self._add_members_to_database("group", ["user1"])
         self._mock_get_user("user1")
 
         await self.highlight.run(self.room, self.event, "!hl")
 
         self.matrix.send_text_to_room.assert_not_called()
-        conn.execute.assert_not_called()
 
     async def test_highlight_with_text(self):
-        conn = Mock()
-        self._mock_get_member(conn, [["user1"]])
+        self._add_members_to_database("group", ["user1"])
         self._mock_get_user("user1")
 
         expected_send_message = "user1: helloes"
@@ -100,7 +104,16 @@ class TestHighlight(IsolatedAsyncioTestCase):
         await self.highlight.run(self.room, self.event, "!hl group helloes")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        conn.execute.assert_called_once()
+
+    async def test_highlight_without_reading_database(self):
+        self._add_members_to_database("group", ["user1"])
+        self._mock_get_user("user1")
+        self.highlight.database = Mock()
+
+        await self.highlight.run(self.room, self.event, "!hl group")
+
+        self.matrix.send_text_to_room.assert_called_with("user1", self.room.room_id)
+        self.assertEqual([], self.highlight.database.method_calls)
 
     def _get_user_side_effect(*args, **kwargs):
         online_user = Mock()
@@ -113,19 +126,14 @@ class TestHighlight(IsolatedAsyncioTestCase):
             return offline_user
 
     async def test_no_members_for_highlight(self):
-        conn = Mock()
-        self._mock_get_member(conn, [])
-
         expected_send_message = "Group \"group\" does not have any members to highlight"
 
         await self.highlight.run(self.room, self.event, "!hl group")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        conn.execute.assert_called_once()
 
     async def test_dont_highlight_sender_in_highlight(self):
-        conn = Mock()
-        self._mock_get_member(conn, [self.event.sender])
+        self._add_members_to_database("group", [self.event.sender])
         self._mock_get_user(self.event.sender)
 
         expected_send_message = "Group \"group\" does not have any members to highlight"
@@ -133,11 +141,8 @@ class TestHighlight(IsolatedAsyncioTestCase):
         await self.highlight.run(self.room, self.event, "!hl group")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        conn.execute.assert_called_once()
 
     async def test_successfully_adding_members_to_case_insensitive_group(self):
-        conn = Mock()
-        self._mock_is_in_group(conn, None)
         self._mock_get_user("user1")
 
         expected_send_message = "Added \"user1\" to group \"group\""
@@ -145,10 +150,11 @@ class TestHighlight(IsolatedAsyncioTestCase):
         await self.highlight.run(self.room, self.event, "!hla GRouP user1")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
+        self.assertEqual({"user1"}, self.highlight.groups["room_id"]["group"])
+        self.assertEqual([("room_id", "group", "user1")], self._get_members_in_database())
 
     async def test_dont_add_to_group_if_already_member(self):
-        conn = Mock()
-        self._mock_is_in_group(conn, "user1")
+        self._add_members_to_database("group", ["user1"])
         self._mock_get_user("user1")
 
         expected_send_message = "Could not add \"user1\" to group \"group\""
@@ -166,9 +172,18 @@ class TestHighlight(IsolatedAsyncioTestCase):
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
 
+    async def test_dont_add_to_group_if_display_name_matches_several_members(self):
+        self.highlight.matrix.get_user.side_effect = AmbiguousUserError("Several users have display name user1")
+
+        expected_send_message = "User: \"user1\" matches several members, use their user id instead"
+
+        await self.highlight.run(self.room, self.event, "!hla group user1")
+
+        self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
+        self.assertEqual([], self._get_members_in_database())
+
     async def test_successfully_deleting_members_from_case_insensitive_group(self):
-        conn = Mock()
-        self._mock_is_in_group(conn, "user1")
+        self._add_members_to_database("group", ["user1", "user2"])
         self._mock_get_user("user1")
 
         expected_send_message = "Removed \"user1\" from group \"group\""
@@ -176,10 +191,10 @@ class TestHighlight(IsolatedAsyncioTestCase):
         await self.highlight.run(self.room, self.event, "!hld gROUp user1")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
+        self.assertEqual({"user2"}, self.highlight.groups["room_id"]["group"])
+        self.assertEqual([("room_id", "group", "user2")], self._get_members_in_database())
 
     async def test_dont_delete_from_group_if_not_member(self):
-        conn = Mock()
-        self._mock_is_in_group(conn, None)
         self._mock_get_user("user1")
 
         expected_send_message = "Could not remove \"user1\" from group \"group\""
@@ -193,17 +208,13 @@ class TestHighlight(IsolatedAsyncioTestCase):
         user.user_id = user_id
         self.highlight.matrix.get_user.return_value = user
 
-    def _mock_is_in_group(self, conn, return_value):
-        self.highlight.database.connect.return_value = conn
-        conn.__enter__ = Mock(return_value=conn)
-        conn.__exit__ = Mock(return_value=None)
-        result = Mock()
-        conn.execute.return_value = result
-        result.fetchone.return_value = return_value
-
-    def _mock_get_member(self, conn, members):
-        self.highlight.database.connect.return_value = conn
+    def _add_members_to_database(self, group, members):
+        """ Add members to the database and load them, like when the bot starts """
+        self.database.run_blocking(
+            lambda conn: conn.executemany("INSERT INTO highlight_groups(ROOM_ID,GROUP_NAME,MEMBER) VALUES(?,?,?)",
+                                          [(self.room.room_id, group, member) for member in members]))
+        self.highlight = Highlight(None, self.matrix, self.database, None)
 
-        rows = Mock()
-        conn.execute.return_value = rows
-        rows.fetchall.return_value = members
+    def _get_members_in_database(self):
+        return self.database.run_blocking(
+            lambda conn: conn.execute("SELECT ROOM_ID, GROUP_NAME, MEMBER FROM highlight_groups").fetchall())
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from chaanbot.html_extractor import ElementTextExtractor
+
+
+class TestElementTextExtractor(TestCase):
+
+    def test_extract_text_of_element(self):
+        extractor = ElementTextExtractor("div", ["tweet-content", "media-body"])
+
+        extractor.feed('<html><div class="tweet-header">Name</div>'
+                       '<div class="media-body tweet-content" dir="auto">Hello <a href="/x">@x</a> &amp; '
+                       '<div>nested</div><br>world<img src="a.png"/></div><div>Reply</div></html>')
+
+        self.assertTrue(extractor.done)
+        self.assertEqual("Hello @x & nestedworld", extractor.text)
+
+    def test_extract_text_fed_in_chunks(self):
+        html = '<div class="tweet-content media-body">Hello <b>world</b> &#129409;</div><div>More</div>'
+        extractor = ElementTextExtractor("div", ["tweet-content"])
+
+        for index in range(0, len(html), 5):
+            extractor.feed(html[index:index + 5])
+            if extractor.done:
+                break
+
+        self.assertLess(index, len(html) - 5)
+        self.assertEqual("Hello world \U0001F981", extractor.text)
+
+    def test_not_done_if_element_is_not_found(self):
+        extractor = ElementTextExtractor("div", ["tweet-content"])
+
+        extractor.feed('<div class="tweet-contents">Hello</div>')
+
+        self.assertFalse(extractor.found)
+        self.assertFalse(extractor.done)
+        self.assertEqual("", extractor.text)
+
+    def test_ignore_stray_end_tags(self):
+        extractor = ElementTextExtractor("div", ["tweet-content"])
+
+        extractor.feed('<div class="tweet-content">Hello</br> world</p></div>')
+
+        self.assertTrue(extractor.done)
+        self.assertEqual("Hello world", extractor.text)
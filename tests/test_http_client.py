@@ -0,0 +1,74 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from chaanbot.http_client import HttpClient, BlockingRequests
+
+
+class TestHttpClient(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.peers = []
+        app = web.Application()
+        app.router.add_get("/json", self._json_handler)
+        app.router.add_get("/slow", self._slow_handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: "0.1" if option == "read_timeout" else None
+        self.http_client = HttpClient(config)
+
+    async def asyncTearDown(self) -> None:
+        await self.http_client.close()
+        await self.server.close()
+
+    async def _json_handler(self, request):
+        self.peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response({"greeting": "hello", "agent": request.headers.get("User-Agent")})
+
+    async def _slow_handler(self, request):
+        await asyncio.sleep(1)
+        return web.Response(text="too late")
+
+    def test_initialize_from_config(self):
+        self.assertEqual(0.1, self.http_client.read_timeout_seconds)
+        self.assertEqual(HttpClient.DEFAULT_CONNECT_TIMEOUT_SECONDS, self.http_client.connect_timeout_seconds)
+        self.assertEqual(HttpClient.DEFAULT_MAX_CONNECTIONS_PER_HOST, self.http_client.max_connections_per_host)
+
+    async def test_get(self):
+        response = await self.http_client.get(str(self.server.make_url("/json")), headers={"User-Agent": "chaanbot"})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"greeting": "hello", "agent": "chaanbot"}, response.json())
+        self.assertIn("hello", response.text)
+
+    async def test_stream(self):
+        async with self.http_client.stream(str(self.server.make_url("/json"))) as response:
+            content = b"".join([chunk async for chunk in response.iter_chunks(chunk_size=4)])
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'"greeting": "hello"', content)
+
+    async def test_get_not_found(self):
+        response = await self.http_client.get(str(self.server.make_url("/missing")))
+
+        self.assertEqual(404, response.status_code)
+
+    async def test_reuse_connection_between_requests(self):
+        await self.http_client.get(str(self.server.make_url("/json")))
+        await self.http_client.get(str(self.server.make_url("/json")))
+
+        self.assertEqual(2, len(self.peers))
+        self.assertEqual(self.peers[0], self.peers[1])
+
+    async def test_time_out_slow_responses(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.http_client.get(str(self.server.make_url("/slow")))
+
+    def test_blocking_requests_passes_calls_to_requests(self):
+        self.assertEqual(requests.get, BlockingRequests().get)
@@ -1,7 +1,9 @@
 from unittest import mock, IsolatedAsyncioTestCase
-from unittest.mock import Mock
+from unittest.mock import Mock, AsyncMock
 
-from chaanbot.matrix import Matrix
+from nio import MatrixRoom, RoomMemberEvent, RoomNameEvent, RoomResolveAliasResponse
+
+from chaanbot.matrix import Matrix, AmbiguousUserError
 
 
 class TestMatrixUtility(IsolatedAsyncioTestCase):
@@ -73,6 +75,78 @@ class TestMatrixUtility(IsolatedAsyncioTestCase):
 
         self.assertIsNone(actual_room)
 
+    def test_get_room_by_room_id_before_alias_and_name(self):
+        room_by_name = Mock()
+        room_by_name.room_id, room_by_name.canonical_alias, room_by_name.name = "1", "#alias", "!room"
+        room_by_id = Mock()
+        room_by_id.room_id, room_by_id.canonical_alias, room_by_id.name = "!room", "#other", "other"
+
+        rooms = {"1": room_by_name, "!room": room_by_id}
+
+        self.assertEqual(room_by_id, self.matrix.get_room(rooms, "!room"))
+        self.assertEqual(room_by_name, self.matrix.get_room(rooms, "#alias"))
+
+    def test_index_rooms_again_when_rooms_change(self):
+        rooms = {}
+        self.assertIsNone(self.matrix.get_room(rooms, "!room"))
+
+        rooms["!room"] = MatrixRoom("!room", "@bot:example.com")
+
+        self.assertEqual(rooms["!room"], self.matrix.get_room(rooms, "!room"))
+
+    async def test_index_rooms_again_when_renamed(self):
+        room = MatrixRoom("!room", "@bot:example.com")
+        rooms = {"!room": room}
+        self.assertIsNone(self.matrix.get_room(rooms, "name"))
+
+        room.name = "name"
+        await self.matrix._on_room_name_or_alias_event(room, Mock())
+
+        self.assertEqual(room, self.matrix.get_room(rooms, "name"))
+
+    async def test_join_whitelisted_room(self):
+        matrix = self._create_matrix_with_config("whitelisted_room_ids", "!known, #unknown:example.com")
+        matrix.matrix_client.room_resolve_alias.return_value = RoomResolveAliasResponse("#unknown:example.com",
+                                                                                        "!unknown", [])
+
+        await matrix.join_room("!known")
+        await matrix.join_room("!unknown")
+        await matrix.join_room(MatrixRoom("!unknown", "@bot:example.com"))
+
+        self.assertEqual([mock.call("!known"), mock.call("!unknown"), mock.call("!unknown")],
+                         matrix.matrix_client.join.call_args_list)
+        matrix.matrix_client.room_resolve_alias.assert_called_once_with("#unknown:example.com")
+
+    async def test_dont_join_room_not_whitelisted(self):
+        matrix = self._create_matrix_with_config("whitelisted_room_ids", "!known")
+
+        await matrix.join_room("!other")
+
+        matrix.matrix_client.join.assert_not_called()
+
+    async def test_dont_join_blacklisted_room(self):
+        matrix = self._create_matrix_with_config("blacklisted_room_ids", "#blacklisted:example.com")
+        matrix.matrix_client.room_resolve_alias.return_value = RoomResolveAliasResponse("#blacklisted:example.com",
+                                                                                        "!blacklisted", [])
+
+        await matrix.join_room("!blacklisted")
+        await matrix.join_room("#blacklisted:example.com")
+        await matrix.join_room("!other")
+
+        matrix.matrix_client.join.assert_called_once_with("!other")
+        matrix.matrix_client.room_resolve_alias.assert_called_once_with("#blacklisted:example.com")
+
+    @staticmethod
+    def _create_matrix_with_config(option, value):
+        config = Mock()
+        config.get.side_effect = lambda section, config_option, fallback=None: \
+            value if config_option == option else None
+        matrix_client = AsyncMock()
+        matrix_client.add_event_callback = Mock()
+        matrix_client.add_response_callback = Mock()
+        matrix_client.rooms = {}
+        return Matrix(config, matrix_client)
+
     def test_get_user_by_id(self):
         user_id = "user"
         mocked_room = mock.Mock()
@@ -111,6 +185,92 @@ class TestMatrixUtility(IsolatedAsyncioTestCase):
 
         self.assertIsNone(actual_user)
 
+    def test_get_user_by_id_before_display_name(self):
+        room = self._create_room({"@carl:example.com": "Richard", "@richard:example.com": "Rich"})
+
+        self.assertEqual("@richard:example.com", self.matrix.get_user(room, "@Richard:example.com").user_id)
+        self.assertEqual("@carl:example.com", self.matrix.get_user(room, "richard").user_id)
+
+    def test_dont_get_user_if_display_name_is_ambiguous(self):
+        room = self._create_room({"@carl:example.com": "Richard", "@richard:example.com": "richard"})
+
+        with self.assertRaises(AmbiguousUserError):
+            self.matrix.get_user(room, "Richard")
+        self.assertEqual("@carl:example.com", self.matrix.get_user(room, "@carl:example.com").user_id)
+
+    def test_get_user_without_display_name(self):
+        room = self._create_room({"@carl:example.com": None})
+
+        self.assertEqual("@carl:example.com", self.matrix.get_user(room, "@carl:example.com").user_id)
+
+    async def test_update_user_index_on_display_name_change(self):
+        room = self._create_room({"@carl:example.com": "Carl"})
+        self.assertIsNotNone(self.matrix.get_user(room, "carl"))
+
+        room.users["@carl:example.com"].display_name = "Charles"
+        await self.matrix._on_member_event(room, self._member_event("@carl:example.com"))
+
+        self.assertIsNone(self.matrix.get_user(room, "carl"))
+        self.assertEqual("@carl:example.com", self.matrix.get_user(room, "charles").user_id)
+
+    async def test_update_user_index_on_leave(self):
+        room = self._create_room({"@carl:example.com": "Carl", "@richard:example.com": "Richard"})
+        self.assertIsNotNone(self.matrix.get_user(room, "carl"))
+
+        room.remove_member("@carl:example.com")
+        await self.matrix._on_member_event(room, self._member_event("@carl:example.com"))
+
+        self.assertIsNone(self.matrix.get_user(room, "carl"))
+        self.assertIsNone(self.matrix.get_user(room, "@carl:example.com"))
+        self.assertIsNotNone(self.matrix.get_user(room, "richard"))
+
+    async def test_rebuild_user_index_on_member_state_in_sync(self):
+        room = self._create_room({"@carl:example.com": "Carl"})
+        self.assertIsNotNone(self.matrix.get_user(room, "carl"))
+
+        room.users["@carl:example.com"].display_name = "Charles"
+        await self.matrix._on_sync(self._sync_response(room.room_id, [self._member_event("@carl:example.com")]))
+
+        self.assertIsNone(self.matrix.get_user(room, "carl"))
+        self.assertEqual("@carl:example.com", self.matrix.get_user(room, "charles").user_id)
+
+    async def test_index_rooms_again_on_name_state_in_sync(self):
+        room = MatrixRoom("!room", "@bot:example.com")
+        rooms = {"!room": room}
+        self.assertIsNone(self.matrix.get_room(rooms, "name"))
+
+        room.name = "name"
+        await self.matrix._on_sync(self._sync_response(room.room_id, [Mock(RoomNameEvent)]))
+
+        self.assertEqual(room, self.matrix.get_room(rooms, "name"))
+
+    def test_rebuild_user_index_if_members_changed_without_event(self):
+        room = self._create_room({"@carl:example.com": "Carl"})
+        self.assertIsNone(self.matrix.get_user(room, "richard"))
+
+        room.add_member("@richard:example.com", "Richard", None)
+
+        self.assertEqual("@richard:example.com", self.matrix.get_user(room, "richard").user_id)
+
+    @staticmethod
+    def _create_room(display_names_by_user_id):
+        room = MatrixRoom("!room:example.com", "@bot:example.com")
+        for user_id, display_name in display_names_by_user_id.items():
+            room.add_member(user_id, display_name, None)
+        return room
+
+    @staticmethod
+    def _sync_response(room_id, state_events):
+        response = Mock()
+        response.rooms.join = {room_id: Mock(state=state_events)}
+        return response
+
+    @staticmethod
+    def _member_event(user_id):
+        event = Mock(RoomMemberEvent)
+        event.state_key = user_id
+        return event
+
     def test_get_presence(self):
         expected_presence = "presence"
         user_id = "user"
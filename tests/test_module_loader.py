@@ -1,23 +1,39 @@
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
+from chaanbot.http_client import BlockingRequests
 from chaanbot.module_loader import ModuleLoader
 
 
+class AsyncHttpModule:
+    def __init__(self, config, matrix, database, http_client):
+        self.http_client = http_client
+
+
+class BudgetModule:
+    def __init__(self, config, matrix, database, http_client, budget=None):
+        self.budget = budget
+
+
+class BlockingRequestsModule:
+    def __init__(self, config, matrix, database, requests):
+        self.requests = requests
+
+
 class TestModuleLoader(TestCase):
     def setUp(self):
         database = Mock()
-        requests = Mock()
+        http_client = Mock()
         config = Mock()
         config.get.return_value = None
-        self.module_loader = ModuleLoader(config, database, requests)
+        self.module_loader = ModuleLoader(config, database, http_client, Mock())
 
     def test_load_enabled_and_disabled_config(self):
         database = Mock()
-        requests = Mock()
+        http_client = Mock()
         config = Mock()
         config.get.side_effect = self._get_config_side_effect_with_module1_disabled_and_module2_enabled
-        module_loader = ModuleLoader(config, database, requests)
+        module_loader = ModuleLoader(config, database, http_client)
         self.assertEqual("module1", module_loader.disabled_modules[0])
         self.assertEqual("module2", module_loader.enabled_modules[0])
 
@@ -65,10 +81,10 @@ class TestModuleLoader(TestCase):
 
     def test_dont_load_disabled_modules(self):
         database = Mock()
-        requests = Mock()
+        http_client = Mock()
         config = Mock()
         config.get.side_effect = self._get_config_side_effect_with_module_disabled
-        module_loader = ModuleLoader(config, database, requests)
+        module_loader = ModuleLoader(config, database, http_client)
 
         files = ["module.py", "module2.py"]
         loaded_modules, import_module, isdir, listdir = self.mock_and_load_modules(files, module_loader)
@@ -80,10 +96,10 @@ class TestModuleLoader(TestCase):
 
     def test_only_load_enabled_modules(self):
         database = Mock()
-        requests = Mock()
+        http_client = Mock()
         config = Mock()
         config.get.side_effect = self._get_config_side_effect_with_module1_disabled_and_module2_enabled
-        module_loader = ModuleLoader(config, database, requests)
+        module_loader = ModuleLoader(config, database, http_client)
 
         files = ["module.py", "module2.py", "module3.py"]
         loaded_modules, import_module, isdir, listdir = self.mock_and_load_modules(files, module_loader)
@@ -93,6 +109,23 @@ class TestModuleLoader(TestCase):
         isdir.assert_called()
         import_module.assert_called_once()
 
+    def test_give_http_client_to_modules(self):
+        module = self.module_loader._instantiate_module_class(AsyncHttpModule, Mock(), Mock())
+
+        self.assertEqual(self.module_loader.http_client, module.http_client)
+
+    def test_give_budget_only_to_modules_taking_it(self):
+        budget_module = self.module_loader._instantiate_module_class(BudgetModule, Mock(), Mock())
+        http_module = self.module_loader._instantiate_module_class(AsyncHttpModule, Mock(), Mock())
+
+        self.assertEqual(self.module_loader.budget, budget_module.budget)
+        self.assertEqual(self.module_loader.http_client, http_module.http_client)
+
+    def test_give_blocking_requests_to_modules_asking_for_requests(self):
+        module = self.module_loader._instantiate_module_class(BlockingRequestsModule, Mock(), Mock())
+
+        self.assertIsInstance(module.requests, BlockingRequests)
+
     @staticmethod
     def mock_and_load_modules(files, module_loader):
         with patch("pkg_resources.resource_listdir") as listdir:
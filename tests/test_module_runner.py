@@ -1,3 +1,4 @@
+import asyncio
 import time
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import Mock, AsyncMock
@@ -17,6 +18,24 @@ class TestModuleRunner(IsolatedAsyncioTestCase):
         module_runner = ModuleRunner(config, matrix, module_loader)
         self.assertEqual(modules, module_runner.loaded_modules)
 
+    async def test_start_and_stop_modules(self):
+        module = AsyncMock()
+        failing_module = AsyncMock()
+        failing_module.start.side_effect = RuntimeError("failure")
+        module_without_lifecycle = type("Alive", (), {})()
+        config = Mock()
+        config.get.return_value = None
+        module_loader = Mock()
+        module_loader.load_modules.return_value = [failing_module, module, module_without_lifecycle]
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
+
+        await module_runner.start()
+        await module_runner.stop()
+
+        module.start.assert_awaited_once()
+        module.stop.assert_awaited_once()
+        failing_module.stop.assert_awaited_once()
+
     async def test_runs_loaded_modules(self):
         module1 = AsyncMock()
         module1.run.return_value = False
@@ -60,20 +79,226 @@ class TestModuleRunner(IsolatedAsyncioTestCase):
         module1.run.assert_not_called()
         module2.run.assert_not_called()
 
-    async def _run_module_loader(self, modules):
+    async def test_only_runs_command_modules_matching_command(self):
+        hl_module = AsyncMock()
+        hl_module.operations = {"highlight": {"commands": ["!hl", "!highlight"]}}
+        alive_module = AsyncMock()
+        alive_module.operations = {"alive": {"commands": ["!alive"]}}
+        link_module = AsyncMock()
+        link_module.always_run = True
+
+        modules = [hl_module, alive_module, link_module]
+
+        await self._run_module_loader(modules, "!HL group hello")
+
+        hl_module.run.assert_called_once()
+        alive_module.run.assert_not_called()
+        link_module.run.assert_called_once()
+
+    async def test_does_not_run_command_modules_on_plain_messages(self):
+        alive_module = AsyncMock()
+        alive_module.operations = {"alive": {"commands": ["!alive"]}}
+        link_module = AsyncMock()
+
+        modules = [alive_module, link_module]
+
+        await self._run_module_loader(modules, "just chatting https://example.com")
+
+        alive_module.run.assert_not_called()
+        link_module.run.assert_called_once()
+
+    def test_plan_modules_to_run_for_each_command_on_init(self):
+        alive_module = AsyncMock()
+        alive_module.operations = {"alive": {"commands": ["!alive"]}}
+        link_module = AsyncMock()
+        link_module.always_run = True
+        chat_module = AsyncMock()
+        chat_module.always_run = False
+        module_loader = Mock()
+        module_loader.load_modules.return_value = [chat_module, alive_module, link_module]
+        config = Mock()
+        config.get.return_value = None
+
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
+
+        self.assertEqual([chat_module, link_module], module_runner.default_plan.modules)
+        self.assertEqual([link_module], module_runner.default_plan.concurrent_modules)
+        self.assertEqual([chat_module], module_runner.default_plan.handling_modules)
+        self.assertEqual([chat_module, alive_module], module_runner.command_plans["!alive"].handling_modules)
+        self.assertEqual(["!alive"], list(module_runner.command_plans.keys()))
+
+    async def test_runs_all_modules_declaring_same_command(self):
+        module1 = AsyncMock()
+        module1.operations = {"operation": {"commands": ["!cmd"]}}
+        module1.run.return_value = False
+        module2 = AsyncMock()
+        module2.operations = {"other_operation": {"commands": ["!CMD"]}}
+
+        modules = [module1, module2]
+
+        await self._run_module_loader(modules, "!cmd")
+
+        module1.run.assert_called_once()
+        module2.run.assert_called_once()
+
+    async def test_only_runs_always_run_modules_once_message_handled(self):
+        handling_module = AsyncMock()
+        handling_module.run.return_value = True
+        other_module = AsyncMock()
+        other_module.run.return_value = False
+        always_run_module = AsyncMock()
+        always_run_module.always_run = True
+        always_run_module.run.return_value = False
+
+        await self._run_module_loader([handling_module, other_module, always_run_module])
+
+        handling_module.run.assert_called_once()
+        other_module.run.assert_not_called()
+        always_run_module.run.assert_called_once()
+
+    async def test_runs_modules_in_configured_order(self):
+        ran = []
+        modules = [self._create_named_module(name, ran) for name in ["Alive", "ChanSave", "Highlight"]]
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: \
+            "highlight, alive" if (section, option) == ("modules", "order") else None
         module_loader = Mock()
         module_loader.load_modules.return_value = modules
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
         event = Mock()
         event.server_timestamp = time.time() * 1000
-        await self._run_module_loader_with_event(modules, event)
 
-    async def _run_module_loader_with_event(self, modules, event):
+        await module_runner.run(event, AsyncMock(), "message")
+
+        self.assertEqual(["highlight", "alive", "chan_save"], ran)
+
+    async def test_runs_always_run_modules_concurrently(self):
+        started = []
+
+        async def slow_run(room, event, message):
+            started.append("slow")
+            await asyncio.sleep(0.05)
+            return False
+
+        async def fast_run(room, event, message):
+            started.append("fast")
+            return False
+
+        slow_module = AsyncMock()
+        slow_module.always_run = True
+        slow_module.run.side_effect = slow_run
+        fast_module = AsyncMock()
+        fast_module.always_run = True
+        fast_module.run.side_effect = fast_run
+
+        await self._run_module_loader([slow_module, fast_module])
+
+        self.assertEqual(["slow", "fast"], started)
+        fast_module.run.assert_called_once()
+
+    async def test_failing_module_does_not_stop_other_modules(self):
+        failing_module = AsyncMock()
+        failing_module.run.side_effect = RuntimeError("failure")
+        module = AsyncMock()
+        module.run.return_value = False
+
+        await self._run_module_loader([failing_module, module])
+
+        module.run.assert_called_once()
+
+    async def test_timed_out_module_does_not_stop_other_modules(self):
+        async def hanging_run(room, event, message):
+            await asyncio.sleep(10)
+
+        hanging_module = AsyncMock()
+        hanging_module.run.side_effect = hanging_run
+        module = AsyncMock()
+        module.run.return_value = False
+
+        config = Mock()
+        config.get.return_value = "0.01"
+        module_loader = Mock()
+        module_loader.load_modules.return_value = [hanging_module, module]
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
+        event = Mock()
+        event.server_timestamp = time.time() * 1000
+
+        await module_runner.run(event, AsyncMock(), "message")
+
+        self.assertEqual(0.01, module_runner.module_timeout_seconds)
+        module.run.assert_called_once()
+
+    async def test_runs_non_concurrent_modules_in_order(self):
+        finished = []
+
+        def run_and_record(name, delay):
+            async def run(room, event, message):
+                await asyncio.sleep(delay)
+                finished.append(name)
+                return False
+
+            return run
+
+        module1 = AsyncMock()
+        module1.always_run = True
+        module1.run_concurrently = False
+        module1.run.side_effect = run_and_record("module1", 0.02)
+        module2 = AsyncMock()
+        module2.always_run = True
+        module2.run_concurrently = False
+        module2.run.side_effect = run_and_record("module2", 0)
+
+        await self._run_module_loader([module1, module2])
+
+        self.assertEqual(["module1", "module2"], finished)
+
+    def test_use_default_timeout_if_not_configured(self):
+        config = Mock()
+        config.get.return_value = None
+        module_loader = Mock()
+        module_loader.load_modules.return_value = []
+
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
+
+        self.assertEqual(ModuleRunner.DEFAULT_MODULE_TIMEOUT_SECONDS, module_runner.module_timeout_seconds)
+
+    def test_get_event_types_of_modules(self):
+        module1 = Mock()
+        module1.event_types = ["m.reaction"]
+        module2 = Mock()
+
+        config = Mock()
+        config.get.return_value = None
+        module_loader = Mock()
+        module_loader.load_modules.return_value = [module1, module2]
+        module_runner = ModuleRunner(config, AsyncMock(), module_loader)
+
+        self.assertEqual(["m.reaction", "m.room.message"], module_runner.get_event_types())
+
+    @staticmethod
+    def _create_named_module(class_name, ran):
+        async def run(room, event, message):
+            ran.append(ModuleRunner._get_module_name(module))
+            return False
+
+        module = type(class_name, (), {})()
+        module.run = run
+        return module
+
+    async def _run_module_loader(self, modules, message=None):
+        module_loader = Mock()
+        module_loader.load_modules.return_value = modules
+        event = Mock()
+        event.server_timestamp = time.time() * 1000
+        await self._run_module_loader_with_event(modules, event, message)
+
+    async def _run_module_loader_with_event(self, modules, event, message=None):
         config = Mock()
+        config.get.return_value = None
         matrix = AsyncMock()
 
         module_loader = Mock()
         module_loader.load_modules.return_value = modules
         module_runner = ModuleRunner(config, matrix, module_loader)
         room = AsyncMock()
-        message = Mock()
-        await module_runner.run(event, room, message)
+        await module_runner.run(event, room, message if message is not None else Mock())
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from chaanbot.parsed_message import ParsedMessage, Url, parse
+
+
+class TestParsedMessage(TestCase):
+
+    def test_get_command_and_argument(self):
+        message = ParsedMessage("!HL group  some text")
+
+        self.assertEqual("!HL", message.command)
+        self.assertEqual("!hl", message.command_token)
+        self.assertEqual("group  some text", message.argument)
+        self.assertEqual(["group", "some", "text"], message.argument_tokens)
+
+    def test_get_empty_argument_if_no_argument(self):
+        message = ParsedMessage("!alive")
+
+        self.assertEqual("!alive", message.command)
+        self.assertEqual("", message.argument)
+        self.assertEqual([], message.argument_tokens)
+
+    def test_empty_message(self):
+        message = ParsedMessage("")
+
+        self.assertEqual("", message.command)
+        self.assertEqual("", message.argument)
+        self.assertEqual([], message.urls)
+
+    def test_get_urls(self):
+        message = ParsedMessage("look https://www.YouTube.com/shorts/abc?x=1 and http://example.com")
+
+        self.assertEqual([Url("https://www.YouTube.com/shorts/abc?x=1", "www.youtube.com", "/shorts/abc"),
+                          Url("http://example.com", "example.com", "")], message.urls)
+
+    def test_get_invalid_url_without_host(self):
+        message = ParsedMessage("http://[invalid")
+
+        self.assertEqual([Url("http://[invalid", "", "")], message.urls)
+
+    def test_is_still_message_text(self):
+        message = ParsedMessage("!alive")
+
+        self.assertEqual("!alive", message)
+        self.assertTrue(message.startswith("!"))
+
+    def test_parse_only_once(self):
+        message = ParsedMessage("!alive")
+
+        self.assertIs(message, parse(message))
+        self.assertIs(message.urls, message.urls)
@@ -0,0 +1,107 @@
+import configparser
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock
+
+from chaanbot.modules.rewrite_links import RewriteLinks
+
+
+class TestRewriteLinks(IsolatedAsyncioTestCase):
+    config_prefix_message = "prefix "
+
+    def setUp(self) -> None:
+        self.config = configparser.ConfigParser()
+        self.config.read_dict({"rewrite_links": {"prefix_message": self.config_prefix_message}})
+        self.event = Mock()
+        self.event.sender = "user_id"
+        self.room = AsyncMock()
+        self.room.room_id = 1234
+        self.matrix = AsyncMock()
+        self.module = RewriteLinks(self.config, self.matrix, Mock(), None)
+
+    async def test_rewrite_amp(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.youtube.com/amp/6j6ksOu1231")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "https://www.youtube.com/6j6ksOu1231",
+            self.room.room_id)
+
+    async def test_rewrite_several_amps(self):
+        ran = await self.module.run(self.room, None,
+                                    "Check these out: https://www.youtube.com/amp/6j6ksOu1231 "
+                                    "and http://news.com/amp/russia-loses-ukraine-war great huh?")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "https://www.youtube.com/6j6ksOu1231"
+            + os.linesep + "http://news.com/russia-loses-ukraine-war",
+            self.room.room_id)
+
+    async def test_dont_rewrite_non_amp(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.news.com/amps/test")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_dont_rewrite_amp_without_page(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.news.com/amp/")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_rewrite_normal_short(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.youtube.com/shorts/6j6ksOu1231")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "https://www.youtube.com/watch?v=6j6ksOu1231",
+            self.room.room_id)
+
+    async def test_rewrite_short_with_dash(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.youtube.com/shorts/6j6ksO-u1231")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "https://www.youtube.com/watch?v=6j6ksO-u1231",
+            self.room.room_id)
+
+    async def test_rewrite_several_shorts(self):
+        ran = await self.module.run(self.room, None,
+                                    "Check these out: http://www.youtube.com/shorts/6j6ksOu1231 "
+                                    "and https://youtube.com/shorts/6j6ksO-u1232 great huh?")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "http://www.youtube.com/watch?v=6j6ksOu1231"
+            + os.linesep + "https://youtube.com/watch?v=6j6ksO-u1232",
+            self.room.room_id)
+
+    async def test_rewrite_links_ignoring_case(self):
+        ran = await self.module.run(self.room, None,
+                                    "https://YouTube.com/Shorts/6j6ksOu1231 https://news.com/AMP/Story")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_any_call(
+            self.config_prefix_message + "https://YouTube.com/watch?v=6j6ksOu1231" + os.linesep
+            + "https://news.com/Story",
+            self.room.room_id)
+
+    async def test_dont_rewrite_non_youtube_short(self):
+        ran = await self.module.run(self.room, None, "Check this out: https://www.othertube.com/shorts/6j6ksOu1231")
+
+        self.assertFalse(ran)
+        self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_send_all_rewritten_links_in_one_reply(self):
+        self.config.set("rewrite_links", "rule_x", r"x.com ^https://x\.com/ => https://fixupx.com/")
+        module = RewriteLinks(self.config, self.matrix, Mock(), None)
+
+        await module.run(self.room, None, "https://youtube.com/shorts/6j6ksOu1231 https://news.com/amp/war "
+                                          "https://x.com/user/status/1 https://example.com/")
+
+        self.matrix.send_text_to_room.assert_called_once_with(
+            self.config_prefix_message + os.linesep.join(["https://youtube.com/watch?v=6j6ksOu1231",
+                                                          "https://news.com/war",
+                                                          "https://fixupx.com/user/status/1"]),
+            self.room.room_id)
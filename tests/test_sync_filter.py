@@ -0,0 +1,34 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from chaanbot import sync_filter
+
+
+class TestSyncFilter(TestCase):
+
+    def _config(self, values):
+        config = Mock()
+        config.get.side_effect = lambda section, option, fallback=None: values.get(option)
+        return config
+
+    def test_build_filter_for_event_types(self):
+        built_filter = sync_filter.build(self._config({}), ["m.room.message"])
+
+        timeline = built_filter["room"]["timeline"]
+        self.assertIn("m.room.message", timeline["types"])
+        self.assertIn("m.room.member", timeline["types"])
+        self.assertEqual(sync_filter.DEFAULT_TIMELINE_LIMIT, timeline["limit"])
+        self.assertEqual(sync_filter.STATE_EVENT_TYPES, built_filter["room"]["state"]["types"])
+        self.assertFalse(built_filter["room"]["state"]["lazy_load_members"])
+        self.assertEqual({"not_types": ["*"]}, built_filter["presence"])
+        self.assertEqual({"not_types": ["*"]}, built_filter["room"]["ephemeral"])
+
+    def test_build_filter_from_config(self):
+        built_filter = sync_filter.build(self._config({"sync_timeline_limit": "5", "sync_lazy_load_members": "true"}),
+                                         ["m.room.message"])
+
+        self.assertEqual(5, built_filter["room"]["timeline"]["limit"])
+        self.assertTrue(built_filter["room"]["state"]["lazy_load_members"])
+
+    def test_no_filter_if_turned_off(self):
+        self.assertIsNone(sync_filter.build(self._config({"sync_filter": "false"}), ["m.room.message"]))
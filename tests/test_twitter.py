@@ -1,5 +1,8 @@
+import asyncio
 from unittest import IsolatedAsyncioTestCase
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import AsyncMock, Mock, MagicMock
+
+import aiohttp
 
 from chaanbot.modules.twitter import Twitter
 
@@ -13,18 +16,16 @@ class TestTwitter(IsolatedAsyncioTestCase):
         config.get.return_value = self.config_prefix_message
         self.event = Mock()
         self.event.sender = "user_id"
-        self.requests = Mock()
+        self.http_client = AsyncMock()
         self.room = AsyncMock()
         self.room.room_id = 1234
         self.matrix = AsyncMock()
-        self.module = Twitter(config, self.matrix, Mock(), self.requests)
+        self.module = Twitter(config, self.matrix, Mock(), self.http_client)
 
     async def test_fetch_twitter(self):
         tweet_text = "hello literally everyone"
-        response = Mock()
-        response.status_code = 200
-        response.content = '<html><div class="tweet-content media-body" dir="auto">' + tweet_text + '</div></html>'
-        self.requests.get.return_value = response
+        self._mock_response(200,
+                            '<html><div class="tweet-content media-body" dir="auto">' + tweet_text + '</div></html>')
 
         ran = await self.module.run(self.room, None,
                                     "Check this out: https://twitter.com/Twitter/status/1445078208190291973")
@@ -36,10 +37,8 @@ class TestTwitter(IsolatedAsyncioTestCase):
 
     async def test_fetch_several_tweets(self):
         tweet_text = "hello literally everyone"
-        response = Mock()
-        response.status_code = 200
-        response.content = '<html><div class="tweet-content media-body" dir="auto">' + tweet_text + '</div></html>'
-        self.requests.get.return_value = response
+        self._mock_response(200,
+                            '<html><div class="tweet-content media-body" dir="auto">' + tweet_text + '</div></html>')
 
         ran = await self.module.run(self.room, None,
                                     "Check this out: https://twitter.com/Twitter/status/1445078208190291973 and https://twitter.com/Twitter/status/1445078208190291972")
@@ -50,25 +49,152 @@ class TestTwitter(IsolatedAsyncioTestCase):
             self.room.room_id)
 
     async def test_handle_404(self):
-        response = Mock()
-        response.status_code = 404
-        self.requests.get.return_value = response
+        self._mock_response(404, "")
 
         ran = await self.module.run(self.room, None,
                                     "Check this out: https://twitter.com/Twitter/status/1445078208190291973")
 
         self.assertFalse(ran)
-        self.requests.get.assert_called()
+        self.http_client.stream.assert_called()
         self.matrix.send_text_to_room.assert_not_called()
 
     async def test_handle_not_finding_tweet(self):
-        response = Mock()
-        response.status_code = 200
-        response.content = '<html><div class="tweest-content medias-body" dir="auto"></div></html>'
-        self.requests.get.return_value = response
+        self._mock_response(200, '<html><div class="tweest-content medias-body" dir="auto"></div></html>')
 
         ran = await self.module.run(self.room, None,
                                     "Check this out: https://twitter.com/Twitter/status/1445078208190291973")
 
         self.assertFalse(ran)
         self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_do_not_fetch_tweet_without_budget(self):
+        budget = Mock()
+        budget.try_acquire.return_value = False
+        self.module.budget = budget
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+
+        self.http_client.stream.assert_not_called()
+        self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_use_cached_text_for_same_tweet_in_other_links(self):
+        tweet_text = "hello literally everyone"
+        self._mock_response(200, '<html><div class="tweet-content media-body">' + tweet_text + '</div></html>')
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973?s=20")
+        await self.module.run(self.room, None, "https://mobile.twitter.com/Twitter/status/1445078208190291973")
+        await self.module.run(self.room, None, "https://nitter.net/Twitter/statuses/1445078208190291973#m")
+
+        self.http_client.stream.assert_called_once()
+        self.assertEqual("https://nitter.net/Twitter/status/1445078208190291973",
+                         self.http_client.stream.call_args.args[0])
+        self.assertEqual(3, self.matrix.send_text_to_room.call_count)
+
+    async def test_cache_failures_for_a_short_while(self):
+        now = [0]
+        self.module.tweet_cache.clock = lambda: now[0]
+        self._mock_response(404, "")
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+        self.http_client.stream.assert_called_once()
+        now[0] = self.module.failure_cache_seconds
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+
+        self.assertEqual(2, self.http_client.stream.call_count)
+
+    async def test_cache_connection_failures_for_a_short_while(self):
+        for error in [aiohttp.ClientConnectionError("Connection refused"), asyncio.TimeoutError()]:
+            self.module.tweet_cache.pop("1445078208190291973")
+            self.http_client.stream = Mock(side_effect=error)
+
+            await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+            await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+
+            self.http_client.stream.assert_called_once()
+            self.matrix.send_text_to_room.assert_not_called()
+
+    async def test_stop_reading_page_after_tweet_body(self):
+        tweet_text = "hello literally everyone"
+        page = '<html><div class="tweet-content media-body">' + tweet_text + '</div>' + "<div>reply</div>" * 100
+        chunks_read = []
+        self._mock_response(200, page, chunks_read)
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+
+        self.matrix.send_text_to_room.assert_called_once_with(self.config_prefix_message_output + tweet_text,
+                                                              self.room.room_id)
+        self.assertLess(len(b"".join(chunks_read)), len(page) / 10)
+
+    async def test_parse_whole_page_if_tweet_body_could_not_be_extracted_while_reading(self):
+        tweet_text = "hello literally everyone"
+        self._mock_response(200, '<html><div class="tweet-content media-body">' + tweet_text)
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1445078208190291973")
+
+        self.matrix.send_text_to_room.assert_called_once_with(self.config_prefix_message_output + tweet_text,
+                                                              self.room.room_id)
+
+    async def test_fetch_tweets_concurrently_and_keep_their_order(self):
+        fetching, max_fetching = [0], [0]
+
+        async def get_text(link):
+            fetching[0] += 1
+            max_fetching[0] = max(max_fetching[0], fetching[0])
+            await asyncio.sleep(0.02 if link.endswith("1") else 0)
+            fetching[0] -= 1
+            return link[-1]
+
+        self.module._getText = get_text
+        self.module.fetch_semaphore = asyncio.Semaphore(2)
+
+        await self.module.run(self.room, None, " ".join(
+            "https://twitter.com/Twitter/status/{}".format(status_id) for status_id in range(1, 4)))
+
+        self.assertEqual(2, max_fetching[0])
+        self.matrix.send_text_to_room.assert_called_once_with(
+            "\n".join(self.config_prefix_message_output + text for text in ["1", "2", "3"]), self.room.room_id)
+
+    async def test_send_tweets_fetched_when_others_fail(self):
+        async def get_text(link):
+            if link.endswith("1"):
+                raise ValueError("Unexpected page")
+            return "" if link.endswith("2") else link[-1]
+
+        self.module._getText = get_text
+
+        await self.module.run(self.room, None, " ".join(
+            "https://twitter.com/Twitter/status/{}".format(status_id) for status_id in range(1, 5)))
+
+        self.matrix.send_text_to_room.assert_called_once_with(
+            "\n".join(self.config_prefix_message_output + text for text in ["3", "4"]), self.room.room_id)
+
+    async def test_fetch_same_tweet_once_when_posted_twice(self):
+        get_text = AsyncMock(return_value="text")
+        self.module._getText = get_text
+
+        await self.module.run(self.room, None, "https://twitter.com/Twitter/status/1 https://www.twitter.com/a/status/1"
+                                               " https://mobile.twitter.com/Twitter/status/1")
+
+        get_text.assert_awaited_once()
+
+    def _mock_response(self, status_code, content, chunks_read=None, chunk_size=16):
+        def stream(link, headers=None):
+            unread = [content[index:index + chunk_size].encode() for index in range(0, len(content), chunk_size)]
+
+            async def iter_chunks():
+                while unread:
+                    chunk = unread.pop(0)
+                    if chunks_read is not None:
+                        chunks_read.append(chunk)
+                    yield chunk
+
+            response = Mock()
+            response.status_code = status_code
+            response.iter_chunks = iter_chunks
+            streamed_response = MagicMock()
+            streamed_response.__aenter__.return_value = response
+            return streamed_response
+
+        self.http_client.stream = Mock(side_effect=stream)
@@ -0,0 +1,108 @@
+import configparser
+from unittest import TestCase
+
+from chaanbot import url_rewriter
+from chaanbot.parsed_message import parse
+from chaanbot.url_rewriter import UrlRewriter
+
+
+class TestUrlRewriter(TestCase):
+
+    def test_parse_rule(self):
+        rule = url_rewriter.parse_rule("x", r"X.com ^https://x\.com/ => https://fixupx.com/")
+
+        self.assertEqual("x", rule.name)
+        self.assertEqual("x.com", rule.host)
+        self.assertEqual(r"^https://x\.com/", rule.pattern.pattern)
+        self.assertEqual("https://fixupx.com/", rule.replacement)
+
+    def test_parse_rule_with_empty_replacement(self):
+        self.assertEqual("", url_rewriter.parse_rule("utm", r"* [?&]utm_source=[^&]* =>").replacement)
+
+    def test_dont_parse_invalid_rules(self):
+        for rule in ["x.com ^https://x\\.com/", "x.com (unclosed => x", "=> x"]:
+            with self.assertRaises(ValueError, msg=rule):
+                url_rewriter.parse_rule("x", rule)
+
+    def test_load_default_and_configured_rules(self):
+        config = self._get_config({
+            "rule_reddit": r"reddit.com ^https://(www\.)?reddit\.com/ => https://old.reddit.com/",
+            "rule_invalid": "invalid",
+            "prefix_message": "not a rule"})
+
+        rules = url_rewriter.load_rules(config, "rewrite_links")
+
+        self.assertEqual(["amp", "youtube_shorts", "reddit"], [rule.name for rule in rules])
+
+    def test_override_and_turn_off_default_rules(self):
+        config = self._get_config({"rule_amp": r"* /amp/ => /", "rule_youtube_shorts": ""})
+
+        rules = url_rewriter.load_rules(config, "rewrite_links")
+
+        self.assertEqual([("amp", "/amp/")], [(rule.name, rule.pattern.pattern) for rule in rules])
+
+    def test_turn_off_all_default_rules(self):
+        self.assertEqual([], url_rewriter.load_rules(self._get_config({"default_rules": "false"}), "rewrite_links"))
+
+    def test_load_default_rules_without_section(self):
+        rules = url_rewriter.load_rules(configparser.ConfigParser(), "rewrite_links")
+
+        self.assertEqual(["amp", "youtube_shorts"], [rule.name for rule in rules])
+
+    def test_apply_rules_of_host_to_subdomains_only(self):
+        rewriter = self._get_rewriter(r"youtube.com /shorts/ => /watch?v=")
+
+        self.assertEqual(["https://m.youtube.com/watch?v=1"], self._rewrite(rewriter, "https://m.youtube.com/shorts/1"))
+        self.assertEqual([], self._rewrite(rewriter, "https://notyoutube.com/shorts/1"))
+
+    def test_apply_rules_of_all_matching_hosts_and_any_host(self):
+        rewriter = self._get_rewriter(r"youtube.com /a$ => /b", r"m.youtube.com /c$ => /d", r"* /e$ => /f")
+
+        self.assertEqual(["https://m.youtube.com/b", "https://m.youtube.com/d", "https://m.youtube.com/f",
+                          "https://other.com/f"],
+                         self._rewrite(rewriter, "https://m.youtube.com/a https://m.youtube.com/c "
+                                                 "https://m.youtube.com/e https://other.com/e https://other.com/a"))
+
+    def test_rewrite_with_rule_matching_earliest_in_url(self):
+        rewriter = self._get_rewriter(r"* /amp$ => /", r"* ^https://x\.com/ => https://fixupx.com/")
+
+        self.assertEqual(["https://fixupx.com/amp"], self._rewrite(rewriter, "https://x.com/amp"))
+
+    def test_rewrite_with_groups_of_the_matching_rule(self):
+        rewriter = self._get_rewriter(r"* ^https://(a)\.com/(b) => https://\2.com/\1",
+                                      r"* ^https://(c)\.com/(?P<path>d) => https://\g<path>.com/\1")
+
+        self.assertEqual(["https://b.com/a", "https://d.com/c"],
+                         self._rewrite(rewriter, "https://a.com/b https://c.com/d"))
+
+    def test_rewrite_with_rules_which_can_not_be_combined(self):
+        rewriter = self._get_rewriter(r"* ^https://(\w)\1\.com/ => https://double.com/",
+                                      r"* ^https://(?P<name>c)\.com/ => https://\g<name>c.com/",
+                                      r"* ^https://(?P<name>e)\.com/ => https://\g<name>e.com/")
+
+        self.assertEqual(["https://double.com/", "https://cc.com/", "https://ee.com/"],
+                         self._rewrite(rewriter, "https://aa.com/ https://ab.com/ https://c.com/ https://e.com/"))
+
+    def test_dont_rewrite_with_invalid_replacement(self):
+        rewriter = self._get_rewriter(r"* ^https://a\.com/ => https://\2.com/")
+
+        self.assertEqual([], self._rewrite(rewriter, "https://a.com/"))
+
+    def test_dont_return_unchanged_urls(self):
+        rewriter = self._get_rewriter(r"* ^https://a\.com/ => https://a.com/")
+
+        self.assertEqual([], self._rewrite(rewriter, "https://a.com/"))
+
+    @staticmethod
+    def _get_rewriter(*rules) -> UrlRewriter:
+        return UrlRewriter([url_rewriter.parse_rule(str(index), rule) for index, rule in enumerate(rules)])
+
+    @staticmethod
+    def _rewrite(rewriter, message):
+        return rewriter.rewrite_all(parse(message).urls)
+
+    @staticmethod
+    def _get_config(options) -> configparser.ConfigParser:
+        config = configparser.ConfigParser()
+        config.read_dict({"rewrite_links": options})
+        return config
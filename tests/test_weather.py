@@ -1,6 +1,8 @@
+import asyncio
 from unittest import IsolatedAsyncioTestCase
 from unittest.mock import Mock, AsyncMock
 
+from chaanbot.budget import BudgetManager
 from chaanbot.modules.weather import Weather
 
 
@@ -9,14 +11,17 @@ class TestWeather(IsolatedAsyncioTestCase):
 
     def setUp(self) -> None:
         config = Mock()
-        config.get.return_value = self.api_key
+        config.get.side_effect = lambda section, option, fallback=None: self.api_key if option == "api_key" else None
         self.event = Mock()
         self.event.sender = "user_id"
-        self.requests = Mock()
+        self.http_client = AsyncMock()
         self.room = AsyncMock()
         self.room.room_id = 1234
         self.matrix = AsyncMock()
-        self.weather = Weather(config, self.matrix, Mock(), self.requests)
+        self.database = AsyncMock()
+        self.database.run_blocking = Mock()
+        self.database.write = Mock()
+        self.weather = Weather(config, self.matrix, self.database, self.http_client)
 
     def test_disabled_if_no_database(self):
         cfg = Mock()
@@ -39,17 +44,16 @@ class TestWeather(IsolatedAsyncioTestCase):
         self.assertFalse(self.weather.always_run)
 
     async def test_send_todays_weather_if_no_argument(self):
-        conn = Mock()
         latitude = 1.123
         longitude = -12.123
-        self._mock_get_coordinates(conn, latitude, longitude)
+        self._mock_get_coordinates(latitude, longitude)
 
         current_temp = 12
         min_temp = 45
         max_temp = 92
         summary = "Summary"
         response = Mock()
-        self.requests.get.return_value = response
+        self.http_client.get.return_value = response
         response.json.return_value = {
             "current": {
                 "temp": current_temp,
@@ -76,19 +80,18 @@ class TestWeather(IsolatedAsyncioTestCase):
         await self.weather.run(self.room, self.event, "!weather")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        self.requests.get.assert_called_once()
+        self.http_client.get.assert_called_once()
 
     async def test_send_several_days_weather(self):
-        conn = Mock()
         latitude = 1.123
         longitude = -12.123
-        self._mock_get_coordinates(conn, latitude, longitude)
+        self._mock_get_coordinates(latitude, longitude)
 
         min_temp1, min_temp2, min_temp3 = 45, 46, 47
         max_temp1, max_temp2, max_temp3 = 92, 93, 94
         summary1, summary2, summary3 = "Summary1", "Summary2", "Summary3"
         response = Mock()
-        self.requests.get.return_value = response
+        self.http_client.get.return_value = response
         response.json.return_value = {
             "daily":
                 [
@@ -136,13 +139,12 @@ class TestWeather(IsolatedAsyncioTestCase):
         await self.weather.run(self.room, self.event, "!weather 0 1 2")
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
-        self.requests.get.assert_called_once()
+        self.http_client.get.assert_called_once()
 
     async def test_cant_send_more_than_max_days(self):
-        conn = Mock()
         latitude = 1.123
         longitude = 12.123
-        self._mock_get_coordinates(conn, latitude, longitude)
+        self._mock_get_coordinates(latitude, longitude)
 
         expected_send_message = "Can only look up {} days at once.".format(
             self.weather.max_days_to_send_at_once)
@@ -155,24 +157,17 @@ class TestWeather(IsolatedAsyncioTestCase):
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
 
     async def test_remind_user_to_set_coordinates_if_trying_to_send_weather_without_coordinates_set(self):
-        conn = Mock()
-        self._mock_get_coordinates(conn, None, None)
+        self._mock_get_coordinates(None, None)
 
         await self.weather.run(self.room, self.event, "!weather")
 
         expected_send_message = "Set your coordinates by using !setcoordinates [LATITUDE] [LONGITUDE]."
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
 
-    def _mock_get_coordinates(self, conn, latitude, longitude):
-        self.weather.database.connect.return_value = conn
-
-        rows = Mock()
-        conn.execute.return_value = rows
-        rows.fetchone.return_value = (latitude, longitude)
+    def _mock_get_coordinates(self, latitude, longitude):
+        self.database.fetchone.return_value = (latitude, longitude)
 
     async def test_add_coordinates(self):
-        conn = Mock()
-        self._mock_add_coordinates(conn)
 
         latitude = 1.123
         longitude = -5.13
@@ -180,16 +175,162 @@ class TestWeather(IsolatedAsyncioTestCase):
         await self.weather.run(self.room, self.event, "!addcoordinates {}, {}".format(latitude, longitude))
 
         self.matrix.send_text_to_room.assert_called_with(expected_send_message, self.room.room_id)
+        self.database.write.assert_called_once_with(
+            "INSERT OR REPLACE INTO user_coordinates(ROOM_ID, USER_ID, LATITUDE, LONGITUDE) VALUES(?,?,?,?)",
+            (self.room.room_id, self.event.sender, str(latitude), str(longitude)))
+
+    async def test_use_cached_forecast_for_nearby_coordinates(self):
+        self._mock_forecast_response()
+        self._mock_get_coordinates(59.3293, 18.0686)
+        await self.weather.run(self.room, self.event, "!weather")
+        self._mock_get_coordinates(59.3301, 18.0712)
+
+        await self.weather.run(self.room, self.event, "!weather")
+
+        self.http_client.get.assert_called_once()
+        self.assertIn("lat=59.3&lon=18.1", self.http_client.get.call_args.args[0])
+        self.assertEqual({"size": 1, "hits": 1, "misses": 1}, self.weather.forecast_cache.get_metrics())
+
+    async def test_log_hit_rate_of_forecast_cache(self):
+        self._mock_forecast_response()
+        self._mock_get_coordinates(59.3293, 18.0686)
+        self.weather.cache_metrics_log_every = 4
+
+        with self.assertLogs("weather", "INFO") as logs:
+            for _ in range(4):
+                await self.weather.run(self.room, self.event, "!weather")
+
+        self.assertEqual(["INFO:weather:Forecast cache has 1 areas, 3 of 4 lookups were hits (75%)"], logs.output)
+
+    async def test_serve_several_days_from_cached_forecast(self):
+        self._mock_forecast_response()
+        self._mock_get_coordinates(59.3293, 18.0686)
+        await self.weather.run(self.room, self.event, "!weather")
+
+        await self.weather.run(self.room, self.event, "!weather 0")
 
-    def _mock_add_coordinates(self, conn):
-        self.weather.database.connect.return_value = conn
+        self.http_client.get.assert_called_once()
+        self.matrix.send_text_to_room.assert_called_with("Today\t\t\t Max: 3, Min: 1\tSnow\n", self.room.room_id)
+
+    async def test_request_forecast_again_when_current_weather_is_too_old(self):
+        now = [0]
+        self.weather.forecast_cache.clock = lambda: now[0]
+        self._mock_forecast_response()
+        self._mock_get_coordinates(59.3293, 18.0686)
+        await self.weather.run(self.room, self.event, "!weather")
+        now[0] = self.weather.current_cache_seconds + 1
+
+        await self.weather.run(self.room, self.event, "!weather 1")
+        self.http_client.get.assert_called_once()
+        await self.weather.run(self.room, self.event, "!weather")
+
+        self.assertEqual(2, self.http_client.get.call_count)
+
+    async def test_concurrent_requests_for_same_area_share_one_request(self):
+        response = self._mock_forecast_response()
+
+        async def slow_get(url):
+            await asyncio.sleep(0.01)
+            return response
+
+        self.http_client.get.side_effect = slow_get
+        self._mock_get_coordinates(59.3293, 18.0686)
+
+        await asyncio.gather(self.weather.run(self.room, self.event, "!weather"),
+                             self.weather.run(self.room, self.event, "!weather"))
+
+        self.http_client.get.assert_called_once()
+        self.assertEqual(2, self.matrix.send_text_to_room.call_count)
+
+    async def test_do_not_cache_error_responses(self):
+        response = Mock()
+        response.json.return_value = {"cod": 401, "message": "Invalid API key"}
+        self.http_client.get.return_value = response
+        self._mock_get_coordinates(59.3293, 18.0686)
 
-        rows = Mock()
-        conn.execute.return_value = rows
+        await self.weather._get_forecast(59.3293, 18.0686, self.weather.current_cache_seconds)
+        await self.weather._get_forecast(59.3293, 18.0686, self.weather.current_cache_seconds)
 
-        cursor = Mock()
-        conn.cursor.return_value = cursor
-        cursor.lastrowid = 123
+        self.assertEqual(2, self.http_client.get.call_count)
+
+    async def test_prefetch_area_without_forecast_first(self):
+        self._mock_forecast_response()
+        self.weather.forecast_cache.set((59.3, 18.1), {"daily": []})
+        self.database.fetchall.return_value = [("59.3293", "18.0686"), ("57.7089", "11.9746")]
+
+        area = await self.weather._prefetch(interval_seconds=60)
+
+        self.assertEqual((57.7, 12.0), area)
+        self.assertIn("lat=57.7&lon=12.0", self.http_client.get.call_args.args[0])
+
+    async def test_do_not_prefetch_forecasts_recent_enough_until_next_prefetch(self):
+        now = [0]
+        self.weather.forecast_cache.clock = lambda: now[0]
+        self.weather.forecast_cache.set((59.3, 18.1), {"daily": []})
+        self.database.fetchall.return_value = [("59.3293", "18.0686")]
+        now[0] = self.weather.current_cache_seconds - 120
+
+        self.assertIsNone(await self.weather._prefetch(interval_seconds=60))
+        self.http_client.get.assert_not_called()
+        self._mock_forecast_response()
+        self.assertEqual((59.3, 18.1), await self.weather._prefetch(interval_seconds=180))
+        self.http_client.get.assert_called_once()
+
+    async def test_send_weather_from_prefetched_forecast(self):
+        self._mock_forecast_response()
+        self.database.fetchall.return_value = [("59.3293", "18.0686")]
+        self._mock_get_coordinates("59.3293", "18.0686")
+        await self.weather._prefetch(interval_seconds=60)
+
+        await self.weather.run(self.room, self.event, "!weather")
+
+        self.http_client.get.assert_called_once()
+        self.matrix.send_text_to_room.assert_called_with("Currently: 2 (Max: 3, Min: 1)\tSnow", self.room.room_id)
+
+    async def test_only_prefetch_if_enabled(self):
+        await self.weather.start()
+        self.assertIsNone(self.weather.prefetch_task)
+
+        self.weather.prefetch = True
+        self.database.fetchall.return_value = []
+        await self.weather.start()
+        self.assertIsNotNone(self.weather.prefetch_task)
+
+        await self.weather.stop()
+        self.assertIsNone(self.weather.prefetch_task)
+
+    async def test_reply_quota_exhausted_without_requesting_forecast(self):
+        budget = Mock()
+        budget.try_acquire.return_value = False
+        self.weather.budget = budget
+        self._mock_get_coordinates(59.3293, 18.0686)
+
+        await self.weather.run(self.room, self.event, "!weather")
+
+        self.http_client.get.assert_not_called()
+        self.matrix.send_text_to_room.assert_called_with("Weather quota exhausted, try again later.",
+                                                         self.room.room_id)
+
+    async def test_prefetch_with_background_priority(self):
+        self._mock_forecast_response()
+        budget = Mock()
+        budget.try_acquire.return_value = True
+        self.weather.budget = budget
+        self.database.fetchall.return_value = [("59.3293", "18.0686")]
+
+        await self.weather._prefetch(interval_seconds=60)
+
+        budget.try_acquire.assert_called_once_with(Weather.budget_service, BudgetManager.BACKGROUND)
+
+    def _mock_forecast_response(self):
+        response = Mock()
+        response.json.return_value = {
+            "current": {"temp": 2, "weather": [{"description": "snow"}]},
+            "daily": [{"temp": {"min": 1, "max": 3}, "weather": [{"description": "snow"}]},
+                      {"temp": {"min": 4, "max": 6}, "weather": [{"description": "rain"}]}],
+        }
+        self.http_client.get.return_value = response
+        return response
 
     async def test_max_two_digits_in_lat_and_long_when_adding_coordinates(self):
         latitude, longitude = 111, 5